@@ -3,3 +3,16 @@ collect_ignore_glob = [
   "opendbc/safety/tests/misra/*.sh",
   "opendbc/safety/tests/misra/cppcheck/",
 ]
+
+
+def pytest_configure(config):
+  # keep the compiled DBC cache of test runs out of the user's cache
+  import tempfile
+  from opendbc.can import dbc
+  config._dbc_cache_dir = tempfile.TemporaryDirectory(prefix="opendbc-dbc-cache-")
+  dbc.DBC_CACHE_DIR = config._dbc_cache_dir.name
+
+
+def pytest_unconfigure(config):
+  if hasattr(config, "_dbc_cache_dir"):
+    config._dbc_cache_dir.cleanup()
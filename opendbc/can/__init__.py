@@ -1,8 +1,10 @@
 from opendbc.can.packer import CANPacker
-from opendbc.can.parser import CANParser, CANDefine
+from opendbc.can.parser import CANParser, CANDefine, CANDemux, MultiBusCANParser
 
 __all__ = [
   "CANDefine",
+  "CANDemux",
   "CANParser",
   "CANPacker",
+  "MultiBusCANParser",
 ]
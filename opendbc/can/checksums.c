@@ -0,0 +1,230 @@
+// Compiled versions of the checksum functions wired up in opendbc/can/dbc.py:get_checksum_state.
+// Each one must match its Python counterpart bit for bit, see opendbc/can/tests/test_checksums.py.
+
+#include <stdbool.h>
+#include <stdint.h>
+
+static uint8_t crc8_h2f[256];
+static uint8_t crc8_j1850[256];
+static uint16_t crc16_xmodem[256];
+
+static void gen_crc8_table(uint8_t *table, uint8_t poly) {
+  for (int i = 0; i < 256; i++) {
+    uint8_t crc = (uint8_t)i;
+    for (int j = 0; j < 8; j++) {
+      if ((crc & 0x80U) != 0U) {
+        crc = (uint8_t)((crc << 1) ^ poly);
+      } else {
+        crc = (uint8_t)(crc << 1);
+      }
+    }
+    table[i] = crc;
+  }
+}
+
+static void gen_crc16_table(uint16_t *table, uint16_t poly) {
+  for (int i = 0; i < 256; i++) {
+    uint16_t crc = (uint16_t)(i << 8);
+    for (int j = 0; j < 8; j++) {
+      if ((crc & 0x8000U) != 0U) {
+        crc = (uint16_t)((crc << 1) ^ poly);
+      } else {
+        crc = (uint16_t)(crc << 1);
+      }
+    }
+    table[i] = crc;
+  }
+}
+
+void checksums_init(void) {
+  gen_crc8_table(crc8_h2f, 0x2FU);
+  gen_crc8_table(crc8_j1850, 0x1DU);
+  gen_crc16_table(crc16_xmodem, 0x1021U);
+}
+
+static int sum_address_bytes(uint32_t address) {
+  int s = 0;
+  while (address > 0U) {
+    s += (int)(address & 0xFFU);
+    address >>= 8;
+  }
+  return s;
+}
+
+int honda_checksum(uint32_t address, const uint8_t *dat, int len) {
+  int s = 0;
+  bool extended = address > 0x7FFU;
+  while (address > 0U) {
+    s += (int)(address & 0xFU);
+    address >>= 4;
+  }
+  for (int i = 0; i < len; i++) {
+    uint8_t x = dat[i];
+    if (i == (len - 1)) {
+      x >>= 4;
+    }
+    s += (x & 0xF) + (x >> 4);
+  }
+  s = 8 - s;
+  if (extended) {
+    s += 3;
+  }
+  return s & 0xF;
+}
+
+int toyota_checksum(uint32_t address, const uint8_t *dat, int len) {
+  int s = len + sum_address_bytes(address);
+  for (int i = 0; i < (len - 1); i++) {
+    s += dat[i];
+  }
+  return s & 0xFF;
+}
+
+int subaru_checksum(uint32_t address, const uint8_t *dat, int len) {
+  int s = sum_address_bytes(address);
+  for (int i = 1; i < len; i++) {
+    s += dat[i];
+  }
+  return s & 0xFF;
+}
+
+int chrysler_checksum(uint32_t address, const uint8_t *dat, int len) {
+  (void)address;
+  uint8_t checksum = 0xFFU;
+  for (int j = 0; j < (len - 1); j++) {
+    uint8_t curr = dat[j];
+    uint8_t shift = 0x80U;
+    for (int i = 0; i < 8; i++) {
+      uint8_t bit_sum = curr & shift;
+      uint8_t temp_chk = checksum & 0x80U;
+      if (bit_sum != 0U) {
+        bit_sum = (temp_chk != 0U) ? 1U : 0x1CU;
+        checksum = (uint8_t)(checksum << 1);
+        temp_chk = checksum | 1U;
+        bit_sum ^= temp_chk;
+      } else {
+        bit_sum = (temp_chk != 0U) ? 0x1DU : 0U;
+        checksum = (uint8_t)(checksum << 1);
+        bit_sum ^= checksum;
+      }
+      checksum = bit_sum;
+      shift >>= 1;
+    }
+  }
+  return (uint8_t)(~checksum);
+}
+
+int fca_giorgio_checksum(uint32_t address, const uint8_t *dat, int len) {
+  uint8_t crc = 0U;
+  for (int i = 0; i < (len - 1); i++) {
+    crc = crc8_j1850[crc ^ dat[i]];
+  }
+  if (address == 0xDEU) {
+    crc ^= 0x10U;
+  } else if (address == 0x106U) {
+    crc ^= 0xF6U;
+  } else if (address == 0x122U) {
+    crc ^= 0xF1U;
+  } else {
+    crc ^= 0x0AU;
+  }
+  return crc;
+}
+
+int fiat_fastback_checksum(uint32_t address, const uint8_t *dat, int len) {
+  // DAS_1 has the checksum on the byte before the last
+  int skip = (address == 0x2FAU) ? 2 : 1;
+  uint8_t crc = 0xFFU;
+  for (int i = 0; i < (len - skip); i++) {
+    crc = crc8_j1850[crc ^ dat[i]];
+  }
+  return crc ^ 0xFFU;
+}
+
+int hkg_can_fd_checksum(uint32_t address, const uint8_t *dat, int len) {
+  uint16_t crc = 0U;
+  for (int i = 2; i < len; i++) {
+    crc = (uint16_t)((crc << 8) ^ crc16_xmodem[(crc >> 8) ^ dat[i]]);
+  }
+  crc = (uint16_t)((crc << 8) ^ crc16_xmodem[(crc >> 8) ^ (address & 0xFFU)]);
+  crc = (uint16_t)((crc << 8) ^ crc16_xmodem[(crc >> 8) ^ ((address >> 8) & 0xFFU)]);
+  if (len == 8) {
+    crc ^= 0x5F29U;
+  } else if (len == 16) {
+    crc ^= 0x041DU;
+  } else if (len == 24) {
+    crc ^= 0x819DU;
+  } else if (len == 32) {
+    crc ^= 0x9F5BU;
+  } else {
+  }
+  return crc;
+}
+
+// magic is the per-address, per-counter constant, or -1 if the address has none
+int volkswagen_mqb_meb_checksum(const uint8_t *dat, int len, int magic) {
+  uint8_t crc = 0xFFU;
+  for (int i = 1; i < len; i++) {
+    crc = crc8_h2f[crc ^ dat[i]];
+  }
+  if (magic >= 0) {
+    crc = crc8_h2f[crc ^ (uint8_t)magic];
+  }
+  return crc ^ 0xFFU;
+}
+
+int xor_checksum(const uint8_t *dat, int len, int checksum_byte, int initial_value) {
+  int checksum = initial_value;
+  for (int i = 0; i < len; i++) {
+    if (i != checksum_byte) {
+      checksum ^= dat[i];
+    }
+  }
+  return checksum;
+}
+
+int tesla_checksum(uint32_t address, const uint8_t *dat, int len, int checksum_byte) {
+  int checksum = (int)(address & 0xFFU) + (int)((address >> 8) & 0xFFU);
+  for (int i = 0; i < len; i++) {
+    if (i != checksum_byte) {
+      checksum += dat[i];
+    }
+  }
+  return checksum & 0xFF;
+}
+
+int body_checksum(uint32_t address, const uint8_t *dat, int len) {
+  (void)address;
+  uint8_t crc = 0xFFU;
+  for (int i = len - 2; i >= 0; i--) {
+    crc ^= dat[i];
+    for (int j = 0; j < 8; j++) {
+      if ((crc & 0x80U) != 0U) {
+        crc = (uint8_t)((crc << 1) ^ 0xD5U);
+      } else {
+        crc = (uint8_t)(crc << 1);
+      }
+    }
+  }
+  return crc;
+}
+
+int psa_checksum(uint32_t address, const uint8_t *dat, int len, int start_bit) {
+  int chk_ini = 0xB;
+  if (address == 0x452U) {
+    chk_ini = 0x4;
+  } else if (address == 0x38DU) {
+    chk_ini = 0x7;
+  } else if (address == 0x42DU) {
+    chk_ini = 0xC;
+  } else {
+  }
+  int checksum_byte = start_bit / 8;
+  uint8_t checksum_mask = ((start_bit % 8) >= 4) ? 0x0FU : 0xF0U;
+  int checksum = 0;
+  for (int i = 0; i < len; i++) {
+    uint8_t b = (i == checksum_byte) ? (dat[i] & checksum_mask) : dat[i];
+    checksum += (b >> 4) + (b & 0xF);
+  }
+  return (chk_ini - checksum) & 0xF;
+}
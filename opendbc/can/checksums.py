@@ -0,0 +1,96 @@
+import os
+
+from opendbc.car.volkswagen.mlbcan import VOLKSWAGEN_MLB_XOR_STARTING_VALUES
+from opendbc.car.volkswagen.mqbcan import VOLKSWAGEN_MQB_MEB_CONSTANTS
+
+# Compiled checksum kernels from checksums.c, built by scons. When the library
+# or cffi isn't available, dbc.py keeps using the pure-Python checksum functions.
+
+LIBCHECKSUMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libchecksums.so")
+
+try:
+  from cffi import FFI
+except ImportError:
+  FFI = None
+
+ffi = None
+lib = None
+if FFI is not None and os.path.exists(LIBCHECKSUMS_PATH):
+  ffi = FFI()
+  ffi.cdef("""
+  void checksums_init(void);
+  int honda_checksum(uint32_t address, const char *dat, int len);
+  int toyota_checksum(uint32_t address, const char *dat, int len);
+  int subaru_checksum(uint32_t address, const char *dat, int len);
+  int chrysler_checksum(uint32_t address, const char *dat, int len);
+  int fca_giorgio_checksum(uint32_t address, const char *dat, int len);
+  int fiat_fastback_checksum(uint32_t address, const char *dat, int len);
+  int hkg_can_fd_checksum(uint32_t address, const char *dat, int len);
+  int volkswagen_mqb_meb_checksum(const char *dat, int len, int magic);
+  int xor_checksum(const char *dat, int len, int checksum_byte, int initial_value);
+  int tesla_checksum(uint32_t address, const char *dat, int len, int checksum_byte);
+  int body_checksum(uint32_t address, const char *dat, int len);
+  int psa_checksum(uint32_t address, const char *dat, int len, int start_bit);
+  """)
+  lib = ffi.dlopen(LIBCHECKSUMS_PATH)
+  lib.checksums_init()
+
+
+def _buf(d):
+  # bytes can be passed straight through to a const char *, anything else is wrapped without copying
+  return d if type(d) is bytes else ffi.from_buffer(d)
+
+
+def honda_checksum(address: int, sig, d) -> int:
+  return lib.honda_checksum(address, _buf(d), len(d))
+
+
+def toyota_checksum(address: int, sig, d) -> int:
+  return lib.toyota_checksum(address, _buf(d), len(d))
+
+
+def subaru_checksum(address: int, sig, d) -> int:
+  return lib.subaru_checksum(address, _buf(d), len(d))
+
+
+def chrysler_checksum(address: int, sig, d) -> int:
+  return lib.chrysler_checksum(address, _buf(d), len(d))
+
+
+def fca_giorgio_checksum(address: int, sig, d) -> int:
+  return lib.fca_giorgio_checksum(address, _buf(d), len(d))
+
+
+def fiat_fastback_checksum(address: int, sig, d) -> int:
+  return lib.fiat_fastback_checksum(address, _buf(d), len(d))
+
+
+def hkg_can_fd_checksum(address: int, sig, d) -> int:
+  return lib.hkg_can_fd_checksum(address, _buf(d), len(d))
+
+
+def volkswagen_mqb_meb_checksum(address: int, sig, d) -> int:
+  const = VOLKSWAGEN_MQB_MEB_CONSTANTS.get(address)
+  return lib.volkswagen_mqb_meb_checksum(_buf(d), len(d), const[d[1] & 0x0F] if const else -1)
+
+
+def xor_checksum(address: int, sig, d, initial_value: int = 0) -> int:
+  return lib.xor_checksum(_buf(d), len(d), sig.start_bit // 8, initial_value)
+
+
+def volkswagen_mlb_checksum(address: int, sig, d) -> int:
+  if address in VOLKSWAGEN_MLB_XOR_STARTING_VALUES:
+    return lib.xor_checksum(_buf(d), len(d), sig.start_bit // 8, VOLKSWAGEN_MLB_XOR_STARTING_VALUES[address])
+  return volkswagen_mqb_meb_checksum(address, sig, d)
+
+
+def tesla_checksum(address: int, sig, d) -> int:
+  return lib.tesla_checksum(address, _buf(d), len(d), sig.start_bit // 8)
+
+
+def body_checksum(address: int, sig, d) -> int:
+  return lib.body_checksum(address, _buf(d), len(d))
+
+
+def psa_checksum(address: int, sig, d) -> int:
+  return lib.psa_checksum(address, _buf(d), len(d), sig.start_bit)
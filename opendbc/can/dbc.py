@@ -1,6 +1,10 @@
 import re
 import os
-from collections.abc import Callable
+import mmap
+import struct
+import hashlib
+import tempfile
+from collections.abc import Callable, Iterator, Mapping
 from dataclasses import dataclass
 from functools import cache
 
@@ -18,6 +22,7 @@ from opendbc.car.volkswagen.mqbcan import volkswagen_mqb_meb_checksum, xor_check
 from opendbc.car.tesla.teslacan import tesla_checksum
 from opendbc.car.body.bodycan import body_checksum
 from opendbc.car.psa.psacan import psa_checksum
+from opendbc.can import checksums
 
 
 class SignalType:
@@ -38,6 +43,24 @@ class SignalType:
   FIAT_FASTBACK_CHECKSUM = 14
 
 
+# compiled checksum kernels by signal type, empty if libchecksums isn't built
+NATIVE_CHECKSUMS: dict[int, Callable] = {} if checksums.lib is None else {
+  SignalType.HONDA_CHECKSUM: checksums.honda_checksum,
+  SignalType.TOYOTA_CHECKSUM: checksums.toyota_checksum,
+  SignalType.BODY_CHECKSUM: checksums.body_checksum,
+  SignalType.VOLKSWAGEN_MQB_MEB_CHECKSUM: checksums.volkswagen_mqb_meb_checksum,
+  SignalType.XOR_CHECKSUM: checksums.xor_checksum,
+  SignalType.SUBARU_CHECKSUM: checksums.subaru_checksum,
+  SignalType.CHRYSLER_CHECKSUM: checksums.chrysler_checksum,
+  SignalType.HKG_CAN_FD_CHECKSUM: checksums.hkg_can_fd_checksum,
+  SignalType.FCA_GIORGIO_CHECKSUM: checksums.fca_giorgio_checksum,
+  SignalType.TESLA_CHECKSUM: checksums.tesla_checksum,
+  SignalType.PSA_CHECKSUM: checksums.psa_checksum,
+  SignalType.VOLKSWAGEN_MLB_CHECKSUM: checksums.volkswagen_mlb_checksum,
+  SignalType.FIAT_FASTBACK_CHECKSUM: checksums.fiat_fastback_checksum,
+}
+
+
 @dataclass
 class Signal:
   name: str
@@ -50,7 +73,20 @@ class Signal:
   offset: float
   is_little_endian: bool
   type: int = SignalType.DEFAULT
-  calc_checksum: 'Callable[[int, Signal, bytearray], int] | None' = None
+  calc_checksum: 'Callable[[int, Signal, bytes | bytearray | memoryview], int] | None' = None
+
+
+def get_signal_shift(sig: Signal, size: int) -> tuple[bool, int] | None:
+  """
+  Locate a signal in a payload of `size` bytes read as a single int, in the signal's byte order.
+  Returns (big_endian, shift of the signal's lsb), or None if the signal doesn't fit in the payload.
+  """
+  if not (0 <= sig.lsb < size * 8 and 0 <= sig.msb < size * 8):
+    return None
+  if sig.is_little_endian:
+    return False, sig.lsb
+  # Motorola bit (byte, bit) maps to (size - 1 - byte) * 8 + bit in the big-endian int
+  return True, (size - 1 - sig.lsb // 8) * 8 + sig.lsb % 8
 
 
 @dataclass
@@ -74,84 +110,288 @@ SG_RE = re.compile(r"^SG_ (\w+) : (\d+)\|(\d+)@(\d)([+-]) \(([0-9.+\-eE]+),([0-9
 SGM_RE = re.compile(r"^SG_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d)([+-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[[0-9.+\-eE]+\|[0-9.+\-eE]+\] \".*\" .*")
 VAL_RE = re.compile(r"^VAL_ (\w+) (\w+) (.*);")
 VAL_SPLIT_RE = re.compile(r'["]+')
+BO_LINE_RE = re.compile(rb"^[ \t\r\x0b\x0c]*BO_ [^\n]*", re.MULTILINE)
+
+BE_BITS = [j + i * 8 for i in range(64) for j in range(7, -1, -1)]
+BE_BITS_IDX = {b: i for i, b in enumerate(BE_BITS)}
+
+# Parsed DBC tables, before checksum setup is applied:
+# messages: (address, name, size) in file order
+# signals: (message index, name, start_bit, msb, lsb, size, is_signed, factor, offset, is_little_endian, line_num)
+# vals: (address, signal name, def_val)
+MsgRecord = tuple[int, str, int]
+SignalRecord = tuple[int, str, int, int, int, int, bool, float, float, bool, int]
+ValRecord = tuple[int, str, str]
+
+# ***** compiled DBC cache *****
+# Parsed DBC tables are stored in a compact binary file per DBC path, keyed on the source's mtime and size.
+# Checksum and counter setup is applied on load, so the cache never goes stale when get_checksum_state changes.
+
+DBC_CACHE_VERSION = 1
+DBC_CACHE_DIR = os.environ.get("DBC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "opendbc", "dbc"))
+DISABLE_DBC_CACHE = os.environ.get("DISABLE_DBC_CACHE") == "1"
+
+CACHE_MAGIC = b"ODBC"
+CACHE_HEADER = struct.Struct("<4sHqqIII")  # magic, version, source mtime_ns, source size, messages, signals, vals
+CACHE_MSG = struct.Struct("<IIH")  # address, name, size
+CACHE_SIGNAL = struct.Struct("<IIHHHH?dd?I")  # message index, name, start_bit, msb, lsb, size, is_signed, factor, offset, is_little_endian, line_num
+CACHE_VAL = struct.Struct("<III")  # address, name, def_val
+
+
+def get_dbc_cache_path(path: str, cache_dir: str) -> str:
+  path_hash = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+  return os.path.join(cache_dir, f"{os.path.basename(path).replace('.dbc', '')}-{path_hash}.bin")
+
+
+def write_dbc_cache(path: str, cache_dir: str, msgs: list[MsgRecord], sigs: list[SignalRecord], vals: list[ValRecord]) -> None:
+  st = os.stat(path)
+  strings: dict[str, int] = {}
+
+  def intern(s: str) -> int:
+    return strings.setdefault(s, len(strings))
+
+  data = bytearray(CACHE_HEADER.pack(CACHE_MAGIC, DBC_CACHE_VERSION, st.st_mtime_ns, st.st_size, len(msgs), len(sigs), len(vals)))
+  for address, name, size in msgs:
+    data += CACHE_MSG.pack(address, intern(name), size)
+  for msg_idx, name, *rest in sigs:
+    data += CACHE_SIGNAL.pack(msg_idx, intern(name), *rest)
+  for address, name, def_val in vals:
+    data += CACHE_VAL.pack(address, intern(name), intern(def_val))
+  data += b"\0".join(s.encode() for s in strings)
+
+  cache_path = get_dbc_cache_path(path, cache_dir)
+  tmp_path = None
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    # a unique temp file, so concurrent writers from any process or thread never replace a partially written cache
+    with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=f"{os.path.basename(cache_path)}.", suffix=".tmp", delete=False) as f:
+      tmp_path = f.name
+      f.write(data)
+    # temp files are created private
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, cache_path)
+  except OSError:
+    # the cache is best-effort, e.g. on a read-only filesystem
+    if tmp_path is not None and os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+
+def read_dbc_cache(path: str, cache_dir: str) -> tuple[list[MsgRecord], list[SignalRecord], list[ValRecord]] | None:
+  try:
+    st = os.stat(path)
+    with open(get_dbc_cache_path(path, cache_dir), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      magic, version, mtime_ns, src_size, n_msgs, n_sigs, n_vals = CACHE_HEADER.unpack_from(mm)
+      if (magic, version, mtime_ns, src_size) != (CACHE_MAGIC, DBC_CACHE_VERSION, st.st_mtime_ns, st.st_size):
+        return None
+
+      pos = CACHE_HEADER.size
+      msgs_end = pos + n_msgs * CACHE_MSG.size
+      sigs_end = msgs_end + n_sigs * CACHE_SIGNAL.size
+      vals_end = sigs_end + n_vals * CACHE_VAL.size
+      strings = [s.decode() for s in mm[vals_end:].split(b"\0")]
+
+      msgs = [(address, strings[name], size) for address, name, size in CACHE_MSG.iter_unpack(mm[pos:msgs_end])]
+      sigs = [(msg_idx, strings[name], *rest) for msg_idx, name, *rest in CACHE_SIGNAL.iter_unpack(mm[msgs_end:sigs_end])]
+      vals = [(address, strings[name], strings[def_val]) for address, name, def_val in CACHE_VAL.iter_unpack(mm[sigs_end:vals_end])]
+  except (OSError, ValueError, IndexError, struct.error, UnicodeDecodeError):
+    return None
+  return msgs, sigs, vals
+
+
+def parse_message_line(line: str) -> MsgRecord | None:
+  m = BO_RE.match(line)
+  if not m:
+    return None
+  return int(m.group(1), 0), m.group(2), int(m.group(3), 0)
+
+
+def parse_signal_line(line: str) -> tuple[str, int, int, int, int, bool, float, float, bool] | None:
+  m = SG_RE.search(line)
+  offset = 0
+  if not m:
+    m = SGM_RE.search(line)
+    if not m:
+      return None
+    offset = 1
+  sig_name = m.group(1)
+  start_bit = int(m.group(2 + offset))
+  size = int(m.group(3 + offset))
+  is_little_endian = m.group(4 + offset) == "1"
+  is_signed = m.group(5 + offset) == "-"
+  factor = float(m.group(6 + offset))
+  offset_val = float(m.group(7 + offset))
+
+  if is_little_endian:
+    lsb = start_bit
+    msb = start_bit + size - 1
+  else:
+    lsb = BE_BITS[BE_BITS_IDX[start_bit] + size - 1]
+    msb = start_bit
+  return sig_name, start_bit, msb, lsb, size, is_signed, factor, offset_val, is_little_endian
+
+
+def parse_val_line(line: str) -> ValRecord | None:
+  m = VAL_RE.search(line)
+  if not m:
+    return None
+  val_addr = int(m.group(1), 0)
+  sgname = m.group(2)
+  defs = m.group(3)
+  words = [w.strip() for w in VAL_SPLIT_RE.split(defs) if w.strip()]
+  words = [w.upper().replace(" ", "_") for w in words]
+  val_def = " ".join(words).strip()
+  return val_addr, sgname, val_def
+
+
+def parse_dbc_file(path: str) -> tuple[list[MsgRecord], list[SignalRecord], list[ValRecord]]:
+  with open(path) as f:
+    lines = f.readlines()
+
+  msgs: list[MsgRecord] = []
+  sigs: list[SignalRecord] = []
+  vals: list[ValRecord] = []
+  for line_num, line in enumerate(lines, 1):
+    line = line.strip()
+    if line.startswith("BO_ "):
+      msg = parse_message_line(line)
+      if msg is not None:
+        msgs.append(msg)
+    elif line.startswith("SG_ "):
+      sig = parse_signal_line(line)
+      if sig is None:
+        continue
+      if not msgs:
+        raise KeyError(0)
+      sigs.append((len(msgs) - 1, *sig, line_num))
+    elif line.startswith("VAL_ "):
+      val = parse_val_line(line)
+      if val is not None:
+        vals.append(val)
+  return msgs, sigs, vals
+
+
+class LazyMessages(Mapping):
+  """Read-only view of a lazy DBC's messages, building each message on first lookup."""
+  def __init__(self, dbc: 'DBC', index: dict):
+    self.dbc = dbc
+    self.index = index
+
+  def __getitem__(self, key) -> Msg:
+    return self.dbc._load_message(self.index[key])
+
+  def __contains__(self, key) -> bool:
+    return key in self.index
+
+  def __iter__(self) -> Iterator:
+    return iter(self.index)
+
+  def __len__(self) -> int:
+    return len(self.index)
 
 
 @cache
 class DBC:
-  def __init__(self, name: str):
+  def __init__(self, name: str, lazy: bool = False):
     dbc_path = name
     if not os.path.exists(dbc_path):
       dbc_path = os.path.join(DBC_PATH, name + ".dbc")
 
-    self._parse(dbc_path)
+    if lazy:
+      self._index(dbc_path)
+    else:
+      self._parse(dbc_path, DBC_CACHE_DIR)
+
+  @property
+  def vals(self) -> list[Val]:
+    if self._vals is None:
+      self._vals = [Val(name, address, def_val) for address, name, def_val in parse_dbc_file(self._path)[2]]
+    return self._vals
 
-  def _parse(self, path: str):
+  def _parse(self, path: str, cache_dir: str | None):
     self.name = os.path.basename(path).replace(".dbc", "")
-    with open(path) as f:
-      lines = f.readlines()
+    self._path = path
 
+    tables = None
+    if cache_dir is not None and not DISABLE_DBC_CACHE:
+      tables = read_dbc_cache(path, cache_dir)
+    if tables is None:
+      tables = parse_dbc_file(path)
+      if cache_dir is not None and not DISABLE_DBC_CACHE:
+        write_dbc_cache(path, cache_dir, *tables)
+    self._build(*tables)
+
+  def _build(self, msg_records: list[MsgRecord], sig_records: list[SignalRecord], val_records: list[ValRecord]):
     checksum_state = get_checksum_state(self.name)
-    be_bits = [j + i * 8 for i in range(64) for j in range(7, -1, -1)]
-    self.msgs: dict[int, Msg] = {}
-    self.addr_to_msg: dict[int, Msg] = {}
-    self.name_to_msg: dict[str, Msg] = {}
-    self.vals: list[Val] = []
-    address = 0
-    signals_temp: dict[int, dict[str, Signal]] = {}
-    for line_num, line in enumerate(lines, 1):
+    self._vals: list[Val] | None = [Val(name, address, def_val) for address, name, def_val in val_records]
+
+    msgs = [Msg(msg_name, address, size, {}) for address, msg_name, size in msg_records]
+    self.msgs: Mapping[int, Msg] = {msg.address: msg for msg in msgs}
+    self.addr_to_msg: Mapping[int, Msg] = dict(self.msgs)
+    self.name_to_msg: Mapping[str, Msg] = {msg.name: msg for msg in msgs}
+
+    for msg_idx, *fields, line_num in sig_records:
+      sig = Signal(*fields)
+      set_signal_type(sig, checksum_state, self.name, line_num)
+      msgs[msg_idx].sigs[sig.name] = sig
+
+  def _index(self, path: str):
+    """
+    Lazy mode: only record where each BO_ section is in the file, and parse its
+    signals the first time the message is looked up. vals are parsed on first access.
+    The file stays memory-mapped, so a lookup doesn't reopen it.
+    """
+    self.name = os.path.basename(path).replace(".dbc", "")
+    self._path = path
+    self._vals = None
+    self._checksum_state = get_checksum_state(self.name)
+
+    # (address, name, size, body start offset, body first line number, body end offset)
+    self._sections: list[tuple[int, str, int, int, int, int]] = []
+    self._loaded: dict[int, Msg] = {}
+    addr_index: dict[int, int] = {}
+    name_index: dict[str, int] = {}
+
+    # kept mapped for the DBC's lifetime, message bodies are read as slices of it
+    with open(path, "rb") as f:
+      self._data: mmap.mmap | bytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+    data = self._data
+    line_num = 1
+    line_start = 0
+    for m in BO_LINE_RE.finditer(data):
+      msg = parse_message_line(m.group(0).strip().decode())
+      if msg is None:
+        continue
+      line_num += data[line_start:m.start()].count(b"\n")
+      line_start = m.start()
+      if self._sections:
+        self._sections[-1] = (*self._sections[-1][:5], m.start())
+      addr_index[msg[0]] = name_index[msg[1]] = len(self._sections)
+      self._sections.append((*msg, m.end() + 1, line_num + 1, len(data)))
+
+    self.msgs = LazyMessages(self, addr_index)
+    self.addr_to_msg = self.msgs
+    self.name_to_msg = LazyMessages(self, name_index)
+
+  def _load_message(self, idx: int) -> Msg:
+    msg = self._loaded.get(idx)
+    if msg is not None:
+      return msg
+
+    address, msg_name, size, start, first_line_num, end = self._sections[idx]
+    body = self._data[start:end].decode()
+
+    sigs: dict[str, Signal] = {}
+    for line_num, line in enumerate(body.split("\n"), first_line_num):
       line = line.strip()
-      if line.startswith("BO_ "):
-        m = BO_RE.match(line)
-        if not m:
-          continue
-        address = int(m.group(1), 0)
-        msg_name = m.group(2)
-        size = int(m.group(3), 0)
-        sigs = {}
-        self.msgs[address] = Msg(msg_name, address, size, sigs)
-        self.addr_to_msg[address] = self.msgs[address]
-        self.name_to_msg[msg_name] = self.msgs[address]
-        signals_temp[address] = sigs
-      elif line.startswith("SG_ "):
-        m = SG_RE.search(line)
-        offset = 0
-        if not m:
-          m = SGM_RE.search(line)
-          if not m:
-            continue
-          offset = 1
-        sig_name = m.group(1)
-        start_bit = int(m.group(2 + offset))
-        size = int(m.group(3 + offset))
-        is_little_endian = m.group(4 + offset) == "1"
-        is_signed = m.group(5 + offset) == "-"
-        factor = float(m.group(6 + offset))
-        offset_val = float(m.group(7 + offset))
-
-        if is_little_endian:
-          lsb = start_bit
-          msb = start_bit + size - 1
-        else:
-          idx = be_bits.index(start_bit)
-          lsb = be_bits[idx + size - 1]
-          msb = start_bit
-
-        sig = Signal(sig_name, start_bit, msb, lsb, size, is_signed, factor, offset_val, is_little_endian)
-        set_signal_type(sig, checksum_state, self.name, line_num)
-        signals_temp[address][sig_name] = sig
-      elif line.startswith("VAL_ "):
-        m = VAL_RE.search(line)
-        if not m:
-          continue
-        val_addr = int(m.group(1), 0)
-        sgname = m.group(2)
-        defs = m.group(3)
-        words = [w.strip() for w in VAL_SPLIT_RE.split(defs) if w.strip()]
-        words = [w.upper().replace(" ", "_") for w in words]
-        val_def = " ".join(words).strip()
-        self.vals.append(Val(sgname, val_addr, val_def))
-    for addr, sigs in signals_temp.items():
-      self.msgs[addr].sigs = sigs
+      if line.startswith("SG_ "):
+        fields = parse_signal_line(line)
+        if fields is not None:
+          sig = Signal(*fields)
+          set_signal_type(sig, self._checksum_state, self.name, line_num)
+          sigs[sig.name] = sig
+
+    msg = self._loaded[idx] = Msg(msg_name, address, size, sigs)
+    return msg
 
 
 # ***** checksum functions *****
@@ -216,3 +456,5 @@ def set_signal_type(sig: Signal, chk: ChecksumState | None, dbc_name: str, line_
       sig.calc_checksum = chk.calc_checksum
     elif sig.name == "COUNTER":
       sig.type = SignalType.COUNTER
+  if sig.calc_checksum is not None:
+    sig.calc_checksum = NATIVE_CHECKSUMS.get(sig.type, sig.calc_checksum)
@@ -1,20 +1,145 @@
 import math
+from collections.abc import Iterable
+from dataclasses import dataclass
 
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal, SignalType
+from opendbc.can.dbc import DBC, Msg, Signal, SignalType, get_signal_shift
+
+
+@dataclass
+class MessageEncoder:
+  msg: Msg
+  # signal name -> (signal, big_endian, shift, mask), see get_signal_encoder
+  signals: dict[str, tuple[Signal, bool, int, int]]
+  counter_names: frozenset[str]
+  counter: Signal | None
+  checksum: Signal | None
+  # whether every signal fits the payload, otherwise fall back to set_value
+  compiled: bool
+
+  @classmethod
+  def compile(cls, msg: Msg) -> 'MessageEncoder':
+    signals = {name: get_signal_encoder(sig, msg.size) for name, sig in msg.sigs.items()}
+    counters = [s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"]
+    checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
+    return cls(
+      msg=msg,
+      signals={name: (msg.sigs[name], *enc) for name, enc in signals.items() if enc is not None},
+      counter_names=frozenset(s.name for s in counters),
+      counter=counters[0] if counters else None,
+      checksum=checksum if checksum is not None and checksum.calc_checksum is not None else None,
+      compiled=None not in signals.values(),
+    )
 
 
 class CANPacker:
   def __init__(self, dbc_name: str):
     self.dbc = DBC(dbc_name)
     self.counters: dict[int, int] = {}
+    self.encoders: dict[int, MessageEncoder] = {}
+
+  def get_encoder(self, address: int) -> MessageEncoder | None:
+    enc = self.encoders.get(address)
+    if enc is None:
+      msg = self.dbc.addr_to_msg.get(address)
+      if msg is None:
+        return None
+      enc = self.encoders[address] = MessageEncoder.compile(msg)
+    return enc
 
   def pack(self, address: int, values: dict[str, float]) -> bytearray:
-    msg = self.dbc.addr_to_msg.get(address)
-    if msg is None:
+    enc = self.get_encoder(address)
+    if enc is None:
       carlog.error(f"msg not found for {address=}")
       return bytearray()
-    dat = bytearray(msg.size)
+    if not enc.compiled:
+      return self._pack_slow(enc, values)
+    return bytearray(self._pack(enc, values))
+
+  def pack_into(self, address: int, values: dict[str, float], buf: bytearray | memoryview, offset: int = 0) -> int:
+    """
+    Pack a message straight into a caller-supplied writable buffer at `offset`, so a preallocated buffer can be reused
+    every cycle. The checksum is computed over and set in the written payload. Returns the number of bytes written,
+    0 if the message doesn't exist.
+    """
+    enc = self.get_encoder(address)
+    if enc is None:
+      carlog.error(f"msg not found for {address=}")
+      return 0
+    size = enc.msg.size
+    dat = memoryview(buf)[offset:offset + size]
+    if len(dat) < size:
+      raise ValueError(f"{size} bytes don't fit in a buffer of {len(buf)} bytes at offset {offset}")
+    if not enc.compiled:
+      self._pack_slow(enc, values, dat)
+      return size
+
+    payload, big_endian = self._encode(enc, values)
+    dat[:] = payload.to_bytes(size, "big" if big_endian else "little")
+    sig_checksum = enc.checksum
+    if sig_checksum:
+      set_value(dat, sig_checksum, sig_checksum.calc_checksum(address, sig_checksum, dat))
+    return size
+
+  def _encode(self, enc: MessageEncoder, values: dict[str, float]) -> tuple[int, bool]:
+    """Encode the values and counter into the payload as an int, returns it and the byte order it's held in"""
+    address = enc.msg.address
+    size = enc.msg.size
+    payload = 0
+    big_endian = False  # byte order payload is currently held in
+    counter_set = False
+    for name, value in values.items():
+      sig_enc = enc.signals.get(name)
+      if sig_enc is None:
+        carlog.error(f"unknown signal {name=} in {enc.msg.name}")
+        continue
+      sig, sig_big_endian, shift, mask = sig_enc
+      ival = int(math.floor((value - sig.offset) / sig.factor + 0.5))
+      if sig_big_endian != big_endian:
+        payload = swap_byte_order(payload, size, big_endian)
+        big_endian = sig_big_endian
+      payload = (payload & ~(mask << shift)) | ((ival & mask) << shift)
+      if name in enc.counter_names:
+        self.counters[address] = int(value)
+        counter_set = True
+
+    sig_counter = enc.counter
+    if sig_counter and not counter_set:
+      if address not in self.counters:
+        self.counters[address] = 0
+      _, sig_big_endian, shift, mask = enc.signals[sig_counter.name]
+      if sig_big_endian != big_endian:
+        payload = swap_byte_order(payload, size, big_endian)
+        big_endian = sig_big_endian
+      payload = (payload & ~(mask << shift)) | ((self.counters[address] & mask) << shift)
+      self.counters[address] = (self.counters[address] + 1) % (1 << sig_counter.size)
+    return payload, big_endian
+
+  def _pack(self, enc: MessageEncoder, values: dict[str, float]) -> bytes:
+    address = enc.msg.address
+    size = enc.msg.size
+    payload, big_endian = self._encode(enc, values)
+    dat = payload.to_bytes(size, "big" if big_endian else "little")
+    sig_checksum = enc.checksum
+    if sig_checksum:
+      # the checksum is computed over the immutable payload, then inserted like any other signal
+      checksum = sig_checksum.calc_checksum(address, sig_checksum, dat)
+      _, sig_big_endian, shift, mask = enc.signals[sig_checksum.name]
+      if sig_big_endian != big_endian:
+        payload = swap_byte_order(payload, size, big_endian)
+        big_endian = sig_big_endian
+      payload = (payload & ~(mask << shift)) | ((checksum & mask) << shift)
+      dat = payload.to_bytes(size, "big" if big_endian else "little")
+    return dat
+
+  def _pack_slow(self, enc: MessageEncoder, values: dict[str, float], dat: bytearray | memoryview | None = None) -> bytearray | memoryview:
+    """Set signals bit by bit, into dat if given"""
+    msg = enc.msg
+    address = msg.address
+    if dat is None:
+      dat = bytearray(msg.size)
+    else:
+      dat[:] = bytes(msg.size)
     counter_set = False
     for name, value in values.items():
       sig = msg.sigs.get(name)
@@ -25,21 +150,24 @@ class CANPacker:
       if ival < 0:
         ival = (1 << sig.size) + ival
       set_value(dat, sig, ival)
-      if sig.type == SignalType.COUNTER or sig.name == "COUNTER":
+      if name in enc.counter_names:
         self.counters[address] = int(value)
         counter_set = True
-    sig_counter = next((s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"), None)
+    sig_counter = enc.counter
     if sig_counter and not counter_set:
       if address not in self.counters:
         self.counters[address] = 0
       set_value(dat, sig_counter, self.counters[address])
       self.counters[address] = (self.counters[address] + 1) % (1 << sig_counter.size)
-    sig_checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
-    if sig_checksum and sig_checksum.calc_checksum:
+    sig_checksum = enc.checksum
+    if sig_checksum:
       checksum = sig_checksum.calc_checksum(address, sig_checksum, dat)
       set_value(dat, sig_checksum, checksum)
     return dat
 
+  def pack_many(self, msgs: Iterable[tuple[int, dict[str, float]]]) -> list[bytearray]:
+    return [self.pack(address, values) for address, values in msgs]
+
   def make_can_msg(self, name_or_addr, bus: int, values: dict[str, float]):
     if isinstance(name_or_addr, int):
       addr = name_or_addr
@@ -49,13 +177,38 @@ class CANPacker:
         carlog.error(f"msg not found for {name_or_addr=}")
         return 0, b'', bus
       addr = msg.address
-    dat = self.pack(addr, values)
-    if len(dat) == 0:
+    enc = self.get_encoder(addr)
+    if enc is None:
+      carlog.error(f"msg not found for address={addr}")
       return 0, b'', bus
-    return addr, bytes(dat), bus
+    # like a missing message, an empty payload isn't a frame to send
+    if enc.msg.size == 0:
+      return 0, b'', bus
+    if not enc.compiled:
+      return addr, bytes(self._pack_slow(enc, values)), bus
+    return addr, self._pack(enc, values), bus
+
+  def make_can_msgs(self, msgs: Iterable[tuple[str | int, int, dict[str, float]]]):
+    return [self.make_can_msg(name_or_addr, bus, values) for name_or_addr, bus, values in msgs]
+
+
+def get_signal_encoder(sig: Signal, size: int) -> tuple[bool, int, int] | None:
+  """
+  Precompute where to write a signal into a payload of `size` bytes held as a single int.
+  Returns (big_endian, shift, mask), or None if the signal doesn't fit in the payload.
+  """
+  pos = get_signal_shift(sig, size)
+  if pos is None:
+    return None
+  return *pos, (1 << sig.size) - 1
+
+
+def swap_byte_order(payload: int, size: int, big_endian: bool) -> int:
+  order, other = ("big", "little") if big_endian else ("little", "big")
+  return int.from_bytes(payload.to_bytes(size, order), other)
 
 
-def set_value(msg: bytearray, sig: Signal, ival: int) -> None:
+def set_value(msg: bytearray | memoryview, sig: Signal, ival: int) -> None:
   i = sig.lsb // 8
   bits = sig.size
   if sig.size < 64:
@@ -1,17 +1,23 @@
+import heapq
 import math
 import numbers
 from collections import defaultdict, deque
+from collections.abc import Hashable, Iterable, Iterator, Mapping, Sequence
 from dataclasses import dataclass, field
 
+import numpy as np
+
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal
+from opendbc.can.dbc import DBC, Signal, SignalType, get_signal_shift
+from opendbc.can.stats import MessageStats, MessageStatsSnapshot
+from opendbc.can.store import HistoryView, SignalStore, TimestampsView, ValuesView
 
 
 MAX_BAD_COUNTER = 5
 CAN_INVALID_CNT = 5
 
 
-def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
+def get_raw_value(dat: bytes | bytearray | memoryview, sig: Signal) -> int:
   ret = 0
   i = sig.msb // 8
   bits = sig.size
@@ -26,6 +32,71 @@ def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
   return ret
 
 
+def get_signal_decoder(sig: Signal, size: int) -> tuple[bool, int, int, int, float, float] | None:
+  """
+  Precompute how to extract a signal from a payload of `size` bytes read as a single int.
+  Returns (big_endian, shift, mask, sign_bit, factor, offset), or None if the signal doesn't fit in the payload.
+  """
+  pos = get_signal_shift(sig, size)
+  if pos is None:
+    return None
+  sign_bit = (1 << (sig.size - 1)) if sig.is_signed else 0
+  return *pos, (1 << sig.size) - 1, sign_bit, sig.factor, sig.offset
+
+
+def get_signal_mask(sig: Signal, size: int) -> int:
+  """Bits a signal occupies in a payload of `size` bytes read as a little endian int, see get_raw_value"""
+  ret = 0
+  i = sig.msb // 8
+  bits = sig.size
+  while 0 <= i < size and bits > 0:
+    lsb = sig.lsb if (sig.lsb // 8) == i else i * 8
+    msb = sig.msb if (sig.msb // 8) == i else (i + 1) * 8 - 1
+    ret |= ((1 << (msb - lsb + 1)) - 1) << lsb
+    bits -= msb - lsb + 1
+    i = i - 1 if sig.is_little_endian else i + 1
+  return ret
+
+
+def get_raw_value_batch(dat: np.ndarray, lengths: np.ndarray, sig: Signal) -> np.ndarray:
+  """Column-wise get_raw_value over a (frames, bytes) uint8 payload matrix, zero-padded past each frame's length."""
+  ret = np.zeros(len(dat), dtype=np.uint64)
+  i = sig.msb // 8
+  bits = sig.size
+  while 0 <= i < dat.shape[1] and bits > 0:
+    lsb = sig.lsb if (sig.lsb // 8) == i else i * 8
+    msb = sig.msb if (sig.msb // 8) == i else (i + 1) * 8 - 1
+    size = msb - lsb + 1
+    d = (dat[:, i].astype(np.uint64) >> np.uint64(lsb - (i * 8))) & np.uint64((1 << size) - 1)
+    ret |= d << np.uint64(bits - size)
+    bits -= size
+    i = i - 1 if sig.is_little_endian else i + 1
+
+  # little endian signals starting past the end of a short frame read as zero, see get_raw_value
+  if sig.is_little_endian:
+    ret[lengths <= sig.msb // 8] = 0
+  return ret
+
+
+def decode_signal_batch(dat: np.ndarray, lengths: np.ndarray, sig: Signal) -> np.ndarray:
+  """Decode one signal for every frame, with the same sign handling and scaling as MessageState.parse."""
+  raw = get_raw_value_batch(dat, lengths, sig)
+  if sig.is_signed:
+    if sig.size == 64:
+      raw = raw.view(np.int64)
+    else:
+      raw = raw.astype(np.int64) - (((raw >> np.uint64(sig.size - 1)) & np.uint64(1)) << np.uint64(sig.size)).astype(np.int64)
+  return raw * sig.factor + sig.offset
+
+
+@dataclass
+class DecodedMessage:
+  address: int
+  name: str
+  timestamps: np.ndarray
+  signals: dict[str, np.ndarray]
+
+
 @dataclass
 class MessageState:
   address: int
@@ -35,6 +106,8 @@ class MessageState:
   ignore_alive: bool = False
   ignore_checksum: bool = False
   ignore_counter: bool = False
+  keep_all_vals: bool = True
+  skip_unchanged: bool = False
   frequency: float = 0.0
   timeout_threshold: float = 1e5  # default to 1Hz threshold
   vals: list[float] = field(default_factory=list)
@@ -44,48 +117,130 @@ class MessageState:
   counter_fail: int = 0
   first_seen_nanos: int = 0
   last_warning_log_nanos: int = 0
+  # receive statistics, None unless the parser collects them
+  stats: MessageStats | None = field(default=None, repr=False)
+  decoders: list[tuple[bool, int, int, int, float, float]] = field(default_factory=list, init=False, repr=False)
+  signal_names: list[str] = field(default_factory=list, init=False, repr=False)
+  checksum_idxs: list[int] = field(default_factory=list, init=False, repr=False)
+  counter_idxs: list[int] = field(default_factory=list, init=False, repr=False)
+  # change detection: payload bits outside the counter and checksum signals, and their value in the last good frame
+  volatile_idxs: list[int] = field(default_factory=list, init=False, repr=False)
+  unchanged_mask: int = field(default=0, init=False, repr=False)
+  last_payload: int | None = field(default=None, init=False, repr=False)
+  raw_vals: list[int] = field(default_factory=list, init=False, repr=False)
+  unchanged: bool = field(default=False, init=False, repr=False)
+
+  def __post_init__(self) -> None:
+    self.compile()
+
+  def compile(self) -> None:
+    """Build the per-signal decode plan once, so parse() only does shifts and masks per frame."""
+    decoders = [get_signal_decoder(sig, self.size) for sig in self.signals]
+    # any signal that doesn't fit the payload falls back to get_raw_value for the whole message
+    self.decoders = decoders if None not in decoders else []
+    self.signal_names = [sig.name for sig in self.signals]
+    self.checksum_idxs = [i for i, sig in enumerate(self.signals) if sig.calc_checksum is not None]
+    self.counter_idxs = [i for i, sig in enumerate(self.signals) if sig.type == SignalType.COUNTER]
+    self.volatile_idxs = sorted({*self.checksum_idxs, *self.counter_idxs})
+    self.unchanged_mask = (1 << (self.size * 8)) - 1
+    for i in self.volatile_idxs:
+      self.unchanged_mask &= ~get_signal_mask(self.signals[i], self.size)
+
+  def decode(self, dat: bytes | bytearray | memoryview) -> tuple[list[int], list[float]]:
+    """Extract the raw (sign-extended) and the scaled value of every signal."""
+    raw_vals: list[int] = []
+    vals: list[float] = []
+    if len(dat) != self.size or not self.decoders:
+      for sig in self.signals:
+        tmp = get_raw_value(dat, sig)
+        if sig.is_signed:
+          tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+        raw_vals.append(tmp)
+        vals.append(tmp * sig.factor + sig.offset)
+      return raw_vals, vals
+
+    le = int.from_bytes(dat, "little")
+    be = int.from_bytes(dat, "big")
+    for big_endian, shift, mask, sign_bit, factor, offset in self.decoders:
+      tmp = ((be if big_endian else le) >> shift) & mask
+      if tmp & sign_bit:
+        tmp -= sign_bit << 1
+      raw_vals.append(tmp)
+      vals.append(tmp * factor + offset)
+    return raw_vals, vals
+
+  def decode_volatile(self, dat: bytes | bytearray | memoryview) -> tuple[list[int], list[float]]:
+    """Like decode, but only re-extracts the counter and checksum signals, the rest are taken from the last good frame."""
+    raw_vals = self.raw_vals.copy()
+    vals = self.vals.copy()
+    le = int.from_bytes(dat, "little")
+    be = int.from_bytes(dat, "big")
+    for i in self.volatile_idxs:
+      big_endian, shift, mask, sign_bit, factor, offset = self.decoders[i]
+      tmp = ((be if big_endian else le) >> shift) & mask
+      if tmp & sign_bit:
+        tmp -= sign_bit << 1
+      raw_vals[i] = tmp
+      vals[i] = tmp * factor + offset
+    return raw_vals, vals
 
   def rate_limited_log(self, last_update_nanos: int, msg: str) -> None:
     if (last_update_nanos - self.last_warning_log_nanos) >= 1_000_000_000:
       carlog.warning(f"CANParser: {hex(self.address)} {self.name} {msg}")
       self.last_warning_log_nanos = last_update_nanos
 
-  def parse(self, nanos: int, dat: bytes) -> bool:
-    tmp_vals: list[float] = [0.0] * len(self.signals)
+  def parse(self, nanos: int, dat: bytes | bytearray | memoryview) -> bool:
+    # dat is only read and never copied, so any buffer-protocol object works
     checksum_failed = False
     counter_failed = False
 
     if self.first_seen_nanos == 0:
       self.first_seen_nanos = nanos
+    stats = self.stats
+    if stats is not None:
+      stats.add_frame(nanos, len(dat))
+
+    payload = None
+    self.unchanged = False
+    if self.skip_unchanged and self.decoders and len(dat) == self.size:
+      payload = int.from_bytes(dat, "little") & self.unchanged_mask
+      self.unchanged = payload == self.last_payload
+
+    if self.unchanged:
+      if stats is not None:
+        stats.unchanged_frames += 1
+      raw_vals, vals = self.decode_volatile(dat)
+    else:
+      raw_vals, vals = self.decode(dat)
 
-    for i, sig in enumerate(self.signals):
-      tmp = get_raw_value(dat, sig)
-      if sig.is_signed:
-        tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
-
-      if not self.ignore_checksum and sig.calc_checksum is not None:
-        expected_checksum = sig.calc_checksum(self.address, sig, bytearray(dat))
-        if tmp != expected_checksum:
+    if not self.ignore_checksum:
+      for i in self.checksum_idxs:
+        sig = self.signals[i]
+        expected_checksum = sig.calc_checksum(self.address, sig, dat)
+        if raw_vals[i] != expected_checksum:
           checksum_failed = True
-          self.rate_limited_log(nanos, f"checksum failed: received {hex(tmp)}, calculated {hex(expected_checksum)}")
+          if stats is not None:
+            stats.checksum_errors += 1
+          self.rate_limited_log(nanos, f"checksum failed: received {hex(raw_vals[i])}, calculated {hex(expected_checksum)}")
 
-      if not self.ignore_counter and sig.type == 1:  # COUNTER
-        if not self.update_counter(tmp, sig.size):
+    if not self.ignore_counter:
+      for i in self.counter_idxs:
+        if not self.update_counter(raw_vals[i], self.signals[i].size):
           counter_failed = True
 
-      tmp_vals[i] = tmp * sig.factor + sig.offset
-
     # must have good counter and checksum to update data
     if checksum_failed or counter_failed:
       return False
 
-    if not self.vals:
-      self.vals = [0.0] * len(self.signals)
-      self.all_vals = [[] for _ in self.signals]
-
-    for i, v in enumerate(tmp_vals):
-      self.vals[i] = v
-      self.all_vals[i].append(v)
+    self.vals = vals
+    if self.skip_unchanged:
+      self.raw_vals = raw_vals
+      self.last_payload = payload
+    if self.keep_all_vals:
+      if not self.all_vals:
+        self.all_vals = [[] for _ in self.signals]
+      for v, all_vals in zip(self.vals, self.all_vals, strict=True):
+        all_vals.append(v)
 
     self.timestamps.append(nanos)
 
@@ -98,6 +253,9 @@ class MessageState:
 
   def update_counter(self, cur_count: int, cnt_size: int) -> bool:
     if ((self.counter + 1) & ((1 << cnt_size) - 1)) != cur_count:
+      # there's nothing to compare the first counter to
+      if self.stats is not None and self.stats.frames > 1:
+        self.stats.counter_errors += 1
       self.counter_fail = min(self.counter_fail + 1, MAX_BAD_COUNTER)
     elif self.counter_fail > 0:
       self.counter_fail -= 1
@@ -126,16 +284,40 @@ class VLDict(dict):
 
 
 class CANParser:
-  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int):
+  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int, lazy: bool = False, compact: bool = False,
+               signals: Mapping[str | int, Iterable[str]] | None = None, skip_unchanged: bool = False, stats: bool = False,
+               history: int = 32):
     self.dbc_name: str = dbc_name
     self.bus: int = bus
-    self.dbc: DBC = DBC(dbc_name)
-
-    self.vl: dict[int | str, dict[str, float]] = VLDict(self)
-    self.vl_all: dict[int | str, dict[str, list[float]]] = {}
-    self.ts_nanos: dict[int | str, dict[str, int]] = {}
+    # a lazy DBC only parses the messages this parser looks up
+    self.dbc: DBC = DBC(dbc_name, lazy=True) if lazy else DBC(dbc_name)
+    # a compact parser keeps values in NumPy arrays, vl, vl_all and ts_nanos are read-only views into it.
+    # its vl_all holds the last `history` frames of each message per update, see HistoryView.dropped
+    self.store: SignalStore | None = SignalStore(history) if compact else None
+
+    self.vl: dict[int | str, Mapping[str, float]] = VLDict(self)
+    self.vl_all: dict[int | str, Mapping[str, list[float]]] = {}
+    self.ts_nanos: dict[int | str, Mapping[str, int]] = {}
     self.addresses: set[int] = set()
     self.message_states: dict[int, MessageState] = {}
+    self._vl_all_dirty: set[int] = set()
+    # message name or address -> the only signals to decode, counters and checksums are always decoded
+    self.signal_allow_list: dict[str | int, set[str]] = {k: set(v) for k, v in (signals or {}).items()}
+    # only re-decode a message when its payload changed outside of the counter and checksum
+    self.skip_unchanged: bool = skip_unchanged
+    # per-message receive statistics for get_stats, off by default to keep them off the per-frame path
+    self.collect_stats: bool = stats
+
+    # validity is tracked as frames come in, so can_valid and bus_timeout don't scan every message:
+    # a min-heap of (deadline, address) per seen message, refreshed lazily when read, the messages
+    # not seen yet, and the number of messages with too many counter errors
+    self._deadlines: list[tuple[float, int]] = []
+    self._unseen: set[int] = set()
+    self._num_counter_invalid: int = 0
+    # recompute the bus timeout threshold and rebuild the deadlines when a message is added or its frequency is learned
+    self._timing_dirty: bool = True
+    self._bus_timeout_threshold: float = 0
+    self._ignore_alive: bool = True
 
     for name_or_addr, freq in messages:
       if isinstance(name_or_addr, numbers.Number):
@@ -161,22 +343,38 @@ class CANParser:
     assert msg is not None
     assert msg.address not in self.addresses
 
+    sigs = list(msg.sigs.values())
+    allowed = self.signal_allow_list.get(msg.name, self.signal_allow_list.get(msg.address))
+    if allowed is not None:
+      if not allowed <= msg.sigs.keys():
+        raise RuntimeError(f"could not find signals {sorted(allowed - msg.sigs.keys())} in message {msg.name}")
+      sigs = [sig for sig in sigs if sig.name in allowed or sig.type == SignalType.COUNTER or sig.calc_checksum is not None]
+
     self.addresses.add(msg.address)
-    signal_names = list(msg.sigs.keys())
-    signals_dict = {s: 0.0 for s in signal_names}
+    signal_names = [sig.name for sig in sigs]
+    if self.store is not None:
+      self.store.add_message(msg.address, len(signal_names))
+      signals_dict = ValuesView(self.store, msg.address, signal_names)
+      self.vl_all[msg.address] = HistoryView(self.store, msg.address, signal_names)
+      self.ts_nanos[msg.address] = TimestampsView(self.store, msg.address, signal_names)
+    else:
+      signals_dict = {s: 0.0 for s in signal_names}
+      self.vl_all[msg.address] = defaultdict(list)
+      self.ts_nanos[msg.address] = {s: 0 for s in signal_names}
     dict.__setitem__(self.vl, msg.address, signals_dict)
     dict.__setitem__(self.vl, msg.name, signals_dict)
-    self.vl_all[msg.address] = defaultdict(list)
     self.vl_all[msg.name] = self.vl_all[msg.address]
-    self.ts_nanos[msg.address] = {s: 0 for s in signal_names}
     self.ts_nanos[msg.name] = self.ts_nanos[msg.address]
 
     state = MessageState(
       address=msg.address,
       name=msg.name,
       size=msg.size,
-      signals=list(msg.sigs.values()),
+      signals=sigs,
       ignore_alive=freq is not None and math.isnan(freq),
+      keep_all_vals=self.store is None,
+      skip_unchanged=self.skip_unchanged,
+      stats=MessageStats() if self.collect_stats else None,
     )
     if freq is not None and freq > 0:
       state.frequency = freq
@@ -186,41 +384,74 @@ class CANParser:
     state.timeout_threshold = (1_000_000_000 / freq) * 10
 
     self.message_states[msg.address] = state
+    if not state.ignore_alive:
+      self._unseen.add(msg.address)
+    self._timing_dirty = True
+
+  def _update_timing(self) -> None:
+    if not self._timing_dirty:
+      return
+    self._timing_dirty = False
+    self._ignore_alive = all(s.ignore_alive for s in self.message_states.values())
+    self._bus_timeout_threshold = 500 * 1_000_000
+    for st in self.message_states.values():
+      if st.timeout_threshold > 0:
+        self._bus_timeout_threshold = min(self._bus_timeout_threshold, st.timeout_threshold)
+    self._deadlines = [(st.timestamps[-1] + st.timeout_threshold, address) for address, st in self.message_states.items()
+                       if st.timestamps and not st.ignore_alive]
+    heapq.heapify(self._deadlines)
+
+  def _timed_out(self) -> bool:
+    """Whether any seen message has gone longer than its timeout threshold without a frame"""
+    deadlines = self._deadlines
+    while deadlines:
+      deadline, address = deadlines[0]
+      if deadline >= self._last_update_nanos:
+        return False
+      state = self.message_states[address]
+      current_deadline = state.timestamps[-1] + state.timeout_threshold
+      if current_deadline <= deadline:
+        return True
+      # received frames since the entry was pushed
+      heapq.heapreplace(deadlines, (current_deadline, address))
+    return False
 
   @property
   def bus_timeout(self) -> bool:
-    ignore_alive = all(s.ignore_alive for s in self.message_states.values())
-    bus_timeout_threshold = 500 * 1_000_000
-    for st in self.message_states.values():
-      if st.timeout_threshold > 0:
-        bus_timeout_threshold = min(bus_timeout_threshold, st.timeout_threshold)
-    return ((self._last_update_nanos - self.last_nonempty_nanos) > bus_timeout_threshold) and not ignore_alive
+    self._update_timing()
+    return ((self._last_update_nanos - self.last_nonempty_nanos) > self._bus_timeout_threshold) and not self._ignore_alive
 
   @property
   def can_valid(self) -> bool:
+    self._update_timing()
     valid = True
     counters_valid = True
-    bus_timeout = self.bus_timeout
-    for state in self.message_states.values():
-      if state.counter_fail >= MAX_BAD_COUNTER:
-        counters_valid = False
-        state.rate_limited_log(self._last_update_nanos, f"counter invalid, {state.counter_fail=} {MAX_BAD_COUNTER=}")
-      if not state.valid(self._last_update_nanos, bus_timeout):
-        valid = False
-        state.rate_limited_log(self._last_update_nanos, "not valid (timeout or missing)")
+    if self._num_counter_invalid > 0 or self._unseen or self._timed_out():
+      # something is invalid, find out what to log it
+      bus_timeout = self.bus_timeout
+      for state in self.message_states.values():
+        if state.counter_fail >= MAX_BAD_COUNTER:
+          counters_valid = False
+          state.rate_limited_log(self._last_update_nanos, f"counter invalid, {state.counter_fail=} {MAX_BAD_COUNTER=}")
+        if not state.valid(self._last_update_nanos, bus_timeout):
+          valid = False
+          state.rate_limited_log(self._last_update_nanos, "not valid (timeout or missing)")
 
     # TODO: probably only want to increment this once per update() call
     self.can_invalid_cnt = 0 if valid else min(self.can_invalid_cnt + 1, CAN_INVALID_CNT)
     return self.can_invalid_cnt < CAN_INVALID_CNT and counters_valid
 
+  def get_stats(self) -> dict[str, MessageStatsSnapshot]:
+    """Receive statistics of each subscribed message: rate, inter-arrival times, gaps and error counts"""
+    if not self.collect_stats:
+      raise RuntimeError("receive statistics are disabled, create the parser with stats=True")
+    return {state.name: state.stats.snapshot(state.address, state.name, self._last_update_nanos) for state in self.message_states.values()}
+
   def update(self, strings, sendcan: bool = False):
     if strings and not isinstance(strings[0], list | tuple):
       strings = [strings]
 
-    for addr in self.addresses:
-      for k in self.vl_all[addr]:
-        self.vl_all[addr][k].clear()
-
+    self._start_update()
     updated_addrs: set[int] = set()
     for entry in strings:
       t = entry[0]
@@ -231,26 +462,186 @@ class CANParser:
           continue
         bus_empty = False
         state = self.message_states.get(address)
-        if state is None or len(dat) > 64:
-          continue
-        if state.parse(t, dat):
+        if state is not None and self._parse_frame(t, state, dat):
           updated_addrs.add(address)
+      self._end_string(t, bus_empty)
 
-          vl_addr = self.vl[address]
-          vl_all_addr = self.vl_all[address]
-          ts_addr = self.ts_nanos[address]
+    return updated_addrs
 
-          for i, sig in enumerate(state.signals):
-            vl_addr[sig.name] = state.vals[i]
-            vl_all_addr[sig.name] = state.all_vals[i]
-            ts_addr[sig.name] = state.timestamps[-1]
+  def _start_update(self) -> None:
+    if self.store is not None:
+      self.store.start_update()
+    # vl_all only holds values from the current update, clear the messages that got data last time
+    for address in self._vl_all_dirty:
+      for k in self.vl_all[address]:
+        self.vl_all[address][k].clear()
+    self._vl_all_dirty.clear()
+
+  def _parse_frame(self, t: int, state: MessageState, dat: bytes | bytearray | memoryview) -> bool:
+    if len(dat) > 64:
+      return False
+    counter_invalid = state.counter_fail >= MAX_BAD_COUNTER
+    timeout_threshold = state.timeout_threshold
+    parsed = state.parse(t, dat)
+    if (state.counter_fail >= MAX_BAD_COUNTER) != counter_invalid:
+      self._num_counter_invalid += -1 if counter_invalid else 1
+    if not parsed:
+      return False
 
-      if not bus_empty:
-        self.last_nonempty_nanos = t
+    address = state.address
+    if state.timeout_threshold != timeout_threshold:
+      self._timing_dirty = True
+    if address in self._unseen:
+      self._unseen.discard(address)
+      heapq.heappush(self._deadlines, (t + state.timeout_threshold, address))
+    if self.store is not None:
+      self.store.write(address, state.vals, t)
+      return True
+    names = state.signal_names
+    vl = self.vl[address]
+    if state.unchanged:
+      for i in state.volatile_idxs:
+        vl[names[i]] = state.vals[i]
+    else:
+      vl.update(zip(names, state.vals, strict=True))
+    self.vl_all[address].update(zip(names, state.all_vals, strict=True))
+    self.ts_nanos[address].update(dict.fromkeys(names, t))
+    self._vl_all_dirty.add(address)
+    return True
 
-      self._last_update_nanos = t
+  def _end_string(self, t: int, bus_empty: bool) -> None:
+    if not bus_empty:
+      self.last_nonempty_nanos = t
+    self._last_update_nanos = t
+
+  def decode_batch(self, addresses: np.ndarray, payloads: np.ndarray | Sequence[bytes], timestamps: np.ndarray,
+                   lengths: np.ndarray | None = None) -> dict[str, DecodedMessage]:
+    """
+    Decode a whole log of frames from one bus at once, returning per-signal arrays for every DBC message seen.
+    payloads is either a (frames, bytes) uint8 array, zero-padded past each frame's length if lengths is given,
+    or a sequence of bytes-like payloads.
+    Unlike update(), this is stateless: counters and checksums are decoded but not validated.
+    """
+    addresses = np.asarray(addresses)
+    timestamps = np.asarray(timestamps)
+    if isinstance(payloads, np.ndarray) and payloads.ndim == 2:
+      dat = payloads.astype(np.uint8, copy=False)
+      lengths = np.full(len(dat), dat.shape[1], dtype=np.int64) if lengths is None else np.asarray(lengths, dtype=np.int64)
+    else:
+      lengths = np.fromiter((len(p) for p in payloads), dtype=np.int64, count=len(payloads))
+      dat = np.zeros((len(payloads), 64), dtype=np.uint8)
+      fits = lengths <= 64
+      flat = np.frombuffer(b"".join(p for p, ok in zip(payloads, fits, strict=True) if ok), dtype=np.uint8)
+      rows = np.repeat(np.flatnonzero(fits), lengths[fits])
+      starts = np.cumsum(lengths[fits]) - lengths[fits]
+      cols = np.arange(len(flat)) - np.repeat(starts, lengths[fits])
+      dat[rows, cols] = flat
+    assert len(addresses) == len(dat) == len(timestamps)
+
+    # group frames by address, preserving their order within each address
+    valid = np.flatnonzero(lengths <= 64)
+    order = valid[np.argsort(addresses[valid], kind="stable")]
+    addrs, starts, counts = np.unique(addresses[order], return_index=True, return_counts=True)
+
+    ret: dict[str, DecodedMessage] = {}
+    for address, start, count in zip(addrs.tolist(), starts, counts, strict=True):
+      msg = self.dbc.addr_to_msg.get(address)
+      if msg is None:
+        continue
+      idxs = order[start:start + count]
+      msg_dat = dat[idxs]
+      msg_lengths = lengths[idxs]
+      signals = {name: decode_signal_batch(msg_dat, msg_lengths, sig) for name, sig in msg.sigs.items()}
+      ret[msg.name] = DecodedMessage(msg.address, msg.name, timestamps[idxs], signals)
+    return ret
+
+
+class CANDemux:
+  """
+  Updates several parsers from the same CAN packets, routing each frame once by (bus, address) to the
+  parsers that subscribed to it, instead of every parser scanning every frame.
+  """
+  def __init__(self, parsers: Iterable[CANParser | None]):
+    self.parsers = [cp for cp in parsers if cp is not None]
+    self.buses = {cp.bus for cp in self.parsers}
+    # bus -> address -> [(parser, state)], rebuilt when a parser adds a message
+    self.routes: dict[int, dict[int, list[tuple[CANParser, MessageState]]]] = {}
+    self._num_states: list[int] = []
+
+  def _update_routes(self) -> None:
+    num_states = [len(cp.message_states) for cp in self.parsers]
+    if num_states == self._num_states:
+      return
+    self._num_states = num_states
+    self.routes = {bus: {} for bus in self.buses}
+    for cp in self.parsers:
+      for address, state in cp.message_states.items():
+        self.routes[cp.bus].setdefault(address, []).append((cp, state))
+
+  def update(self, strings) -> list[set[int]]:
+    """Same as calling update on each parser, returns the updated addresses of each parser."""
+    if strings and not isinstance(strings[0], list | tuple):
+      strings = [strings]
 
-    return updated_addrs
+    self._update_routes()
+    routes = self.routes
+    updated_addrs: dict[CANParser, set[int]] = {}
+    for cp in self.parsers:
+      cp._start_update()
+      updated_addrs[cp] = set()
+
+    for entry in strings:
+      t = entry[0]
+      nonempty_buses = set()
+      for address, dat, src in entry[1]:
+        bus_routes = routes.get(src)
+        if bus_routes is None:
+          continue
+        nonempty_buses.add(src)
+        for cp, state in bus_routes.get(address, ()):
+          if cp._parse_frame(t, state, dat):
+            updated_addrs[cp].add(address)
+      for cp in self.parsers:
+        cp._end_string(t, cp.bus not in nonempty_buses)
+
+    return [updated_addrs[cp] for cp in self.parsers]
+
+
+class MultiBusCANParser(Mapping):
+  """
+  A set of CANParsers, such as the per-bus parsers from get_can_parsers, updated in a single pass over the frames.
+  Indexing returns the individual parser, so code written against a dict of parsers keeps working.
+  """
+  def __init__(self, parsers: Mapping[Hashable, CANParser | None]):
+    self.parsers = dict(parsers)
+    self.demux = CANDemux(self.parsers.values())
+
+  @classmethod
+  def from_subscriptions(cls, subscriptions: Mapping[Hashable, tuple[str, list[tuple[str | int, int]], int]]) -> 'MultiBusCANParser':
+    """Build from {key: (dbc_name, messages, bus)}"""
+    return cls({key: CANParser(dbc_name, messages, bus) for key, (dbc_name, messages, bus) in subscriptions.items()})
+
+  def __getitem__(self, key: Hashable) -> CANParser | None:
+    return self.parsers[key]
+
+  def __iter__(self) -> Iterator[Hashable]:
+    return iter(self.parsers)
+
+  def __len__(self) -> int:
+    return len(self.parsers)
+
+  def update(self, strings) -> dict[Hashable, set[int]]:
+    """Update every parser, returns the updated addresses of each parser"""
+    updated_addrs = iter(self.demux.update(strings))
+    return {key: next(updated_addrs) for key, cp in self.parsers.items() if cp is not None}
+
+  @property
+  def can_valid(self) -> bool:
+    return all(cp.can_valid for cp in self.demux.parsers)
+
+  @property
+  def bus_timeout(self) -> bool:
+    return any(cp.bus_timeout for cp in self.demux.parsers)
 
 
 class CANDefine:
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Streaming decode of raw CAN frame logs into per-signal columns.
+
+Frames are read in fixed-size chunks, split into shards by (bus, address) and decoded with
+CANParser.decode_batch, optionally across a process pool. Every (bus, message) is written as its own
+table with a timestamp column and one column per signal, so memory use is bounded by the chunk size
+and the number of chunks in flight, not by the size of the log.
+
+Supported inputs:
+  - frame logs written by write_frame_log: a 16 byte header followed by fixed-size records
+  - CSV with a "timestamp,bus,address,data" header, address in decimal or 0x-prefixed hex and data in hex
+"""
+import argparse
+import csv
+import os
+from collections import OrderedDict, deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from opendbc.can.parser import CANParser, DecodedMessage
+
+try:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+except ImportError:
+  pa = pq = None
+
+FRAME_LOG_MAGIC = b"CANFRAME"
+FRAME_LOG_VERSION = 1
+FRAME_LOG_HEADER_SIZE = 16
+CHUNK_FRAMES = 1 << 18
+NPY_HEADER_SIZE = 128
+
+
+def get_frame_dtype(width: int) -> np.dtype:
+  """Record layout of a frame log with payloads of up to `width` bytes, zero-padded past each frame's length"""
+  return np.dtype([("timestamp", "<u8"), ("address", "<u4"), ("bus", "u1"), ("length", "u1"), ("pad", "V2"), ("data", "u1", (width,))])
+
+
+def write_frame_log(path: str | os.PathLike, frames: Iterable[tuple[int, int, bytes, int]], width: int = 64) -> int:
+  """Write (nanos, address, dat, bus) frames to a frame log, returns the number of frames written"""
+  assert 0 < width <= 64
+  dtype = get_frame_dtype(width)
+  count = 0
+  with open(path, "wb") as f:
+    f.write(FRAME_LOG_MAGIC + np.array([FRAME_LOG_VERSION, width], dtype="<u2").tobytes() + bytes(4))
+    chunk = np.zeros(CHUNK_FRAMES, dtype=dtype)
+    n = 0
+    for nanos, address, dat, bus in frames:
+      assert len(dat) <= width, f"payload longer than {width} bytes"
+      chunk[n] = (nanos, address, bus, len(dat), b"", np.frombuffer(bytes(dat).ljust(width, b"\x00"), dtype=np.uint8))
+      n += 1
+      if n == len(chunk):
+        chunk.tofile(f)
+        count += n
+        n = 0
+    chunk[:n].tofile(f)
+    count += n
+  return count
+
+
+def read_frame_log(path: str | os.PathLike, chunk_frames: int = CHUNK_FRAMES) -> Iterator[np.ndarray]:
+  with open(path, "rb") as f:
+    header = f.read(FRAME_LOG_HEADER_SIZE)
+    if len(header) != FRAME_LOG_HEADER_SIZE or header[:len(FRAME_LOG_MAGIC)] != FRAME_LOG_MAGIC:
+      raise ValueError(f"{path}: not a frame log")
+    version, width = np.frombuffer(header, dtype="<u2", count=2, offset=len(FRAME_LOG_MAGIC)).tolist()
+    if version != FRAME_LOG_VERSION:
+      raise ValueError(f"{path}: unsupported frame log version {version}")
+    dtype = get_frame_dtype(width)
+    while len(chunk := np.fromfile(f, dtype=dtype, count=chunk_frames)):
+      yield chunk
+
+
+def read_frame_csv(path: str | os.PathLike, chunk_frames: int = CHUNK_FRAMES) -> Iterator[np.ndarray]:
+  dtype = get_frame_dtype(64)
+  with open(path, newline="") as f:
+    chunk = np.zeros(chunk_frames, dtype=dtype)
+    n = 0
+    for row in csv.DictReader(f):
+      dat = bytes.fromhex(row["data"])
+      if len(dat) > 64:
+        raise ValueError(f"{path}: payload longer than 64 bytes")
+      frame = chunk[n]
+      frame["timestamp"] = int(row["timestamp"])
+      frame["address"] = int(row["address"], 0)
+      frame["bus"] = int(row["bus"])
+      frame["length"] = len(dat)
+      frame["data"][:len(dat)] = np.frombuffer(dat, dtype=np.uint8)
+      n += 1
+      if n == chunk_frames:
+        yield chunk
+        chunk = np.zeros(chunk_frames, dtype=dtype)
+        n = 0
+    if n:
+      yield chunk[:n]
+
+
+def read_frames(path: str | os.PathLike, chunk_frames: int = CHUNK_FRAMES) -> Iterator[np.ndarray]:
+  with open(path, "rb") as f:
+    is_frame_log = f.read(len(FRAME_LOG_MAGIC)) == FRAME_LOG_MAGIC
+  return read_frame_log(path, chunk_frames) if is_frame_log else read_frame_csv(path, chunk_frames)
+
+
+def shard_frames(frames: np.ndarray, num_shards: int) -> Iterator[tuple[int, np.ndarray]]:
+  """Split a chunk into (bus, frames) shards, an address always lands in the same shard of its bus"""
+  keys = frames["bus"].astype(np.int64) * num_shards + frames["address"] % num_shards
+  order = np.argsort(keys, kind="stable")
+  shard_keys, starts = np.unique(keys[order], return_index=True)
+  for key, start, end in zip(shard_keys.tolist(), starts, [*starts[1:], len(order)], strict=True):
+    yield key // num_shards, frames[order[start:end]]
+
+
+_parsers: dict[str, CANParser] = {}
+
+
+def decode_frames(dbc_name: str, frames: np.ndarray) -> dict[str, DecodedMessage]:
+  """Decode a shard of frames from one bus, runs in the worker processes"""
+  parser = _parsers.get(dbc_name)
+  if parser is None:
+    parser = _parsers[dbc_name] = CANParser(dbc_name, [], 0)
+  return parser.decode_batch(frames["address"], frames["data"], frames["timestamp"], frames["length"])
+
+
+def decode_stream(chunks: Iterable[np.ndarray], dbc_name: str, executor: Executor | None = None,
+                  num_shards: int = 1, max_pending: int = 8) -> Iterator[tuple[int, DecodedMessage]]:
+  """
+  Yield (bus, decoded message) pieces for each chunk of frames. Each message's pieces are yielded in log order.
+  With an executor, up to max_pending shards are decoded concurrently.
+  """
+  if executor is None:
+    for chunk in chunks:
+      for bus, frames in shard_frames(chunk, num_shards):
+        for decoded in decode_frames(dbc_name, frames).values():
+          yield bus, decoded
+    return
+
+  # results are consumed in submission order, which keeps each message's pieces in order
+  pending: deque[tuple[int, Future]] = deque()
+  for chunk in chunks:
+    for bus, frames in shard_frames(chunk, num_shards):
+      pending.append((bus, executor.submit(decode_frames, dbc_name, frames)))
+      while len(pending) > max_pending:
+        bus_, future = pending.popleft()
+        for decoded in future.result().values():
+          yield bus_, decoded
+  while pending:
+    bus_, future = pending.popleft()
+    for decoded in future.result().values():
+      yield bus_, decoded
+
+
+class NpyColumnWriter:
+  """
+  Appends to a 1-d .npy file, the header is written once the final length is known.
+  The file is only open while a chunk is appended, a table can have more columns than the process has file descriptors.
+  """
+  def __init__(self, path: Path, dtype: np.dtype):
+    self.path = path
+    self.dtype = np.dtype(dtype)
+    self.length = 0
+    with open(self.path, "wb") as f:
+      f.write(bytes(NPY_HEADER_SIZE))
+
+  def write(self, values: np.ndarray) -> None:
+    with open(self.path, "ab") as f:
+      np.ascontiguousarray(values, dtype=self.dtype).tofile(f)
+    self.length += len(values)
+
+  def close(self) -> None:
+    header = repr({"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (self.length,)})
+    header = header.encode("latin1").ljust(NPY_HEADER_SIZE - 10 - 1) + b"\n"
+    assert len(header) == NPY_HEADER_SIZE - 10
+    with open(self.path, "r+b") as f:
+      f.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header)
+
+
+class ColumnarWriter:
+  """
+  Writes each (bus, message) as a table with a timestamp column and one column per signal:
+  a <out_dir>/<bus>_<message>/ directory of .parquet parts, or of .npy columns.
+
+  .npy columns are only open while appending. Parquet files can't be reopened for appending, so at most max_open_files
+  parquet writers are kept open: when the least recently written one is closed, the message continues in a new part,
+  pq.read_table(<out_dir>/<bus>_<message>) reads the parts back in order.
+  """
+  def __init__(self, out_dir: str | os.PathLike, fmt: str = "parquet", max_open_files: int = 64):
+    assert fmt in ("parquet", "npy"), f"unknown output format {fmt}"
+    assert max_open_files > 0
+    if fmt == "parquet" and pq is None:
+      raise ImportError("parquet output requires pyarrow, install opendbc[parquet]")
+    self.out_dir = Path(out_dir)
+    self.out_dir.mkdir(parents=True, exist_ok=True)
+    self.fmt = fmt
+    self.max_open_files = max_open_files
+    # npy: column writers of each message, parquet: open writers, least recently written first
+    self.writers: OrderedDict[tuple[int, str], object] = OrderedDict()
+    self.parts: dict[tuple[int, str], int] = {}
+    self.rows: dict[tuple[int, str], int] = {}
+
+  def write(self, bus: int, decoded: DecodedMessage) -> None:
+    key = (bus, decoded.name)
+    columns = {"timestamp": decoded.timestamps, **decoded.signals}
+    msg_dir = self.out_dir / f"{bus}_{decoded.name}"
+    if self.fmt == "parquet":
+      table = pa.table(columns)
+      if key in self.writers:
+        self.writers.move_to_end(key)
+      else:
+        while len(self.writers) >= self.max_open_files:
+          self.writers.popitem(last=False)[1].close()
+        part = self.parts.get(key, 0)
+        msg_dir.mkdir(exist_ok=True)
+        self.writers[key] = pq.ParquetWriter(msg_dir / f"part-{part:05d}.parquet", table.schema)
+        self.parts[key] = part + 1
+      self.writers[key].write_table(table)
+    else:
+      if key not in self.writers:
+        msg_dir.mkdir(exist_ok=True)
+        self.writers[key] = {name: NpyColumnWriter(msg_dir / f"{name}.npy", values.dtype) for name, values in columns.items()}
+      for name, values in columns.items():
+        self.writers[key][name].write(values)
+    self.rows[key] = self.rows.get(key, 0) + len(decoded.timestamps)
+
+  def close(self) -> None:
+    for writer in self.writers.values():
+      if isinstance(writer, dict):
+        for column in writer.values():
+          column.close()
+      else:
+        writer.close()
+    self.writers.clear()
+
+  def __enter__(self) -> 'ColumnarWriter':
+    return self
+
+  def __exit__(self, *exc) -> None:
+    self.close()
+
+
+def decode_log(path: str | os.PathLike, dbc_name: str, out_dir: str | os.PathLike, fmt: str | None = None,
+               workers: int = 0, chunk_frames: int = CHUNK_FRAMES) -> dict[tuple[int, str], int]:
+  """Decode a frame log into columnar files, returns the number of rows written per (bus, message)"""
+  if fmt is None:
+    fmt = "npy" if pq is None else "parquet"
+  chunks = read_frames(path, chunk_frames)
+  with ColumnarWriter(out_dir, fmt) as writer:
+    if workers > 0:
+      with ProcessPoolExecutor(workers) as executor:
+        for bus, decoded in decode_stream(chunks, dbc_name, executor, num_shards=workers, max_pending=2 * workers):
+          writer.write(bus, decoded)
+    else:
+      for bus, decoded in decode_stream(chunks, dbc_name):
+        writer.write(bus, decoded)
+    return dict(writer.rows)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Decode a raw CAN frame log into per-signal columns",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("dbc", help="DBC name, e.g. toyota_new_mc_pt_generated")
+  parser.add_argument("input", help="frame log or CSV file")
+  parser.add_argument("out_dir")
+  parser.add_argument("--format", choices=("parquet", "npy"), help="output format, parquet if pyarrow is installed")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="decode processes, 0 to decode in this process")
+  parser.add_argument("--chunk-frames", type=int, default=CHUNK_FRAMES, help="frames read per chunk")
+  args = parser.parse_args()
+
+  rows = decode_log(args.input, args.dbc, args.out_dir, args.format, args.workers, args.chunk_frames)
+  for (bus, name), count in sorted(rows.items()):
+    print(f"bus {bus} {name}: {count} rows")
+  print(f"wrote {len(rows)} messages to {args.out_dir}")
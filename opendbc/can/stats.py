@@ -0,0 +1,107 @@
+import math
+from dataclasses import dataclass, field
+
+# inter-arrival times are binned in a log-spaced histogram, GAP_BUCKETS_PER_OCTAVE buckets per doubling of
+# microseconds (~9% resolution) up to 2^24 us (~17 s), which keeps both updates and quantiles cheap
+GAP_BUCKETS_PER_OCTAVE = 8
+NUM_GAP_BUCKETS = 24 * GAP_BUCKETS_PER_OCTAVE + 2
+# rates are exponentially weighted averages over about the last second, so they follow rate changes and stopped messages
+RATE_TIME_CONSTANT_NANOS = 1_000_000_000
+
+
+def get_gap_bucket(gap_nanos: int) -> int:
+  if gap_nanos < 1000:
+    return 0
+  return min(int(math.log2(gap_nanos / 1000) * GAP_BUCKETS_PER_OCTAVE) + 1, NUM_GAP_BUCKETS - 1)
+
+
+def get_gap_bucket_nanos(bucket: int) -> float:
+  """Representative (geometric center) inter-arrival time of a bucket"""
+  if bucket == 0:
+    return 0.
+  return 1000 * 2 ** ((bucket - 0.5) / GAP_BUCKETS_PER_OCTAVE)
+
+
+@dataclass(frozen=True)
+class MessageStatsSnapshot:
+  address: int
+  name: str
+  frames: int
+  rate_hz: float
+  bytes_per_sec: float
+  gap_p50_ms: float
+  gap_p99_ms: float
+  max_gap_ms: float
+  checksum_errors: int
+  counter_errors: int
+  unchanged_ratio: float
+  last_nanos: int
+
+
+@dataclass
+class MessageStats:
+  """Streaming per-message receive statistics, updated in O(1) per frame"""
+  frames: int = 0
+  bytes: int = 0
+  # frames and bytes after the first, exponentially decayed to last_nanos with RATE_TIME_CONSTANT_NANOS, see add_frame
+  decayed_frames: float = 0.
+  decayed_bytes: float = 0.
+  first_nanos: int = 0
+  last_nanos: int = 0
+  max_gap_nanos: int = 0
+  checksum_errors: int = 0
+  counter_errors: int = 0
+  # frames whose payload matched the previous one, when the parser skips unchanged payloads
+  unchanged_frames: int = 0
+  gap_histogram: list[int] = field(default_factory=lambda: [0] * NUM_GAP_BUCKETS, repr=False)
+
+  def add_frame(self, nanos: int, size: int) -> None:
+    if self.frames:
+      gap = nanos - self.last_nanos
+      if gap > self.max_gap_nanos:
+        self.max_gap_nanos = gap
+      self.gap_histogram[get_gap_bucket(gap)] += 1
+      # the frame is spread evenly over the gap before it, which keeps the rate of a steady message unbiased
+      decay = math.exp(-gap / RATE_TIME_CONSTANT_NANOS)
+      weight = (1 - decay) * RATE_TIME_CONSTANT_NANOS / gap if gap > 0 else 1.
+      self.decayed_frames = self.decayed_frames * decay + weight
+      self.decayed_bytes = self.decayed_bytes * decay + weight * size
+    else:
+      self.first_nanos = nanos
+    self.frames += 1
+    self.bytes += size
+    self.last_nanos = nanos
+
+  def gap_quantile(self, q: float) -> float:
+    """Approximate inter-arrival time quantile in nanoseconds"""
+    total = self.frames - 1
+    if total <= 0:
+      return 0.
+    target = q * total
+    count = 0
+    for bucket, n in enumerate(self.gap_histogram):
+      count += n
+      if count >= target and n > 0:
+        return get_gap_bucket_nanos(bucket)
+    return get_gap_bucket_nanos(NUM_GAP_BUCKETS - 1)
+
+  def snapshot(self, address: int, name: str, now_nanos: int = 0) -> MessageStatsSnapshot:
+    """Rates are as of now_nanos, or the last frame if earlier: they decay while a message isn't received"""
+    now_nanos = max(now_nanos, self.last_nanos)
+    # the decayed counts over the equally weighted time since the first frame, so early rates aren't biased low
+    decay = math.exp(-(now_nanos - self.last_nanos) / RATE_TIME_CONSTANT_NANOS)
+    window = RATE_TIME_CONSTANT_NANOS * 1e-9 * -math.expm1(-(now_nanos - self.first_nanos) / RATE_TIME_CONSTANT_NANOS)
+    return MessageStatsSnapshot(
+      address=address,
+      name=name,
+      frames=self.frames,
+      rate_hz=self.decayed_frames * decay / window if window > 0 else 0.,
+      bytes_per_sec=self.decayed_bytes * decay / window if window > 0 else 0.,
+      gap_p50_ms=self.gap_quantile(0.5) * 1e-6,
+      gap_p99_ms=self.gap_quantile(0.99) * 1e-6,
+      max_gap_ms=self.max_gap_nanos * 1e-6,
+      checksum_errors=self.checksum_errors,
+      counter_errors=self.counter_errors,
+      unchanged_ratio=self.unchanged_frames / self.frames if self.frames else 0.,
+      last_nanos=self.last_nanos,
+    )
@@ -0,0 +1,106 @@
+from collections.abc import Iterator, Mapping
+
+import numpy as np
+
+
+class SignalStore:
+  """
+  Compact structure-of-arrays storage for the signals of a CANParser: one float64 array with the latest value
+  of every signal, a ring buffer with the values received during the current update, and the time each
+  message was last received. Each message owns a contiguous range of columns.
+  The ring buffer keeps the last `history` frames of each message per update, the older ones are counted in dropped.
+  """
+  def __init__(self, history: int = 32):
+    self.history = history
+    self.values = np.zeros(0, dtype=np.float64)
+    self.all_values = np.zeros((history, 0), dtype=np.float64)
+    self.timestamps = np.zeros(0, dtype=np.int64)
+    # number of frames received per message during the current update
+    self.num_updates = np.zeros(0, dtype=np.int64)
+    # number of frames per message that didn't fit in the ring buffer, over all updates
+    self.dropped = np.zeros(0, dtype=np.int64)
+    # address -> (message index, first column, number of signals)
+    self.columns: dict[int, tuple[int, int, int]] = {}
+
+  def add_message(self, address: int, num_signals: int) -> None:
+    assert address not in self.columns
+    self.columns[address] = (len(self.timestamps), len(self.values), num_signals)
+    self.values = np.concatenate([self.values, np.zeros(num_signals)])
+    self.all_values = np.concatenate([self.all_values, np.zeros((self.history, num_signals))], axis=1)
+    self.timestamps = np.append(self.timestamps, np.int64(0))
+    self.num_updates = np.append(self.num_updates, np.int64(0))
+    self.dropped = np.append(self.dropped, np.int64(0))
+
+  def start_update(self) -> None:
+    self.num_updates.fill(0)
+
+  def write(self, address: int, vals: list[float], nanos: int) -> None:
+    idx, col, num_signals = self.columns[address]
+    n = int(self.num_updates[idx])
+    self.values[col:col + num_signals] = vals
+    self.all_values[n % self.history, col:col + num_signals] = vals
+    if n >= self.history:
+      self.dropped[idx] += 1
+    self.timestamps[idx] = nanos
+    self.num_updates[idx] = n + 1
+
+  def get_history(self, address: int) -> np.ndarray:
+    """Values of the current update as a (frames, signals) array, oldest first. Keeps the last `history` frames."""
+    idx, col, num_signals = self.columns[address]
+    n = int(self.num_updates[idx])
+    rows = self.all_values[:, col:col + num_signals]
+    if n <= self.history:
+      return rows[:n].copy()
+    return np.roll(rows, -(n % self.history), axis=0)
+
+
+class MessageView(Mapping):
+  """Read-only dict-like view of one message in a SignalStore, keyed by signal name"""
+  def __init__(self, store: SignalStore, address: int, signal_names: list[str]):
+    self.store = store
+    self.address = address
+    self.signal_idxs = {name: i for i, name in enumerate(signal_names)}
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self.signal_idxs)
+
+  def __len__(self) -> int:
+    return len(self.signal_idxs)
+
+  def __repr__(self) -> str:
+    return f"{type(self).__name__}({dict(self)})"
+
+
+class ValuesView(MessageView):
+  """vl[msg]: latest value of each signal"""
+  def __getitem__(self, name: str) -> float:
+    _, col, _ = self.store.columns[self.address]
+    return self.store.values.item(col + self.signal_idxs[name])
+
+  def array(self) -> np.ndarray:
+    _, col, num_signals = self.store.columns[self.address]
+    return self.store.values[col:col + num_signals]
+
+
+class HistoryView(MessageView):
+  """vl_all[msg]: values of each signal received during the current update"""
+  def __getitem__(self, name: str) -> list[float]:
+    return self.store.get_history(self.address)[:, self.signal_idxs[name]].tolist()
+
+  def array(self) -> np.ndarray:
+    return self.store.get_history(self.address)
+
+  @property
+  def dropped(self) -> int:
+    """Frames received beyond the store's history in an update, which vl_all doesn't hold"""
+    idx, _, _ = self.store.columns[self.address]
+    return self.store.dropped.item(idx)
+
+
+class TimestampsView(MessageView):
+  """ts_nanos[msg]: time the signal was last received"""
+  def __getitem__(self, name: str) -> int:
+    if name not in self.signal_idxs:
+      raise KeyError(name)
+    idx, _, _ = self.store.columns[self.address]
+    return self.store.timestamps.item(idx)
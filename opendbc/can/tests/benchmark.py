@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import time
+import numpy as np
 from opendbc.can import CANPacker, CANParser
 
 
@@ -39,8 +40,24 @@ def _benchmark(checks, n):
   print('[%d] %.1fms to pack, %.1fms to parse %s messages, avg: %dns' % (n, pack_dt/1e6, et/1e6, len(can_msgs), avg_nanos))
 
 
+def _benchmark_batch(n):
+  parser = CANParser('toyota_new_mc_pt_generated', [], 0)
+  packer = CANPacker('toyota_new_mc_pt_generated')
+
+  msgs = [packer.make_can_msg("ACC_CONTROL", 0, {"ACC_TYPE": 1, "ALLOW_LONG_PRESS": 3}) for _ in range(n)]
+  addresses = np.array([m[0] for m in msgs])
+  payloads = [m[1] for m in msgs]
+  timestamps = np.arange(n) * 10_000_000
+
+  t1 = time.process_time_ns()
+  parser.decode_batch(addresses, payloads, timestamps)
+  t2 = time.process_time_ns()
+  print('[batch] %.1fms to decode %s messages, avg: %dns' % ((t2 - t1)/1e6, n, (t2 - t1) / n))
+
+
 if __name__ == "__main__":
   # python -m cProfile -s cumulative  benchmark.py
   _benchmark([('ACC_CONTROL', 10)], 1)
   _benchmark([('ACC_CONTROL', 10)], 5)
   _benchmark([('ACC_CONTROL', 10)], 10)
+  _benchmark_batch(1000000)
@@ -1,9 +1,83 @@
 import copy
-from opendbc.can import CANPacker, CANParser
+import random
+import pytest
+
+from opendbc.can import CANPacker, CANParser, checksums
+from opendbc.can.dbc import NATIVE_CHECKSUMS, Signal, SignalType
+from opendbc.car.body.bodycan import body_checksum
+from opendbc.car.chrysler.chryslercan import chrysler_checksum, fca_giorgio_checksum
+from opendbc.car.fiat.fiatcan import fiat_fastback_checksum
+from opendbc.car.honda.hondacan import honda_checksum
+from opendbc.car.hyundai.hyundaicanfd import hkg_can_fd_checksum
+from opendbc.car.psa.psacan import psa_checksum
+from opendbc.car.subaru.subarucan import subaru_checksum
+from opendbc.car.tesla.teslacan import tesla_checksum
+from opendbc.car.toyota.toyotacan import toyota_checksum
+from opendbc.car.volkswagen.mlbcan import VOLKSWAGEN_MLB_XOR_STARTING_VALUES, volkswagen_mlb_checksum
+from opendbc.car.volkswagen.mqbcan import VOLKSWAGEN_MQB_MEB_CONSTANTS, volkswagen_mqb_meb_checksum, xor_checksum
+
+PYTHON_CHECKSUMS = {
+  SignalType.HONDA_CHECKSUM: honda_checksum,
+  SignalType.TOYOTA_CHECKSUM: toyota_checksum,
+  SignalType.BODY_CHECKSUM: body_checksum,
+  SignalType.VOLKSWAGEN_MQB_MEB_CHECKSUM: volkswagen_mqb_meb_checksum,
+  SignalType.XOR_CHECKSUM: xor_checksum,
+  SignalType.SUBARU_CHECKSUM: subaru_checksum,
+  SignalType.CHRYSLER_CHECKSUM: chrysler_checksum,
+  SignalType.HKG_CAN_FD_CHECKSUM: hkg_can_fd_checksum,
+  SignalType.FCA_GIORGIO_CHECKSUM: fca_giorgio_checksum,
+  SignalType.TESLA_CHECKSUM: tesla_checksum,
+  SignalType.PSA_CHECKSUM: psa_checksum,
+  SignalType.VOLKSWAGEN_MLB_CHECKSUM: volkswagen_mlb_checksum,
+  SignalType.FIAT_FASTBACK_CHECKSUM: fiat_fastback_checksum,
+}
 
 
 class TestCanChecksums:
 
+  @pytest.mark.skipif(checksums.lib is None, reason="libchecksums not built")
+  def test_native_checksums(self, subtests):
+    """Compiled checksum kernels must match the Python implementations"""
+    assert NATIVE_CHECKSUMS.keys() == PYTHON_CHECKSUMS.keys()
+
+    rng = random.Random(0)
+    special_addrs = [0xDE, 0x106, 0x122, 0x2FA, 0x452, 0x38D, 0x42D, *VOLKSWAGEN_MQB_MEB_CONSTANTS, *VOLKSWAGEN_MLB_XOR_STARTING_VALUES]
+    for sig_type, python_checksum in PYTHON_CHECKSUMS.items():
+      with subtests.test(sig_type=sig_type):
+        native_checksum = NATIVE_CHECKSUMS[sig_type]
+        for _ in range(2000):
+          dat = rng.randbytes(rng.choice([2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64]))
+          address = rng.choice([rng.choice(special_addrs), rng.randrange(0x800), rng.randrange(0x20000000)])
+          sig = Signal("CHECKSUM", rng.randrange(len(dat) * 8), 0, 0, 8, False, 1.0, 0.0, True, sig_type)
+          expected = python_checksum(address, sig, bytearray(dat))
+          assert native_checksum(address, sig, dat) == expected
+          assert native_checksum(address, sig, bytearray(dat)) == expected
+          assert native_checksum(address, sig, memoryview(dat)) == expected
+
+  def test_python_checksums_memoryview(self, subtests):
+    """The Python fallbacks must accept the same buffers as the compiled kernels"""
+    rng = random.Random(0)
+    for sig_type, python_checksum in PYTHON_CHECKSUMS.items():
+      with subtests.test(sig_type=sig_type):
+        for _ in range(100):
+          dat = rng.randbytes(rng.choice([4, 8, 32, 64]))
+          address = rng.randrange(0x800)
+          sig = Signal("CHECKSUM", rng.randrange(len(dat) * 8), 0, 0, 8, False, 1.0, 0.0, True, sig_type)
+          assert python_checksum(address, sig, memoryview(dat)) == python_checksum(address, sig, bytearray(dat))
+
+  def test_body_checksum_without_native(self, monkeypatch):
+    # as if cffi or libchecksums were missing
+    monkeypatch.setattr("opendbc.can.dbc.NATIVE_CHECKSUMS", {})
+    packer = CANPacker("comma_body")
+    parser = CANParser("comma_body", [("TORQUE_CMD", 0)], 0)
+    assert parser.dbc.name_to_msg["TORQUE_CMD"].sigs["CHECKSUM"].calc_checksum is body_checksum
+
+    address, dat, bus = packer.make_can_msg("TORQUE_CMD", 0, {"TORQUE_L": 100, "TORQUE_R": -100, "COUNTER": 3})
+    parser.update([0, [(address, memoryview(bytes(dat)), bus)]])
+    assert parser.can_valid
+    assert parser.vl["TORQUE_CMD"]["TORQUE_L"] == 100
+    assert parser.vl["TORQUE_CMD"]["CHECKSUM"] == body_checksum(address, None, dat)
+
   def verify_checksum(self, subtests, dbc_file: str, msg_name: str, msg_addr: int, test_messages: list[bytes],
                       checksum_field: str = 'CHECKSUM', counter_field = 'COUNTER'):
     """
@@ -27,6 +101,11 @@ class TestCanChecksums:
       with subtests.test(counter=expected[counter_field]):
         assert tested[checksum_field] == expected[checksum_field]
 
+        # the compiled and Python checksums must agree on the sample
+        sig = parser.dbc.name_to_msg[msg_name].sigs[checksum_field]
+        if sig.type in PYTHON_CHECKSUMS:
+          assert sig.calc_checksum(msg_addr, sig, data) == PYTHON_CHECKSUMS[sig.type](msg_addr, sig, bytearray(data))
+
   def verify_fiat_fastback_crc(self, subtests, msg_name: str, msg_addr: int, test_messages: list[bytes]):
     """Test modified SAE J1850 CRCs, with special final XOR cases for EPS messages"""
     assert len(test_messages) >= 3
@@ -1,5 +1,13 @@
+import os
+import random
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from opendbc import DBC_PATH
 from opendbc.can import CANParser
-from opendbc.can.tests import ALL_DBCS
+from opendbc.can.dbc import DBC, get_dbc_cache_path, parse_dbc_file, read_dbc_cache, write_dbc_cache
+from opendbc.can.parser import MessageState, get_raw_value
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
 
 
 class TestDBCParser:
@@ -19,3 +27,106 @@ class TestDBCParser:
     for dbc in ALL_DBCS:
       with subtests.test(dbc=dbc):
         CANParser(dbc, [], 0)
+
+  def test_decode_plan(self, subtests):
+    """Compiled decoders must match the bit-by-bit reference for every signal"""
+    rng = random.Random(0)
+    for dbc in ALL_DBCS:
+      with subtests.test(dbc=dbc):
+        parser = CANParser(dbc, [], 0)
+        for msg in parser.dbc.msgs.values():
+          state = MessageState(msg.address, msg.name, msg.size, list(msg.sigs.values()))
+          for _ in range(5):
+            dat = rng.randbytes(msg.size)
+            raw_vals, vals = state.decode(dat)
+            for sig, raw, val in zip(state.signals, raw_vals, vals, strict=True):
+              expected = get_raw_value(dat, sig)
+              if sig.is_signed:
+                expected -= ((expected >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+              assert raw == expected, sig.name
+              assert val == expected * sig.factor + sig.offset, sig.name
+
+  def test_dbc_cache(self, tmp_path):
+    """Cached DBCs must match freshly parsed ones, and be invalidated when the source changes"""
+    def load(path, cache_dir):
+      dbc = DBC.__wrapped__.__new__(DBC.__wrapped__)
+      dbc._parse(path, cache_dir)
+      return dbc
+
+    for name in ("honda_civic_touring_2016_can_generated", "tesla_model3_party", "hyundai_canfd_generated"):
+      path = os.path.join(DBC_PATH, name + ".dbc")
+      expected = load(path, None)
+      assert read_dbc_cache(path, str(tmp_path)) is None
+      assert load(path, str(tmp_path)).msgs == expected.msgs
+      assert read_dbc_cache(path, str(tmp_path)) is not None
+
+      cached = load(path, str(tmp_path))
+      assert cached.msgs == expected.msgs
+      assert cached.vals == expected.vals
+      assert cached.name_to_msg == expected.name_to_msg
+
+    # editing the source invalidates its cache
+    path = str(tmp_path / "test.dbc")
+    shutil.copy(TEST_DBC, path)
+    cache_dir = str(tmp_path / "cache")
+    assert "NEW_MESSAGE" not in load(path, cache_dir).name_to_msg
+    with open(path, "a") as f:
+      f.write('\nBO_ 1024 NEW_MESSAGE: 8 XXX\n SG_ NEW_SIGNAL : 0|8@1+ (1,0) [0|255] "" XXX\n')
+    assert read_dbc_cache(path, cache_dir) is None
+    assert "NEW_SIGNAL" in load(path, cache_dir).name_to_msg["NEW_MESSAGE"].sigs
+
+    # a corrupt cache falls back to parsing
+    with open(get_dbc_cache_path(path, cache_dir), "wb") as f:
+      f.write(b"ODBC")
+    assert read_dbc_cache(path, cache_dir) is None
+    assert "NEW_MESSAGE" in load(path, cache_dir).name_to_msg
+
+  def test_dbc_cache_concurrent_writes(self, tmp_path):
+    """Threads writing the same cache at once each use their own temp file"""
+    path = os.path.join(DBC_PATH, "toyota_new_mc_pt_generated.dbc")
+    tables = parse_dbc_file(path)
+    with ThreadPoolExecutor(8) as executor:
+      list(executor.map(lambda _: write_dbc_cache(path, str(tmp_path), *tables), range(32)))
+    assert read_dbc_cache(path, str(tmp_path)) == tables
+    assert os.listdir(tmp_path) == [os.path.basename(get_dbc_cache_path(path, str(tmp_path)))]
+
+  def test_dbc_cache_dir(self, tmp_path, monkeypatch):
+    monkeypatch.setattr("opendbc.can.dbc.DBC_CACHE_DIR", str(tmp_path))
+    DBC.cache_clear()
+    parsed = DBC("honda_civic_touring_2016_can_generated")
+    assert read_dbc_cache(parsed._path, str(tmp_path)) is not None
+
+    monkeypatch.setattr("opendbc.can.dbc.DISABLE_DBC_CACHE", True)
+    DBC.cache_clear()
+    parsed = DBC("toyota_new_mc_pt_generated")
+    assert read_dbc_cache(parsed._path, str(tmp_path)) is None
+
+  def test_lazy_dbc(self, subtests):
+    """Lazily loaded DBCs must match fully parsed ones"""
+    for dbc in ALL_DBCS:
+      with subtests.test(dbc=dbc):
+        expected = DBC(dbc)
+        lazy = DBC(dbc, lazy=True)
+        assert lazy.msgs == expected.msgs
+        assert lazy.addr_to_msg == expected.addr_to_msg
+        assert lazy.name_to_msg == expected.name_to_msg
+        assert lazy.vals == expected.vals
+
+  def test_lazy_dbc_no_reopen(self, mocker):
+    """Messages are read from the mapped file, without opening it again"""
+    DBC.cache_clear()
+    lazy = DBC("toyota_new_mc_pt_generated", lazy=True)
+    mock_open = mocker.patch("builtins.open", side_effect=AssertionError("DBC reopened"))
+    assert all(len(msg.sigs) for msg in lazy.msgs.values())
+    assert len(lazy._loaded) == len(lazy.msgs)
+    assert not mock_open.called
+
+  def test_lazy_parser(self):
+    dbc_file = "hyundai_canfd_generated"
+    DBC.cache_clear()
+    parser = CANParser(dbc_file, [("CRUISE_BUTTONS", 50)], 0, lazy=True)
+    assert parser.dbc._loaded.keys() == {parser.dbc.name_to_msg.index["CRUISE_BUTTONS"]}
+
+    # messages not subscribed to are still added on access
+    assert parser.vl["ACCELERATOR"] == dict.fromkeys(DBC(dbc_file).name_to_msg["ACCELERATOR"].sigs, 0.0)
+    assert len(parser.dbc._loaded) == 2
@@ -1,8 +1,10 @@
+import numpy as np
 import pytest
 import random
 
-from opendbc.can import CANPacker, CANParser
-from opendbc.can.tests import TEST_DBC
+from opendbc.can import CANDemux, CANPacker, CANParser, MultiBusCANParser
+from opendbc.can.parser import CAN_INVALID_CNT, MessageState
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
 
 MAX_BAD_COUNTER = 5
 
@@ -19,6 +21,87 @@ class TestCanParserPacker:
         assert bus == b
         assert dat[0] == i
 
+  def test_packer_compiled(self, subtests):
+    """Compiled encoders must produce the same payloads as setting signals bit by bit"""
+    rng = random.Random(0)
+    for dbc in ALL_DBCS:
+      with subtests.test(dbc=dbc):
+        packer = CANPacker(dbc)
+        reference = CANPacker(dbc)
+        for msg in packer.dbc.msgs.values():
+          for _ in range(3):
+            sigs = rng.sample(list(msg.sigs.values()), len(msg.sigs))
+            values = {s.name: (rng.getrandbits(s.size) - (1 << (s.size - 1) if s.is_signed else 0)) * s.factor + s.offset for s in sigs}
+            if rng.random() < 0.5:
+              values.pop("COUNTER", None)
+            expected = reference._pack_slow(reference.get_encoder(msg.address), values)
+            assert packer.pack(msg.address, values) == expected, msg.name
+
+  def test_make_can_msgs(self):
+    packer = CANPacker(TEST_DBC)
+    reference = CANPacker(TEST_DBC)
+    msgs = [("STEERING_CONTROL", 0, {"STEER_TORQUE": i}) for i in range(10)] + [(245, 1, {}), ("UNKNOWN_MESSAGE", 0, {})]
+    assert packer.make_can_msgs(msgs) == [reference.make_can_msg(*m) for m in msgs]
+    assert packer.pack_many([(228, {"STEER_TORQUE": 1})]) == [reference.pack(228, {"STEER_TORQUE": 1})]
+
+  def test_make_can_msg_empty(self):
+    """Messages without a payload, like VECTOR__INDEPENDENT_SIG_MSG, aren't packed into frames"""
+    packer = CANPacker("gm_global_a_object")
+    msg = packer.dbc.name_to_msg["VECTOR__INDEPENDENT_SIG_MSG"]
+    assert msg.size == 0
+    assert packer.make_can_msg(msg.name, 1, {}) == (0, b'', 1)
+    assert packer.make_can_msg(msg.address, 1, {}) == (0, b'', 1)
+    assert packer.make_can_msg("NOT_A_MESSAGE", 1, {}) == (0, b'', 1)
+
+  def test_pack_into(self, subtests):
+    rng = random.Random(0)
+    for dbc in ALL_DBCS:
+      with subtests.test(dbc=dbc):
+        packer = CANPacker(dbc)
+        reference = CANPacker(dbc)
+        buf = bytearray(80)
+        for msg in packer.dbc.msgs.values():
+          values = {s.name: (rng.getrandbits(s.size) - (1 << (s.size - 1) if s.is_signed else 0)) * s.factor + s.offset for s in msg.sigs.values()}
+          values.pop("COUNTER", None)
+          expected = reference.pack(msg.address, values)
+
+          # written in place, at any offset of a reused buffer, leaving the rest of it alone
+          buf[:] = rng.randbytes(len(buf))
+          before = bytes(buf)
+          offset = rng.randrange(len(buf) - msg.size + 1)
+          assert packer.pack_into(msg.address, values, buf, offset) == msg.size
+          assert buf[offset:offset + msg.size] == expected, msg.name
+          assert buf[:offset] == before[:offset] and buf[offset + msg.size:] == before[offset + msg.size:]
+
+    packer = CANPacker("honda_civic_touring_2016_can_generated")
+    assert packer.pack_into(0x7FF, {}, bytearray(8)) == 0
+    with pytest.raises(ValueError):
+      packer.pack_into(0xE4, {}, bytearray(8), 4)
+
+  def test_pack_into_checksum_in_place(self, mocker):
+    """The checksum is computed over the payload where it was written, not a copy"""
+    packer = CANPacker("honda_civic_touring_2016_can_generated")
+    sig = packer.get_encoder(0xE4).checksum
+    calc_checksum = mocker.patch.object(sig, "calc_checksum", wraps=sig.calc_checksum)
+    buf = bytearray(16)
+    packer.pack_into(0xE4, {"STEER_TORQUE": 100}, buf, 8)
+    dat = calc_checksum.call_args.args[2]
+    assert isinstance(dat, memoryview) and dat.obj is buf
+
+  def test_parser_no_payload_copies(self, mocker):
+    """Payloads are handed to the checksum as-is, so buffer-protocol objects work without copying"""
+    packer = CANPacker("honda_civic_touring_2016_can_generated")
+    parser = CANParser("honda_civic_touring_2016_can_generated", [("STEERING_CONTROL", 0)], 0)
+    sig = parser.message_states[0xE4].signals[parser.message_states[0xE4].checksum_idxs[0]]
+    calc_checksum = mocker.patch.object(sig, "calc_checksum", wraps=sig.calc_checksum)
+
+    for steer in range(-100, 100):
+      _, dat, _ = packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": steer})
+      frame = memoryview(bytearray(dat))
+      assert parser.update([0, [(0xE4, frame, 0)]]) == {0xE4}
+      assert parser.vl["STEERING_CONTROL"]["STEER_TORQUE"] == steer
+      assert calc_checksum.call_args.args[2] is frame
+
   def test_packer_counter(self):
     msgs = [("CAN_FD_MESSAGE", 0), ]
     packer = CANPacker(TEST_DBC)
@@ -67,6 +150,37 @@ class TestCanParserPacker:
       parser.update([t, [msg]])
       assert parser.can_valid
 
+  def test_parser_validity_incremental(self):
+    """can_valid and bus_timeout must match a full scan over every message"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("VSA_STATUS", 50), ("STEERING_CONTROL", 0), ("POWERTRAIN_DATA", 100), ("SCM_FEEDBACK", float('nan'))]
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, msgs, 0)
+
+    rng = random.Random(0)
+    t = 0
+    for i in range(3000):
+      t += rng.choice([1, 10, 10, 10, 50, 300]) * 1_000_000
+      frames = []
+      for name, _ in msgs:
+        if rng.random() < 0.8:
+          # occasionally repeat the counter
+          values = {"COUNTER": 0} if rng.random() < 0.1 else {}
+          frames.append(packer.make_can_msg(name, 0, values))
+      if i == 1500:
+        parser.vl["GAS_PEDAL_2"]
+      parser.update([t, frames if rng.random() < 0.9 else []])
+
+      timeout = (parser._last_update_nanos - parser.last_nonempty_nanos) > min(
+        [500_000_000] + [s.timeout_threshold for s in parser.message_states.values() if s.timeout_threshold > 0])
+      timeout = timeout and not all(s.ignore_alive for s in parser.message_states.values())
+      valid = all(s.valid(parser._last_update_nanos, timeout) for s in parser.message_states.values())
+      counters_valid = all(s.counter_fail < MAX_BAD_COUNTER for s in parser.message_states.values())
+      invalid_cnt = 0 if valid else min(parser.can_invalid_cnt + 1, CAN_INVALID_CNT)
+
+      assert parser.bus_timeout == timeout
+      assert parser.can_valid == (invalid_cnt < CAN_INVALID_CNT and counters_valid)
+
   def test_parser_updated_list(self):
     msgs = [("CAN_FD_MESSAGE", 10), ]
     parser = CANParser(TEST_DBC, msgs, 0)
@@ -102,6 +216,120 @@ class TestCanParserPacker:
     parser.update([0, [msg]])
     assert parser.can_valid
 
+  def test_parser_stats(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, [("STEERING_CONTROL", 0)], 0, stats=True)
+
+    t = 0
+    for i in range(201):
+      # 100Hz, with a single 300ms gap
+      t += 300_000_000 if i == 100 else 10_000_000
+      msg = packer.make_can_msg("STEERING_CONTROL", 0, {"COUNTER": i % 4})
+      if i == 50:
+        msg = packer.make_can_msg("STEERING_CONTROL", 0, {"COUNTER": 0})
+      elif i == 150:
+        msg = (msg[0], bytes([*msg[1][:-1], msg[1][-1] ^ 0xF]), msg[2])
+      parser.update([t, [msg]])
+
+    stats = parser.get_stats()["STEERING_CONTROL"]
+    assert stats.address == 0xe4
+    assert stats.frames == 201
+    # weighted towards the last second at 100Hz
+    assert 85 < stats.rate_hz < 100
+    assert stats.bytes_per_sec == pytest.approx(stats.rate_hz * len(msg[1]))
+    assert stats.gap_p50_ms == pytest.approx(10, rel=0.1)
+    assert stats.gap_p99_ms == pytest.approx(10, rel=0.1)
+    assert stats.max_gap_ms == pytest.approx(300)
+    assert stats.checksum_errors == 1
+    # the repeated counter and the frame after it
+    assert stats.counter_errors == 2
+
+  def test_parser_stats_rate(self):
+    """Rates follow the recent rate of a message, not its lifetime average"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, [("STEERING_CONTROL", 0)], 0, stats=True)
+
+    t = 0
+    for i in range(800):
+      # 100Hz for 3s, then 10Hz for 5s
+      t += 10_000_000 if i < 300 else 100_000_000
+      parser.update([t, [packer.make_can_msg("STEERING_CONTROL", 0, {})]])
+      if i in (2, 299):
+        assert parser.get_stats()["STEERING_CONTROL"].rate_hz == pytest.approx(100)
+    assert parser.get_stats()["STEERING_CONTROL"].rate_hz == pytest.approx(10)
+
+    # decays once the message stops
+    parser.update([t + 5_000_000_000, []])
+    assert parser.get_stats()["STEERING_CONTROL"].rate_hz < 0.1
+
+  def test_parser_stats_disabled(self):
+    parser = CANParser("honda_civic_touring_2016_can_generated", [("STEERING_CONTROL", 0)], 0)
+    assert all(state.stats is None for state in parser.message_states.values())
+    with pytest.raises(RuntimeError):
+      parser.get_stats()
+
+  def test_signal_allow_list(self):
+    dbc_file = "hyundai_canfd_generated"
+    packer = CANPacker(dbc_file)
+    full = CANParser(dbc_file, [("CCNC_0x161", 0)], 0)
+    parser = CANParser(dbc_file, [("CCNC_0x161", 0)], 0, signals={"CCNC_0x161": ["FCA_ICON", "LKA_ICON"], 0x1a0: ["ACC_ObjDist"]})
+
+    # counter and checksum are still decoded and validated
+    assert set(parser.vl["CCNC_0x161"]) == {"CHECKSUM", "COUNTER", "FCA_ICON", "LKA_ICON"}
+    for i in range(10):
+      msg = packer.make_can_msg("CCNC_0x161", 0, {"COUNTER": i, "FCA_ICON": i % 4, "LKA_ICON": 1})
+      full.update([i, [msg]])
+      parser.update([i, [msg]])
+      assert parser.can_valid
+      for name, value in parser.vl["CCNC_0x161"].items():
+        assert value == full.vl["CCNC_0x161"][name]
+    assert parser.vl_all["CCNC_0x161"]["FCA_ICON"] == [1]
+
+    bad_counter = packer.make_can_msg("CCNC_0x161", 0, {"COUNTER": 0, "FCA_ICON": 3})
+    for i in range(MAX_BAD_COUNTER):
+      parser.update([10 + i, [bad_counter]])
+    assert not parser.can_valid
+
+    # also applies to messages added on access, by address
+    assert set(parser.vl["SCC_CONTROL"]) == {"CHECKSUM", "COUNTER", "ACC_ObjDist"}
+
+    with pytest.raises(RuntimeError):
+      CANParser(dbc_file, [("CCNC_0x161", 0)], 0, signals={"CCNC_0x161": ["NOT_A_SIGNAL"]})
+
+  def test_skip_unchanged(self):
+    """Skipping unchanged payloads must give the same values, timestamps and validity as decoding every frame"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("STEERING_CONTROL", 0), ("VSA_STATUS", 0), ("DOORS_STATUS", 0)]
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, msgs, 0, stats=True)
+    skip_parser = CANParser(dbc_file, msgs, 0, skip_unchanged=True, stats=True)
+
+    rng = random.Random(0)
+    values = {"STEER_TORQUE": 0, "USER_BRAKE": 0, "DOOR_OPEN_FL": 1}
+    for i in range(1000):
+      if rng.random() < 0.1:
+        values = {"STEER_TORQUE": rng.randint(-10, 10), "USER_BRAKE": rng.randint(0, 2), "DOOR_OPEN_FL": rng.randint(0, 1)}
+      frames = []
+      for name, _ in msgs:
+        counter = rng.randint(0, 3) if rng.random() < 0.02 else i % 4
+        frames.append(packer.make_can_msg(name, 0, {**values, "COUNTER": counter}))
+      if rng.random() < 0.02:
+        address, dat, bus = frames[0]
+        frames[0] = (address, bytes([*dat[:-1], dat[-1] ^ 0xF]), bus)
+      t = i * 10_000_000
+      assert parser.update([t, frames]) == skip_parser.update([t, frames])
+      assert parser.can_valid == skip_parser.can_valid
+      for name, _ in msgs:
+        assert parser.vl[name] == skip_parser.vl[name]
+        assert parser.vl_all[name] == skip_parser.vl_all[name]
+        assert parser.ts_nanos[name] == skip_parser.ts_nanos[name]
+
+    stats = skip_parser.get_stats()
+    assert 0.5 < stats["STEERING_CONTROL"].unchanged_ratio < 1
+    assert parser.get_stats()["STEERING_CONTROL"].unchanged_ratio == 0
+
   def test_parser_no_partial_update(self):
     """
     Ensure that the CANParser doesn't partially update messages with invalid signals (COUNTER/CHECKSUM).
@@ -366,3 +594,171 @@ class TestCanParserPacker:
     assert packer.make_can_msg("ACC_CONTROL", 0, {"UNKNOWN_SIGNAL": 0}) == (835, b'\x00\x00\x00\x00\x00\x00\x00N', 0)
     assert packer.make_can_msg("UNKNOWN_MESSAGE", 0, {"UNKNOWN_SIGNAL": 0}) == (0, b'', 0)
     assert packer.make_can_msg(0, 0, {"UNKNOWN_SIGNAL": 0}) == (0, b'', 0)
+
+  def test_demux(self):
+    """Updating through CANDemux must match updating each parser on its own"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+
+    def make_parsers():
+      return [
+        CANParser(dbc_file, [("VSA_STATUS", 50), ("STEERING_CONTROL", 0)], 0),
+        CANParser(dbc_file, [("STEERING_CONTROL", 0)], 2),
+        CANParser(dbc_file, [("POWERTRAIN_DATA", 100)], 0),
+      ]
+    parsers, reference = make_parsers(), make_parsers()
+    demux = CANDemux([*parsers, None])
+
+    rng = random.Random(0)
+    t = 0
+    for cycle in range(200):
+      strings = []
+      for _ in range(rng.randrange(3)):
+        t += 10_000_000
+        frames = []
+        for _ in range(rng.randrange(6)):
+          msg = rng.choice(["VSA_STATUS", "STEERING_CONTROL", "POWERTRAIN_DATA", "SCM_FEEDBACK"])
+          frames.append(packer.make_can_msg(msg, rng.choice([0, 1, 2]), {}))
+        strings.append((t, frames))
+
+      # messages can also be added after the first update
+      if cycle == 100:
+        for cps in (parsers, reference):
+          cps[2].vl["SCM_FEEDBACK"]
+
+      assert demux.update(strings) == [cp.update(strings) for cp in reference]
+      for cp, ref in zip(parsers, reference, strict=True):
+        assert cp.vl == ref.vl
+        assert cp.vl_all == ref.vl_all
+        assert cp.ts_nanos == ref.ts_nanos
+        assert (cp.can_valid, cp.bus_timeout) == (ref.can_valid, ref.bus_timeout)
+
+  def test_multi_bus_parser(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    subscriptions = {
+      "pt": (dbc_file, [("VSA_STATUS", 50), ("STEERING_CONTROL", 0)], 0),
+      "cam": (dbc_file, [("STEERING_CONTROL", 0)], 2),
+    }
+    parsers = MultiBusCANParser.from_subscriptions(subscriptions)
+    reference = {key: CANParser(*sub) for key, sub in subscriptions.items()}
+    assert list(parsers) == ["pt", "cam"]
+    assert parsers["cam"].bus == 2
+
+    packer = CANPacker(dbc_file)
+    for i in range(100):
+      frames = [packer.make_can_msg("STEERING_CONTROL", bus, {"STEER_TORQUE": i}) for bus in (0, 1, 2)]
+      if i < 50:
+        frames.append(packer.make_can_msg("VSA_STATUS", 0, {}))
+      strings = [(i * 20_000_000, frames)]
+      assert parsers.update(strings) == {key: cp.update(strings) for key, cp in reference.items()}
+      for key, cp in reference.items():
+        assert parsers[key].vl == cp.vl
+      assert parsers.can_valid == all(cp.can_valid for cp in reference.values())
+      assert parsers.bus_timeout == any(cp.bus_timeout for cp in reference.values())
+    assert not parsers.can_valid
+
+    # a missing parser is skipped
+    parsers = MultiBusCANParser({"pt": CANParser(dbc_file, [], 0), "radar": None})
+    assert parsers.update([0, []]) == {"pt": set()}
+
+  def test_compact_store(self):
+    """A compact parser must expose the same vl, vl_all and ts_nanos as a regular one"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("VSA_STATUS", 50), ("STEERING_CONTROL", 0), ("POWERTRAIN_DATA", 100)]
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, msgs, 0, compact=True)
+    reference = CANParser(dbc_file, msgs, 0)
+
+    rng = random.Random(0)
+    for i in range(200):
+      frames = []
+      for _ in range(rng.randrange(8)):
+        frames.append(packer.make_can_msg(rng.choice(msgs)[0], 0, {"USER_BRAKE": rng.randrange(100), "STEER_TORQUE": rng.randrange(-100, 100)}))
+      strings = [(i * 10_000_000, frames)]
+      if i == 100:
+        # messages can also be added after the first update
+        parser.vl["SCM_FEEDBACK"]
+        reference.vl["SCM_FEEDBACK"]
+      assert parser.update(strings) == reference.update(strings)
+
+      for msg in reference.vl:
+        assert parser.vl[msg] == reference.vl[msg]
+        assert parser.ts_nanos[msg] == reference.ts_nanos[msg]
+        for sig in reference.vl[msg]:
+          assert parser.vl_all[msg][sig] == reference.vl_all[msg][sig]
+      assert (parser.can_valid, parser.bus_timeout) == (reference.can_valid, reference.bus_timeout)
+
+    # whole-message arrays, in signal order
+    assert parser.vl["VSA_STATUS"].array().tolist() == list(reference.vl["VSA_STATUS"].values())
+
+    # read-only views
+    with pytest.raises(TypeError):
+      parser.vl["VSA_STATUS"]["USER_BRAKE"] = 1  # type: ignore[index]
+
+  def test_compact_store_history(self):
+    """vl_all keeps the most recent frames of an update once the ring buffer wraps"""
+    parser = CANParser("honda_civic_touring_2016_can_generated", [("VSA_STATUS", 50)], 0, compact=True)
+    packer = CANPacker("honda_civic_touring_2016_can_generated")
+    history = parser.store.history
+    brakes = list(range(history + 10))
+    parser.update([0, [packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": b}) for b in brakes]])
+    assert parser.vl_all["VSA_STATUS"]["USER_BRAKE"] == pytest.approx(brakes[-history:])
+    assert parser.vl_all["VSA_STATUS"].array().shape == (history, len(parser.vl["VSA_STATUS"]))
+
+    assert parser.vl_all["VSA_STATUS"].dropped == 10
+
+    parser.update([1, []])
+    assert parser.vl_all["VSA_STATUS"]["USER_BRAKE"] == []
+    assert parser.vl_all["VSA_STATUS"].dropped == 10
+
+  def test_compact_store_history_length(self):
+    """The history length is configurable, a long enough one keeps every frame of an update"""
+    packer = CANPacker("honda_civic_touring_2016_can_generated")
+    brakes = list(range(100))
+    frames = [packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": b}) for b in brakes]
+    regular = CANParser("honda_civic_touring_2016_can_generated", [("VSA_STATUS", 50)], 0)
+    parser = CANParser("honda_civic_touring_2016_can_generated", [("VSA_STATUS", 50)], 0, compact=True, history=len(brakes))
+    for t in range(3):
+      regular.update([t, frames])
+      parser.update([t, frames])
+      assert parser.vl_all["VSA_STATUS"]["USER_BRAKE"] == regular.vl_all["VSA_STATUS"]["USER_BRAKE"] == pytest.approx(brakes)
+    assert parser.vl_all["VSA_STATUS"].dropped == 0
+    assert parser.vl["VSA_STATUS"]["USER_BRAKE"] == pytest.approx(brakes[-1])
+
+  def test_decode_batch(self):
+    """Batch decoding must match decoding frame by frame, including short frames"""
+    for dbc_file in (TEST_DBC, "honda_civic_touring_2016_can_generated", "hyundai_canfd_generated"):
+      parser = CANParser(dbc_file, [], 0)
+      msgs = list(parser.dbc.msgs.values())
+      rng = random.Random(0)
+      frames = []
+      for i in range(2000):
+        msg = rng.choice(msgs)
+        size = msg.size if rng.random() < 0.9 else rng.randint(0, msg.size)
+        frames.append((msg.address, rng.randbytes(size), i))
+      frames.append((0x7FF, b"\x00" * 8, 2000))  # not in DBC
+
+      addresses = np.array([f[0] for f in frames])
+      timestamps = np.array([f[2] for f in frames])
+      decoded = parser.decode_batch(addresses, [f[1] for f in frames], timestamps)
+
+      for msg in msgs:
+        state = MessageState(msg.address, msg.name, msg.size, list(msg.sigs.values()))
+        msg_frames = [f for f in frames if f[0] == msg.address]
+        if not msg_frames:
+          assert msg.name not in decoded
+          continue
+        result = decoded[msg.name]
+        assert result.timestamps.tolist() == [f[2] for f in msg_frames]
+        for j, (_, dat, _) in enumerate(msg_frames):
+          _, vals = state.decode(dat)
+          for sig_name, val in zip(state.signal_names, vals, strict=True):
+            assert result.signals[sig_name][j] == val, (msg.name, sig_name)
+
+    # also accepts a padded payload matrix
+    parser = CANParser(TEST_DBC, [], 0)
+    packer = CANPacker(TEST_DBC)
+    msgs = [packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": steer}) for steer in range(-100, 100)]
+    payloads = np.array([list(dat) for _, dat, _ in msgs], dtype=np.uint8)
+    decoded = parser.decode_batch(np.array([m[0] for m in msgs]), payloads, np.arange(len(msgs)))
+    assert decoded["STEERING_CONTROL"].signals["STEER_TORQUE"].tolist() == list(range(-100, 100))
@@ -0,0 +1,104 @@
+import os
+import random
+import resource
+
+import numpy as np
+import pytest
+
+from opendbc.can import CANPacker, CANParser
+from opendbc.can.dbc import DBC
+from opendbc.can.pipeline import decode_log, get_frame_dtype, read_frames, write_frame_log
+
+DBC_FILE = "honda_civic_touring_2016_can_generated"
+MSGS = ["STEERING_CONTROL", "VSA_STATUS", "POWERTRAIN_DATA", "GAS_PEDAL_2"]
+
+
+def get_frames(n: int) -> list[tuple[int, int, bytes, int]]:
+  packer = CANPacker(DBC_FILE)
+  rng = random.Random(0)
+  frames = []
+  for i in range(n):
+    address, dat, bus = packer.make_can_msg(rng.choice(MSGS), rng.randint(0, 2), {"COUNTER": i % 4, "STEER_TORQUE": rng.randint(-1000, 1000)})
+    if rng.random() < 0.05:
+      dat = dat[:rng.randint(0, len(dat))]
+    frames.append((i * 1_000_000, address, dat, bus))
+  return frames
+
+
+def write_csv(path, frames) -> None:
+  with open(path, "w") as f:
+    f.write("timestamp,bus,address,data\n")
+    for nanos, address, dat, bus in frames:
+      f.write(f"{nanos},{bus},{hex(address)},{dat.hex()}\n")
+
+
+class TestPipeline:
+  @pytest.mark.parametrize("fmt", ["log", "csv"])
+  def test_read_frames(self, tmp_path, fmt):
+    frames = get_frames(1000)
+    path = tmp_path / "frames"
+    if fmt == "log":
+      assert write_frame_log(path, frames, width=8) == len(frames)
+    else:
+      write_csv(path, frames)
+
+    chunks = list(read_frames(path, chunk_frames=300))
+    assert [len(c) for c in chunks] == [300, 300, 300, 100]
+    read = [(int(f["timestamp"]), int(f["address"]), f["data"][:f["length"]].tobytes(), int(f["bus"])) for c in chunks for f in c]
+    assert read == frames
+
+  @pytest.mark.parametrize("workers", [0, 2])
+  def test_decode_log(self, tmp_path, workers):
+    frames = get_frames(5000)
+    write_frame_log(tmp_path / "frames", frames)
+    rows = decode_log(tmp_path / "frames", DBC_FILE, tmp_path / "out", fmt="npy", workers=workers, chunk_frames=700)
+
+    # must match decoding each bus as a whole
+    parser = CANParser(DBC_FILE, [], 0)
+    for bus in range(3):
+      bus_frames = [f for f in frames if f[3] == bus]
+      expected = parser.decode_batch(np.array([f[1] for f in bus_frames]), [f[2] for f in bus_frames], np.array([f[0] for f in bus_frames]))
+      assert {name for b, name in rows if b == bus} == set(expected)
+      for name, decoded in expected.items():
+        assert rows[(bus, name)] == len(decoded.timestamps)
+        msg_dir = tmp_path / "out" / f"{bus}_{name}"
+        assert np.load(msg_dir / "timestamp.npy").tolist() == decoded.timestamps.tolist()
+        for sig_name, values in decoded.signals.items():
+          assert np.array_equal(np.load(msg_dir / f"{sig_name}.npy", mmap_mode="r"), values)
+
+  def test_decode_log_parquet(self, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    frames = get_frames(1000)
+    write_frame_log(tmp_path / "frames", frames)
+    rows = decode_log(tmp_path / "frames", DBC_FILE, tmp_path / "out", fmt="parquet", chunk_frames=300)
+    for (bus, name), count in rows.items():
+      table = pq.read_table(tmp_path / "out" / f"{bus}_{name}")
+      assert table.num_rows == count
+      assert table.column_names[0] == "timestamp"
+
+  @pytest.mark.parametrize("fmt", ["npy", "parquet"])
+  def test_decode_log_fd_limit(self, tmp_path, fmt):
+    if fmt == "parquet":
+      pytest.importorskip("pyarrow.parquet")
+    # every signal of every message on every bus, many more columns than file descriptors
+    dbc = DBC("toyota_new_mc_pt_generated")
+    frames = [(i * 1_000_000, address, bytes(msg.size), bus) for i, (address, msg) in enumerate(sorted(dbc.msgs.items())) for bus in range(3)]
+    write_frame_log(tmp_path / "frames", frames)
+    num_columns = 3 * sum(len(msg.sigs) + 1 for msg in dbc.msgs.values())
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limit = len(os.listdir("/proc/self/fd")) + 96
+    assert num_columns > 10 * limit
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    try:
+      rows = decode_log(tmp_path / "frames", "toyota_new_mc_pt_generated", tmp_path / "out", fmt=fmt, chunk_frames=100)
+    finally:
+      resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    assert len(rows) == 3 * len(dbc.msgs)
+    assert all(count == 1 for count in rows.values())
+    assert sum(len(os.listdir(tmp_path / "out" / f"{bus}_{name}")) for bus, name in rows) == (num_columns if fmt == "npy" else len(rows))
+
+  def test_frame_dtype(self):
+    assert get_frame_dtype(8).itemsize == 24
+    assert get_frame_dtype(64).itemsize == 80
@@ -1,3 +1,8 @@
+from opendbc.car.crc import Crc
+
+BODY_CRC = Crc(8, 0xD5, init=0xFF)
+
+
 def create_control(packer, torque_l, torque_r):
   values = {
     "TORQUE_L": torque_l,
@@ -7,14 +12,7 @@ def create_control(packer, torque_l, torque_r):
   return packer.make_can_msg("TORQUE_CMD", 0, values)
 
 
-def body_checksum(address: int, sig, d: bytearray) -> int:
-  crc = 0xFF
-  poly = 0xD5
-  for i in range(len(d) - 2, -1, -1):
-    crc ^= d[i]
-    for _ in range(8):
-      if crc & 0x80:
-        crc = ((crc << 1) ^ poly) & 0xFF
-      else:
-        crc = (crc << 1) & 0xFF
-  return crc
+def body_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
+  # computed over the payload in reverse, skipping the checksum in the last byte.
+  # copied to bytes first, a reversed memoryview isn't contiguous and can't be passed to crcmod
+  return BODY_CRC(bytes(d)[-2::-1])
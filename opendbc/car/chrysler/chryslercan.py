@@ -1,10 +1,14 @@
 from opendbc.car import structs
-from opendbc.car.crc import CRC8J1850
+from opendbc.car.crc import Crc
 from opendbc.car.chrysler.values import RAM_CARS
 
 GearShifter = structs.CarState.GearShifter
 VisualAlert = structs.CarControl.HUDControl.VisualAlert
 
+CHRYSLER_CRC = Crc(8, 0x1D, init=0xFF, xor_out=0xFF)  # SAE J1850
+FCA_GIORGIO_CRC = Crc(8, 0x1D, xor_out=0x0A)
+FCA_GIORGIO_CRC_XOR_OUT = {0xDE: 0x10, 0x106: 0xF6, 0x122: 0xF1}
+
 
 def create_lkas_hud(packer, CP, lkas_active, hud_alert, hud_count, car_model, auto_high_beam):
   # LKAS_HUD - Controls what lane-keeping icon is displayed
@@ -74,40 +78,8 @@ def create_cruise_buttons(packer, frame, bus, cancel=False, resume=False):
 
 
 def chrysler_checksum(address: int, sig, d: bytearray) -> int:
-  checksum = 0xFF
-  for j in range(len(d) - 1):
-    curr = d[j]
-    shift = 0x80
-    for _ in range(8):
-      bit_sum = curr & shift
-      temp_chk = checksum & 0x80
-      if bit_sum:
-        bit_sum = 0x1C
-        if temp_chk:
-          bit_sum = 1
-        checksum = (checksum << 1) & 0xFF
-        temp_chk = checksum | 1
-        bit_sum ^= temp_chk
-      else:
-        if temp_chk:
-          bit_sum = 0x1D
-        checksum = (checksum << 1) & 0xFF
-        bit_sum ^= checksum
-      checksum = bit_sum & 0xFF
-      shift >>= 1
-  return (~checksum) & 0xFF
+  return CHRYSLER_CRC(d, 0, len(d) - 1)
 
 
 def fca_giorgio_checksum(address: int, sig, d: bytearray) -> int:
-  crc = 0
-  for i in range(len(d) - 1):
-    crc ^= d[i]
-    crc = CRC8J1850[crc]
-  if address == 0xDE:
-    return crc ^ 0x10
-  elif address == 0x106:
-    return crc ^ 0xF6
-  elif address == 0x122:
-    return crc ^ 0xF1
-  else:
-    return crc ^ 0x0A
+  return FCA_GIORGIO_CRC(d, 0, len(d) - 1, xor_out=FCA_GIORGIO_CRC_XOR_OUT.get(address))
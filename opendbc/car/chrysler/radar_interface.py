@@ -27,7 +27,7 @@ def _create_radar_can_parser(car_fingerprint):
                       [20] * msg_n +  # 20Hz (0.05s)
                       [20] * msg_n, strict=True))  # 20Hz (0.05s)
 
-  return CANParser(DBC[car_fingerprint][Bus.radar], messages, 1)
+  return CANParser(DBC[car_fingerprint][Bus.radar], messages, 1, lazy=True)
 
 
 def _address_to_track(address):
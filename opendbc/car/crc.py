@@ -1,30 +1,76 @@
+import crcmod
 
-def _gen_crc8_table(poly: int) -> list[int]:
-  table = []
-  for i in range(256):
-    crc = i
-    for _ in range(8):
-      if crc & 0x80:
-        crc = ((crc << 1) ^ poly) & 0xFF
-      else:
-        crc = (crc << 1) & 0xFF
-    table.append(crc)
-  return table
-
-
-def _gen_crc16_table(poly: int) -> list[int]:
-  table = []
-  for i in range(256):
-    crc = i << 8
-    for _ in range(8):
-      if crc & 0x8000:
-        crc = ((crc << 1) ^ poly) & 0xFFFF
-      else:
-        crc = (crc << 1) & 0xFFFF
-    table.append(crc)
-  return table
-
-
-CRC8H2F = _gen_crc8_table(0x2F)
-CRC8J1850 = _gen_crc8_table(0x1D)
-CRC16_XMODEM = _gen_crc16_table(0x1021)
+
+def reflect(value: int, width: int) -> int:
+  return int(f"{value:0{width}b}"[::-1], 2)
+
+
+class Crc:
+  """
+  Table-driven CRC with arbitrary width (in whole bytes), polynomial, init, final XOR and reflection,
+  using the same parameters as the CRC catalogs. The bulk of the input goes through crcmod's compiled
+  table loop; `table` is the single-byte table for feeding in extra bytes such as per-message magic values.
+
+  Brand checksums declare an instance with their parameters, and override the seed or final XOR per
+  address or length with a lookup table where needed.
+  """
+  def __init__(self, width: int, poly: int, init: int = 0, xor_out: int = 0, reflect_in: bool = False, reflect_out: bool | None = None):
+    assert width % 8 == 0, "width must be a whole number of bytes"
+    self.width = width
+    self.poly = poly
+    self.mask = (1 << width) - 1
+    self.reflect_in = reflect_in
+    self.reflect_out = reflect_in if reflect_out is None else reflect_out
+    self.init = self.seed(init)
+    self.xor_out = xor_out
+    self.table = self._gen_table()
+    # returns the raw register, reflection and final XOR are applied in finish
+    self._update = crcmod.mkCrcFun(poly | (1 << width), initCrc=self.init, rev=reflect_in, xorOut=0)
+
+  def _gen_table(self) -> list[int]:
+    table = []
+    if self.reflect_in:
+      poly = reflect(self.poly, self.width)
+      for i in range(256):
+        crc = i
+        for _ in range(8):
+          crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        table.append(crc)
+    else:
+      top_bit = 1 << (self.width - 1)
+      for i in range(256):
+        crc = i << (self.width - 8)
+        for _ in range(8):
+          crc = ((crc << 1) ^ self.poly) & self.mask if crc & top_bit else (crc << 1) & self.mask
+        table.append(crc)
+    return table
+
+  def seed(self, init: int) -> int:
+    """Convert an init value as given in CRC catalogs to a register value"""
+    return reflect(init, self.width) if self.reflect_in else init
+
+  def update(self, crc: int, data, start: int = 0, end: int | None = None) -> int:
+    """Feed data[start:end] into the register, without the final reflection and XOR"""
+    if start != 0 or end is not None:
+      data = data[start:end]
+    return self._update(data, crc)
+
+  def update_byte(self, crc: int, b: int) -> int:
+    if self.reflect_in:
+      return (crc >> 8) ^ self.table[(crc ^ b) & 0xFF]
+    return ((crc << 8) & self.mask) ^ self.table[(crc >> (self.width - 8)) ^ b]
+
+  def finish(self, crc: int, xor_out: int | None = None) -> int:
+    if self.reflect_out != self.reflect_in:
+      crc = reflect(crc, self.width)
+    return crc ^ (self.xor_out if xor_out is None else xor_out)
+
+  def __call__(self, data, start: int = 0, end: int | None = None, init: int | None = None, xor_out: int | None = None) -> int:
+    crc = self.update(self.init if init is None else self.seed(init), data, start, end)
+    return self.finish(crc, xor_out)
+
+
+# single-byte tables
+CRC8H2F = Crc(8, 0x2F).table
+CRC8J1850 = Crc(8, 0x1D).table
+CRC16_XMODEM = Crc(16, 0x1021).table
@@ -1,8 +1,12 @@
-from opendbc.car.crc import CRC8J1850
+from opendbc.car.crc import Crc
 
 PT_BUS = 0
 DAS_BUS = 1
 
+FIAT_FASTBACK_CRC = Crc(8, 0x1D, init=0xFF, xor_out=0xFF)  # SAE J1850
+# bytes at the end of the message not covered by the CRC, DAS_1 has the checksum on the byte before the last
+FIAT_FASTBACK_CRC_SKIP = {0x2FA: 2}
+
 def create_lkas_command(packer, frame, apply_steer, enabled):
   values = {
     "STEERING_TORQUE": apply_steer,
@@ -51,14 +55,4 @@ def create_friction_brake_command(packer, apply_brake, frame):
   return packer.make_can_msg("ABS_6", DAS_BUS, values)
 
 def fiat_fastback_checksum(address: int, sig, d: bytearray) -> int:
-  crc = 0xFF
-  skip = 1
-  if address == 0x2FA:
-    # DAS_1 has the checksum on the byte before the last
-    skip = 2
-
-  for i in range(len(d) - skip):
-    crc ^= d[i]
-    crc = CRC8J1850[crc]
-
-  return crc ^ 0xFF
\ No newline at end of file
+  return FIAT_FASTBACK_CRC(d, 0, len(d) - FIAT_FASTBACK_CRC_SKIP.get(address, 1))
\ No newline at end of file
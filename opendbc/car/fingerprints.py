@@ -25,6 +25,39 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+class FingerprintIndex:
+  """
+  Inverted index of CAN fingerprints: maps each (address, length) to a bitset of the cars with
+  a fingerprint containing it, so eliminating cars for a message is one lookup and a bitwise AND.
+  Bit i of a candidate set is cars[i].
+  """
+  def __init__(self, fingerprints: dict[str, list[dict[int, int]]]):
+    self.cars = list(fingerprints)
+    self.car_bits = {car: 1 << i for i, car in enumerate(self.cars)}
+    self.index: dict[tuple[int, int], int] = {}
+    # cars with any fingerprint, which are compatible with all addresses ignored for fingerprinting
+    self.all_cars = 0
+    for car, car_fingerprints in fingerprints.items():
+      for fingerprint in car_fingerprints:
+        self.all_cars |= self.car_bits[car]
+        # add alien debug address
+        for address_length in (fingerprint | _DEBUG_ADDRESS).items():
+          self.index[address_length] = self.index.get(address_length, 0) | self.car_bits[car]
+
+  def compatible_cars(self, address: int, length: int) -> int:
+    """Bitset of the cars that could have sent a message"""
+    # ignore addresses that are more than 11 bits
+    if address >= 0x800:
+      return self.all_cars
+    return self.index.get((address, length), 0)
+
+  def to_cars(self, bits: int) -> list[str]:
+    return [car for car in self.cars if bits & self.car_bits[car]]
+
+
+FINGERPRINT_INDEX = FingerprintIndex(_FINGERPRINTS)
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -35,18 +68,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  compatible_cars = FINGERPRINT_INDEX.compatible_cars(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if compatible_cars & FINGERPRINT_INDEX.car_bits[car_name]]
 
 
 def all_legacy_fingerprint_cars():
@@ -73,7 +73,7 @@ def _create_delphi_esr_radar_can_parser(CP) -> CANParser:
   msg_n = len(DELPHI_ESR_RADAR_MSGS)
   messages = list(zip(DELPHI_ESR_RADAR_MSGS, [20] * msg_n, strict=True))
 
-  return CANParser(RADAR.DELPHI_ESR, messages, CanBus(CP).radar)
+  return CANParser(RADAR.DELPHI_ESR, messages, CanBus(CP).radar, lazy=True)
 
 
 def _create_delphi_mrr_radar_can_parser(CP) -> CANParser:
@@ -86,7 +86,7 @@ def _create_delphi_mrr_radar_can_parser(CP) -> CANParser:
     msg = f"MRR_Detection_{i:03d}"
     messages += [(msg, 33)]
 
-  return CANParser(RADAR.DELPHI_MRR, messages, CanBus(CP).radar)
+  return CANParser(RADAR.DELPHI_MRR, messages, CanBus(CP).radar, lazy=True)
 
 
 class RadarInterface(RadarInterfaceBase):
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Re-run FW fingerprinting over a corpus of logged carFw lists, to find regressions after FW version changes.
+
+The corpus is JSON lines, one car per line:
+  {"id": "...", "carFingerprint": "TOYOTA_RAV4", "carVin": "...", "carFw": [{"ecu": "engine", "fwVersion": "<hex>",
+   "address": 2016, "subAddress": 0, "brand": "toyota", "logging": false}, ...]}
+carFingerprint and carVin are optional, carFw entries take any CarParams.CarFw field with fwVersion hex encoded.
+
+Lines are matched in chunks across processes, each of which matches against the FW index built at import.
+"""
+import argparse
+import json
+import os
+from collections import Counter, defaultdict, deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+
+from opendbc.car.structs import CarParams
+from opendbc.car.fw_versions import match_fw_to_car
+
+CHUNK_SIZE = 256
+UNKNOWN_PLATFORM = "UNKNOWN"
+
+
+@dataclass(frozen=True)
+class FwMatchResult:
+  id: str
+  expected: str | None
+  kind: str  # exact, fuzzy or none
+  matches: list[str]
+
+  @property
+  def platform(self) -> str:
+    if self.expected is not None:
+      return self.expected
+    return self.matches[0] if len(self.matches) == 1 else UNKNOWN_PLATFORM
+
+  @property
+  def mismatch(self) -> bool:
+    return self.expected is not None and len(self.matches) > 0 and self.matches != [self.expected]
+
+
+def match_record(record: dict) -> FwMatchResult:
+  car_fw = [CarParams.CarFw(**{**fw, "fwVersion": bytes.fromhex(fw["fwVersion"])}) for fw in record["carFw"]]
+  exact, matches = match_fw_to_car(car_fw, record.get("carVin", ""), log=False)
+  kind = "none" if not matches else "exact" if exact else "fuzzy"
+  return FwMatchResult(str(record["id"]), record.get("carFingerprint"), kind, sorted(str(m) for m in matches))
+
+
+def match_lines(lines: list[str]) -> list[FwMatchResult]:
+  return [match_record(json.loads(line)) for line in lines]
+
+
+def read_chunks(lines: Iterable[str], chunk_size: int = CHUNK_SIZE) -> Iterator[list[str]]:
+  chunk = []
+  for line in lines:
+    if line.strip():
+      chunk.append(line)
+      if len(chunk) == chunk_size:
+        yield chunk
+        chunk = []
+  if chunk:
+    yield chunk
+
+
+def match_corpus(lines: Iterable[str], workers: int = 0, chunk_size: int = CHUNK_SIZE) -> Iterator[FwMatchResult]:
+  """Match every JSON line of a corpus, in order. With workers, chunks are matched across a process pool."""
+  if workers <= 0:
+    for chunk in read_chunks(lines, chunk_size):
+      yield from match_lines(chunk)
+    return
+
+  with ProcessPoolExecutor(workers) as executor:
+    pending: deque[Future] = deque()
+    for chunk in read_chunks(lines, chunk_size):
+      pending.append(executor.submit(match_lines, chunk))
+      if len(pending) > 2 * workers:
+        yield from pending.popleft().result()
+    while pending:
+      yield from pending.popleft().result()
+
+
+def summarize(results: Iterable[FwMatchResult]) -> dict[str, Counter]:
+  """Per-platform counts of exact, fuzzy and no matches, and of matches to other platforms than expected"""
+  summary: defaultdict[str, Counter] = defaultdict(Counter)
+  for result in results:
+    summary[result.platform][result.kind] += 1
+    if result.mismatch:
+      summary[result.platform]["mismatch"] += 1
+  return dict(summary)
+
+
+def diff_results(previous: Iterable[FwMatchResult], results: Iterable[FwMatchResult]) -> list[tuple[FwMatchResult, FwMatchResult]]:
+  """(previous, new) results of the records whose match changed"""
+  previous_by_id = {r.id: r for r in previous}
+  return [(previous_by_id[r.id], r) for r in results
+          if r.id in previous_by_id and (previous_by_id[r.id].kind, previous_by_id[r.id].matches) != (r.kind, r.matches)]
+
+
+def load_results(path: str | os.PathLike) -> list[FwMatchResult]:
+  with open(path) as f:
+    return [FwMatchResult(**json.loads(line)) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Re-fingerprint a corpus of logged FW versions",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("corpus", help="JSON lines of carFw lists")
+  parser.add_argument("--out", help="write the results as JSON lines, to compare against in a later run")
+  parser.add_argument("--previous", help="results of a previous run to diff against")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="matching processes, 0 to match in this process")
+  parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="records per task")
+  args = parser.parse_args()
+
+  with open(args.corpus) as f:
+    results = list(match_corpus(f, args.workers, args.chunk_size))
+
+  if args.out:
+    with open(args.out, "w") as f:
+      for result in results:
+        f.write(json.dumps(asdict(result)) + "\n")
+
+  summary = summarize(results)
+  print(f"{'platform':<40} {'exact':>8} {'fuzzy':>8} {'none':>8} {'mismatch':>8}")
+  for platform, counts in sorted(summary.items()):
+    print(f"{platform:<40} {counts['exact']:>8} {counts['fuzzy']:>8} {counts['none']:>8} {counts['mismatch']:>8}")
+  totals = sum(summary.values(), Counter())
+  print(f"{'total':<40} {totals['exact']:>8} {totals['fuzzy']:>8} {totals['none']:>8} {totals['mismatch']:>8}")
+
+  if args.previous:
+    changed = diff_results(load_results(args.previous), results)
+    print(f"\n{len(changed)} changed since {args.previous}")
+    for old, new in changed:
+      print(f"{new.id}: {old.kind} {old.matches} -> {new.kind} {new.matches}")
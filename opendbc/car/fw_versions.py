@@ -1,6 +1,6 @@
 from collections import defaultdict
-from collections.abc import Callable, Iterator
-from typing import Protocol, TypeVar
+from collections.abc import Callable
+from typing import Protocol
 
 from tqdm import tqdm
 
@@ -10,9 +10,11 @@ from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams
 from opendbc.car.ecu_addrs import get_ecu_addrs
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions
+from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, EcuAddrSubAddr, FwQueryConfig, LiveFwVersions, \
+                                            OfflineFwVersions, Request
 from opendbc.car.interfaces import get_interface_attr
-from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.isotp_parallel_query import IsoTpPipelinedQuery
+from opendbc.car.response_latency import ResponseLatencies
 
 Ecu = CarParams.Ecu
 FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
@@ -23,15 +25,9 @@ VERSIONS = get_interface_attr('FW_VERSIONS', ignore_none=True)
 MODEL_TO_BRAND = {c: b for b, e in VERSIONS.items() for c in e}
 REQUESTS = [(brand, config, r) for brand, config in FW_QUERY_CONFIGS.items() for r in config.requests]
 
-T = TypeVar('T')
 ObdCallback = Callable[[bool], None]
 
 
-def chunks(l: list[T], n: int = 128) -> Iterator[list[T]]:
-  for i in range(0, len(l), n):
-    yield l[i:i + n]
-
-
 def is_brand(brand: str, filter_brand: str | None) -> bool:
   """Returns if brand matches filter_brand or no brand filter is specified"""
   return filter_brand is None or brand == filter_brand
@@ -46,6 +42,80 @@ def build_fw_dict(fw_versions: list[CarParams.CarFw], filter_brand: str | None =
   return dict(fw_versions_dict)
 
 
+class FwIndex:
+  """
+  A FW version database indexed for matching, so matching only does lookups and set operations.
+  Every table is partitioned by brand, with None holding all brands.
+  """
+  def __init__(self, fw_versions: OfflineFwVersions):
+    self.fw_versions = fw_versions
+    self.candidates: dict[str | None, frozenset[str]] = {None: frozenset(fw_versions)}
+    # exact matching, per ECU: (address, cars with the ECU, cars that can't be missing it, FW version -> cars that list it)
+    self.exact_ecus: dict[str | None, list[tuple[AddrType, frozenset[str], frozenset[str], dict[bytes, frozenset[str]]]]] = {}
+    # fuzzy matching: (addr, sub_addr, FW version) -> cars that list it, once per listing
+    self.fuzzy: dict[str | None, dict[tuple[int, int | None, bytes], tuple[str, ...]]] = {}
+
+    for brand in (None, *VERSIONS):
+      candidates = {c: fws for c, fws in fw_versions.items() if is_brand(MODEL_TO_BRAND[c], brand)}
+      self.candidates[brand] = frozenset(candidates)
+
+      ecu_cars: defaultdict[EcuAddrSubAddr, set[str]] = defaultdict(set)
+      ecu_required: defaultdict[EcuAddrSubAddr, set[str]] = defaultdict(set)
+      ecu_versions: defaultdict[EcuAddrSubAddr, defaultdict[bytes, set[str]]] = defaultdict(lambda: defaultdict(set))
+      fuzzy: defaultdict[tuple[int, int | None, bytes], list[str]] = defaultdict(list)
+      for candidate, fws in candidates.items():
+        config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+        for ecu, versions in fws.items():
+          ecu_type = ecu[0]
+          # Virtual debug ecu doesn't need to match the database
+          if ecu_type != Ecu.debug:
+            ecu_cars[ecu].add(candidate)
+            # Some models can sometimes miss an ecu, or show on two different addresses
+            # FIXME: this logic can be improved to be more specific, should require one of the two addresses
+            if ecu_type in ESSENTIAL_ECUS and candidate not in config.non_essential_ecus.get(ecu_type, []):
+              ecu_required[ecu].add(candidate)
+            for version in versions:
+              ecu_versions[ecu][version].add(candidate)
+
+          # See match_fw_to_car_fuzzy for excluded ECUs
+          if ecu_type not in FUZZY_EXCLUDE_ECUS:
+            for version in versions:
+              fuzzy[(ecu[1], ecu[2], version)].append(candidate)
+
+      self.exact_ecus[brand] = [(ecu[1:], frozenset(cars), frozenset(ecu_required[ecu]),
+                                 {version: frozenset(cs) for version, cs in ecu_versions[ecu].items()}) for ecu, cars in ecu_cars.items()]
+      self.fuzzy[brand] = {key: tuple(cs) for key, cs in fuzzy.items()}
+
+  def index_extra_versions(self, extra_fw_versions: OfflineFwVersions) -> dict[AddrType, dict[bytes, frozenset[str]]]:
+    """Index FW versions to accept on top of the database, for ECUs the cars have in it: address -> FW version -> cars"""
+    extra_versions: defaultdict[AddrType, defaultdict[bytes, set[str]]] = defaultdict(lambda: defaultdict(set))
+    for candidate, fws in extra_fw_versions.items():
+      for ecu, versions in fws.items():
+        if ecu in self.fw_versions.get(candidate, {}) and ecu[0] != Ecu.debug:
+          for version in versions:
+            extra_versions[ecu[1:]][version].add(candidate)
+    return {addr: {version: frozenset(cs) for version, cs in versions.items()} for addr, versions in extra_versions.items()}
+
+  def match_exact(self, live_fw_versions: LiveFwVersions, brand: str | None = None,
+                  extra_versions: dict[AddrType, dict[bytes, frozenset[str]]] | None = None) -> set[str]:
+    if brand not in self.candidates:
+      return set()
+    valid = set(self.candidates[brand])
+    for addr, cars, required, versions in self.exact_ecus[brand]:
+      found_versions = live_fw_versions.get(addr)
+      if found_versions:
+        # cars with this ECU are invalid unless any found version is in their list
+        extra = extra_versions.get(addr, {}) if extra_versions else {}
+        valid -= cars.difference(*(versions.get(version, ()) for version in found_versions),
+                                 *(extra.get(version, ()) for version in found_versions))
+      else:
+        valid -= required
+    return valid
+
+
+FW_INDEX = FwIndex(FW_VERSIONS)
+
+
 class MatchFwToCar(Protocol):
   def __call__(self, live_fw_versions: LiveFwVersions, match_brand: str | None = None, log: bool = True) -> set[str]:
     ...
@@ -56,24 +126,12 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | N
   that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
   the match is rejected."""
 
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
-      continue
-
-    if candidate == exclude:
-      continue
-
-    for addr, fws in fw_by_addr.items():
-      # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-      # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-      # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-      # time and only one is in our database.
-      if addr[0] in FUZZY_EXCLUDE_ECUS:
-        continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+  # Lookup table from (addr, sub_addr, fw) to list of candidate cars.
+  # FUZZY_EXCLUDE_ECUS are known to be shared between models (EPS only between hybrid/ICE version)
+  # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+  # impossible to get 3 matching versions, even if two models with shared parts are released at the same
+  # time and only one is in our database.
+  all_fw_versions = FW_INDEX.fuzzy.get(match_brand, {})
 
   matched_ecus = set()
   match: str | None = None
@@ -81,7 +139,9 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | N
     ecu_key = (addr[0], addr[1])
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
+      candidates = all_fw_versions.get((*ecu_key, version), ())
+      if exclude is not None:
+        candidates = tuple(c for c in candidates if c != exclude)
 
       if len(candidates) == 1:
         matched_ecus.add(ecu_key)
@@ -107,40 +167,8 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str | N
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  if extra_fw_versions is None:
-    extra_fw_versions = {}
-
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = live_fw_versions.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
-
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
-        break
-
-  return set(candidates.keys()) - invalid
+  extra_versions = FW_INDEX.index_extra_versions(extra_fw_versions) if extra_fw_versions else None
+  return FW_INDEX.match_exact(live_fw_versions, match_brand, extra_versions)
 
 
 def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: bool = True,
@@ -152,11 +180,14 @@ def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: b
   if allow_fuzzy:
     exact_matches.append((False, match_fw_to_car_fuzzy))
 
+  fw_by_brand: defaultdict[str, list[CarParams.CarFw]] = defaultdict(list)
+  for fw in fw_versions:
+    fw_by_brand[fw.brand].append(fw)
+  fw_versions_dicts = {brand: build_fw_dict(fw_by_brand[brand]) for brand in VERSIONS.keys()}
   for exact_match, match_func in exact_matches:
     # For each brand, attempt to fingerprint using all FW returned from its queries
     matches: set[str] = set()
-    for brand in VERSIONS.keys():
-      fw_versions_dict = build_fw_dict(fw_versions, filter_brand=brand)
+    for brand, fw_versions_dict in fw_versions_dicts.items():
       matches |= match_func(fw_versions_dict, match_brand=brand, log=log)
 
       # If specified and no matches so far, fall back to brand's fuzzy fingerprinting function
@@ -229,7 +260,8 @@ def get_brand_ecu_matches(ecu_rx_addrs: set[EcuAddrBusType]) -> dict[str, list[b
 
 
 def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, vin: str,
-                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, num_pandas: int = 1, progress: bool = False) -> list[CarParams.CarFw]:
+                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, num_pandas: int = 1, progress: bool = False,
+                            latencies: ResponseLatencies | None = None) -> list[CarParams.CarFw]:
   """Queries for FW versions ordering brands by likelihood, breaks when exact match is found"""
 
   all_car_fw = []
@@ -242,7 +274,8 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
     if True not in brand_matches[brand]:
       continue
 
-    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, num_pandas=num_pandas, progress=progress)
+    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, num_pandas=num_pandas, progress=progress,
+                             latencies=latencies)
     all_car_fw.extend(car_fw)
 
     # If there is a match using this brand's FW alone, finish querying early
@@ -254,7 +287,8 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
 
 
 def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str | None = None,
-                    extra: OfflineFwVersions | None = None, timeout: float = 0.1, num_pandas: int = 1, progress: bool = False) -> list[CarParams.CarFw]:
+                    extra: OfflineFwVersions | None = None, timeout: float = 0.1, num_pandas: int = 1, progress: bool = False,
+                    latencies: ResponseLatencies | None = None) -> list[CarParams.CarFw]:
   versions = VERSIONS.copy()
 
   if query_brand is not None:
@@ -264,9 +298,7 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
     versions.update(extra)
 
   # Extract ECU addresses to query from fingerprints
-  # ECUs using a subaddress need be queried one by one, the rest can be done in parallel
   addrs = []
-  parallel_addrs = []
   ecu_types = {}
 
   for brand, brand_versions in versions.items():
@@ -275,54 +307,52 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
       a = (brand, addr, sub_addr)
       if a not in ecu_types:
         ecu_types[a] = ecu_type
+        addrs.append(a)
 
-      if sub_addr is None:
-        if a not in parallel_addrs:
-          parallel_addrs.append(a)
-      else:
-        if [a] not in addrs:
-          addrs.append([a])
-
-  addrs.insert(0, parallel_addrs)
+  # Group requests by bus and OBD multiplexing mode, each group is pipelined through one query
+  request_groups: defaultdict[tuple[int, bool], list[tuple[str, FwQueryConfig, Request]]] = defaultdict(list)
+  for brand, config, r in REQUESTS:
+    # Skip query if no panda available
+    if is_brand(brand, query_brand) and r.bus <= num_pandas * 4 - 1:
+      request_groups[(r.bus, r.obd_multiplexing)].append((brand, config, r))
 
   # Get versions and build capnp list to put into CarParams
   car_fw = []
-  requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
-  for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
-    for addr_chunk in chunks(addr_group):
-      for brand, config, r in requests:
-        # Skip query if no panda available
-        if r.bus > num_pandas * 4 - 1:
-          continue
-
-        # Toggle OBD multiplexing for each request
-        if r.bus % 4 == 1:
-          set_obd_multiplexing(r.obd_multiplexing)
-
-        try:
-          query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
-                         (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
-
-          if query_addrs:
-            query = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
-              f = CarParams.CarFw()
-
-              f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
-              f.fwVersion = version
-              f.address = tx_addr
-              f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
-              f.request = r.request
-              f.brand = brand
-              f.bus = r.bus
-              f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
-              f.obdMultiplexing = r.obd_multiplexing
-
-              if sub_addr is not None:
-                f.subAddress = sub_addr
-
-              car_fw.append(f)
-        except Exception:
-          carlog.exception("FW query exception")
+  for (bus, obd_multiplexing), requests in tqdm(request_groups.items(), disable=not progress):
+    # Toggle OBD multiplexing once for each group
+    if bus % 4 == 1:
+      set_obd_multiplexing(obd_multiplexing)
+
+    queries = []
+    for brand, _, r in requests:
+      query_addrs = [(a, s) for (b, a, s) in addrs if b in (brand, 'any') and
+                     (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
+      queries.append((query_addrs, r.request, r.response, r.rx_offset))
+
+    try:
+      query = IsoTpPipelinedQuery(can_send, can_recv, bus, queries, latencies=latencies)
+      results = query.get_data(timeout)
+    except Exception:
+      carlog.exception("FW query exception")
+      continue
+
+    for query_idx, (brand, config, r) in enumerate(requests):
+      for (tx_addr, sub_addr), version in results.get(query_idx, {}).items():
+        f = CarParams.CarFw()
+
+        f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
+        f.fwVersion = version
+        f.address = tx_addr
+        f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
+        f.request = r.request
+        f.brand = brand
+        f.bus = r.bus
+        f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
+        f.obdMultiplexing = r.obd_multiplexing
+
+        if sub_addr is not None:
+          f.subAddress = sub_addr
+
+        car_fw.append(f)
 
   return car_fw
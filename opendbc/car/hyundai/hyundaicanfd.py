@@ -1,9 +1,13 @@
 import copy
 import numpy as np
 from opendbc.car import CanBusBase
-from opendbc.car.crc import CRC16_XMODEM
+from opendbc.car.crc import Crc
 from opendbc.car.hyundai.values import HyundaiFlags
 
+# CRC16 XMODEM over the payload after the checksum and the address, with a final XOR per message length
+HKG_CAN_FD_CRC = Crc(16, 0x1021)
+HKG_CAN_FD_CRC_XOR_OUT = {8: 0x5F29, 16: 0x041D, 24: 0x819D, 32: 0x9F5B}
+
 
 class CanBus(CanBusBase):
   def __init__(self, CP, fingerprint=None, lka_steering=None) -> None:
@@ -242,17 +246,7 @@ def create_adrv_messages(packer, CAN, frame):
 
 
 def hkg_can_fd_checksum(address: int, sig, d: bytearray) -> int:
-  crc = 0
-  for i in range(2, len(d)):
-    crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ d[i]]) & 0xFFFF
-  crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 0) & 0xFF)]) & 0xFFFF
-  crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 8) & 0xFF)]) & 0xFFFF
-  if len(d) == 8:
-    crc ^= 0x5F29
-  elif len(d) == 16:
-    crc ^= 0x041D
-  elif len(d) == 24:
-    crc ^= 0x819D
-  elif len(d) == 32:
-    crc ^= 0x9F5B
-  return crc
+  crc = HKG_CAN_FD_CRC.update(HKG_CAN_FD_CRC.init, d, 2)
+  crc = HKG_CAN_FD_CRC.update_byte(crc, address & 0xFF)
+  crc = HKG_CAN_FD_CRC.update_byte(crc, (address >> 8) & 0xFF)
+  return HKG_CAN_FD_CRC.finish(crc, HKG_CAN_FD_CRC_XOR_OUT.get(len(d)))
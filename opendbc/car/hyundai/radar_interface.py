@@ -16,7 +16,7 @@ def get_radar_can_parser(CP):
     return None
 
   messages = [(f"RADAR_TRACK_{addr:x}", 50) for addr in range(RADAR_START_ADDR, RADAR_START_ADDR + RADAR_MSG_COUNT)]
-  return CANParser(DBC[CP.carFingerprint][Bus.radar], messages, 1)
+  return CANParser(DBC[CP.carFingerprint][Bus.radar], messages, 1, lazy=True)
 
 
 class RadarInterface(RadarInterfaceBase):
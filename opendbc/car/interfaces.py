@@ -15,7 +15,7 @@ from opendbc.car.common.basedir import BASEDIR
 from opendbc.car.common.conversions import Conversions as CV
 from opendbc.car.common.simple_kalman import KF1D, get_kalman_gain
 from opendbc.car.values import PLATFORMS
-from opendbc.can import CANParser
+from opendbc.can import CANParser, MultiBusCANParser
 
 GearShifter = structs.CarState.GearShifter
 ButtonType = structs.CarState.ButtonEvent.Type
@@ -105,7 +105,8 @@ class CarInterfaceBase(ABC):
     self.v_ego_cluster_seen = False
 
     self.CS: CarStateBase = self.CarState(CP)
-    self.can_parsers: dict[StrEnum, CANParser] = self.CS.get_can_parsers(CP)
+    # all buses are parsed in one pass over the frames
+    self.can_parsers = MultiBusCANParser(self.CS.get_can_parsers(CP))
 
     dbc_names = {bus: cp.dbc_name for bus, cp in self.can_parsers.items()}
     self.CC: CarControllerBase = self.CarController(dbc_names, CP)
@@ -233,15 +234,13 @@ class CarInterfaceBase(ABC):
 
   def update(self, can_packets: list[tuple[int, list[CanData]]]) -> structs.CarState:
     # parse can
-    for cp in self.can_parsers.values():
-      if cp is not None:
-        cp.update(can_packets)
+    self.can_parsers.update(can_packets)
 
     # get CarState
     ret = self.CS.update(self.can_parsers)
 
-    ret.canValid = all(cp.can_valid for cp in self.can_parsers.values())
-    ret.canTimeout = any(cp.bus_timeout for cp in self.can_parsers.values())
+    ret.canValid = self.can_parsers.can_valid
+    ret.canTimeout = self.can_parsers.bus_timeout
 
     if ret.vEgoCluster == 0.0 and not self.v_ego_cluster_seen:
       ret.vEgoCluster = ret.vEgo
@@ -1,31 +1,31 @@
+import heapq
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from functools import partial
 
 from opendbc.car import uds
 from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallable
 from opendbc.car.carlog import carlog
 from opendbc.car.fw_query_definitions import AddrType
+from opendbc.car.response_latency import LatencyKey, ResponseLatencies
 
 
-class IsoTpParallelQuery:
-  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, addrs: list[int] | list[AddrType],
-               request: list[bytes], response: list[bytes], response_offset: int = 0x8,
-               functional_addrs: list[int] | None = None, response_pending_timeout: float = 10) -> None:
+class IsoTpQueryBase:
+  """Buffers received frames per rx address and creates the ISO-TP messages reading from them"""
+  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, response_pending_timeout: float = 10,
+               latencies: ResponseLatencies | None = None, separation_time: float = 0.01, tx_dl: int = 8) -> None:
     self.can_send = can_send
     self.can_recv = can_recv
     self.bus = bus
-    self.request = request
-    self.response = response
-    self.functional_addrs = functional_addrs or []
     self.response_pending_timeout = response_pending_timeout
-
-    real_addrs = [a if isinstance(a, tuple) else (a, None) for a in addrs]
-    for tx_addr, _ in real_addrs:
-      assert tx_addr not in uds.FUNCTIONAL_ADDRS, f"Functional address should be defined in functional_addrs: {hex(tx_addr)}"
-
-    self.msg_addrs = {tx_addr: uds.get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in real_addrs}
-    self.msg_buffer: dict[int, list[CanData]] = defaultdict(list)
+    self.latencies = latencies
+    # separation time asked of ECUs between their consecutive frames, and the length of the frames sent (64 for CAN FD)
+    self.separation_time = separation_time
+    self.tx_dl = tx_dl
+    self.rx_addrs: set[int] = set()
+    self.msg_buffer: dict[int, deque[CanData]] = defaultdict(deque)
+    # rx addresses with frames received since they were last processed
+    self.ready: set[int] = set()
 
   def rx(self) -> None:
     """Drain can socket and sort messages into buffers based on address"""
@@ -33,8 +33,10 @@ class IsoTpParallelQuery:
 
     for packet in can_packets:
       for msg in packet:
-        if msg.src == self.bus and msg.address in self.msg_addrs.values():
-          self.msg_buffer[msg.address].append(CanData(msg.address, msg.dat, msg.src))
+        # buffer the received frames as-is, their payloads are only read
+        if msg.src == self.bus and msg.address in self.rx_addrs:
+          self.msg_buffer[msg.address].append(msg)
+          self.ready.add(msg.address)
 
   def _can_tx(self, tx_addr: int, dat: bytes, bus: int):
     """Helper function to send single message"""
@@ -43,35 +45,79 @@ class IsoTpParallelQuery:
 
   def _can_rx(self, addr, sub_addr=None):
     """Helper function to retrieve message with specified address and subaddress from buffer"""
-    keep_msgs = []
-
+    buffer = self.msg_buffer[addr]
     if sub_addr is None:
-      msgs = self.msg_buffer[addr]
-    else:
-      # Filter based on subaddress
-      msgs = []
-      for m in self.msg_buffer[addr]:
-        first_byte = m[1][0]
-        if first_byte == sub_addr:
-          msgs.append(m)
-        else:
-          keep_msgs.append(m)
+      msgs = list(buffer)
+      buffer.clear()
+      return msgs
 
-    self.msg_buffer[addr] = keep_msgs
+    # Filter based on subaddress
+    msgs = []
+    for _ in range(len(buffer)):
+      m = buffer.popleft()
+      if m[1][0] == sub_addr:
+        msgs.append(m)
+      else:
+        buffer.append(m)
     return msgs
 
   def _drain_rx(self) -> None:
     self.can_recv()
-    self.msg_buffer = defaultdict(list)
+    self.msg_buffer = defaultdict(deque)
+    self.ready.clear()
 
   def _create_isotp_msg(self, tx_addr: int, sub_addr: int | None, rx_addr: int):
     can_client = uds.CanClient(self._can_tx, partial(self._can_rx, rx_addr, sub_addr=sub_addr), tx_addr, rx_addr,
                                self.bus, sub_addr=sub_addr)
 
-    # uses iso-tp frame separation time of 10 ms
+    # uses iso-tp frame separation time of 10 ms by default
     # TODO: use single_frame_mode so ECUs can send as fast as they want,
     # as well as reduces chances we process messages from previous queries
-    return uds.IsoTpMessage(can_client, timeout=0, separation_time=0.01)
+    return uds.IsoTpMessage(can_client, timeout=0, separation_time=self.separation_time, tx_dl=self.tx_dl)
+
+  def _latency_key(self, tx_addr: AddrType, request: bytes) -> LatencyKey:
+    return (self.bus, tx_addr[0], tx_addr[1], request)
+
+  def _response_timeout(self, key: LatencyKey, timeout: float) -> float:
+    """Time to wait for the first response, longer for addresses known to answer slower than timeout"""
+    return timeout if self.latencies is None else self.latencies.get_timeout(key, timeout)
+
+  def _is_absent(self, key: LatencyKey) -> bool:
+    return self.latencies is not None and self.latencies.is_absent(key)
+
+  def _add_response(self, key: LatencyKey, latency: float) -> None:
+    if self.latencies is not None:
+      self.latencies.add_response(key, latency)
+
+  def _add_timeout(self, key: LatencyKey, waited: float) -> None:
+    if self.latencies is not None:
+      self.latencies.add_timeout(key, waited)
+
+  def _add_skip(self, key: LatencyKey) -> None:
+    if self.latencies is not None:
+      self.latencies.add_skip(key)
+
+
+class IsoTpParallelQuery(IsoTpQueryBase):
+  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, addrs: list[int] | list[AddrType],
+               request: list[bytes], response: list[bytes], response_offset: int = 0x8,
+               functional_addrs: list[int] | None = None, response_pending_timeout: float = 10,
+               latencies: ResponseLatencies | None = None, separation_time: float = 0.01, tx_dl: int = 8) -> None:
+    super().__init__(can_send, can_recv, bus, response_pending_timeout, latencies, separation_time, tx_dl)
+    self.request = request
+    self.response = response
+    self.functional_addrs = functional_addrs or []
+
+    real_addrs = [a if isinstance(a, tuple) else (a, None) for a in addrs]
+    for tx_addr, _ in real_addrs:
+      assert tx_addr not in uds.FUNCTIONAL_ADDRS, f"Functional address should be defined in functional_addrs: {hex(tx_addr)}"
+
+    self.msg_addrs = {tx_addr: uds.get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in real_addrs}
+    self.rx_addrs = set(self.msg_addrs.values())
+    # several sub addresses can share an rx address
+    self.rx_to_tx: dict[int, list[AddrType]] = defaultdict(list)
+    for tx_addr, rx_addr in self.msg_addrs.items():
+      self.rx_to_tx[rx_addr].append(tx_addr)
 
   def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
     self._drain_rx()
@@ -79,11 +125,9 @@ class IsoTpParallelQuery:
     # Create message objects
     msgs = {}
     request_counter = {}
-    request_done = {}
     for tx_addr, rx_addr in self.msg_addrs.items():
       msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
       request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
 
     # Send first request to functional addrs, subsequent responses are handled on physical addrs
     if len(self.functional_addrs):
@@ -98,22 +142,39 @@ class IsoTpParallelQuery:
     results = {}
     start_time = time.monotonic()
     addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
-    response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
+    pending = set(self.msg_addrs)  # requests not finished or timed out
+    tx_addrs = list(self.msg_addrs)
+    tx_idxs = {tx_addr: i for i, tx_addr in enumerate(tx_addrs)}
+    latency_keys = {tx_addr: self._latency_key(tx_addr, self.request[0]) for tx_addr in tx_addrs}
+    response_timeouts = {tx_addr: start_time + self._response_timeout(latency_keys[tx_addr], timeout) for tx_addr in tx_addrs}
+    # addresses that have never answered, the query doesn't wait on them
+    absent = {tx_addr for tx_addr in tx_addrs if self._is_absent(latency_keys[tx_addr])}
+    # min-heap of (deadline, index into tx_addrs), an entry is stale once its address' timeout is extended
+    deadlines = [(response_timeouts[tx_addr], i) for i, tx_addr in enumerate(tx_addrs)]
+    heapq.heapify(deadlines)
+
+    def set_timeout(tx_addr: AddrType, deadline: float) -> None:
+      response_timeouts[tx_addr] = deadline
+      heapq.heappush(deadlines, (deadline, tx_idxs[tx_addr]))
+
     while True:
       self.rx()
 
-      for tx_addr, msg in msgs.items():
+      # only process the addresses that received frames
+      ready, self.ready = self.ready, set()
+      for tx_addr in (tx_addr for rx_addr in ready for tx_addr in self.rx_to_tx[rx_addr]):
+        msg = msgs[tx_addr]
         try:
           dat, rx_in_progress = msg.recv()
         except Exception:
           carlog.exception(f"Error processing UDS response: {tx_addr}")
-          request_done[tx_addr] = True
+          pending.discard(tx_addr)
           continue
 
         # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
         if rx_in_progress:
           addrs_responded.add(tx_addr)
-          response_timeouts[tx_addr] = time.monotonic() + timeout
+          set_timeout(tx_addr, time.monotonic() + timeout)
 
         if dat is None:
           continue
@@ -121,7 +182,7 @@ class IsoTpParallelQuery:
         # Log unexpected empty responses
         if len(dat) == 0:
           carlog.error(f"iso-tp query empty response: {tx_addr}")
-          request_done[tx_addr] = True
+          pending.discard(tx_addr)
           continue
 
         counter = request_counter[tx_addr]
@@ -130,37 +191,44 @@ class IsoTpParallelQuery:
 
         if response_valid:
           if counter + 1 < len(self.request):
-            response_timeouts[tx_addr] = time.monotonic() + timeout
+            set_timeout(tx_addr, time.monotonic() + timeout)
             msg.send(self.request[counter + 1])
             request_counter[tx_addr] += 1
           else:
             results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
+            pending.discard(tx_addr)
+            self._add_response(latency_keys[tx_addr], time.monotonic() - start_time)
         else:
           error_code = dat[2] if len(dat) > 2 else -1
           if error_code == 0x78:
-            response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
+            set_timeout(tx_addr, time.monotonic() + self.response_pending_timeout)
             carlog.error(f"iso-tp query response pending: {tx_addr}")
           else:
-            request_done[tx_addr] = True
+            pending.discard(tx_addr)
+            self._add_response(latency_keys[tx_addr], time.monotonic() - start_time)
             carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
 
       # Mark request done if address timed out
       cur_time = time.monotonic()
-      for tx_addr in response_timeouts:
-        if cur_time - response_timeouts[tx_addr] > 0:
-          if not request_done[tx_addr]:
-            if request_counter[tx_addr] > 0:
-              carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
-            elif tx_addr in addrs_responded:
-              carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
-            # TODO: handle functional addresses
-            # else:
-            #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
-          request_done[tx_addr] = True
-
-      # Break if all requests are done (finished or timed out)
-      if all(request_done.values()):
+      while deadlines and deadlines[0][0] < cur_time:
+        deadline, i = heapq.heappop(deadlines)
+        tx_addr = tx_addrs[i]
+        if deadline != response_timeouts[tx_addr] or tx_addr not in pending:
+          continue
+        if request_counter[tx_addr] > 0:
+          carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
+        elif tx_addr in addrs_responded:
+          carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
+        else:
+          # TODO: handle functional addresses
+          # carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
+          self._add_timeout(latency_keys[tx_addr], cur_time - start_time)
+        pending.discard(tx_addr)
+
+      # Break if all requests are done (finished or timed out), not waiting on absent addresses
+      if pending <= absent:
+        for tx_addr in pending:
+          self._add_skip(latency_keys[tx_addr])
         break
 
       if cur_time - start_time > total_timeout:
@@ -168,3 +236,171 @@ class IsoTpParallelQuery:
         break
 
     return results
+
+
+class IsoTpPipelinedQuery(IsoTpQueryBase):
+  """
+  Runs several queries on one bus, each a (addrs, request, response, response_offset) like IsoTpParallelQuery's arguments.
+  Every tx address works through its queries in order and is sent the next one as soon as the previous one finishes,
+  instead of waiting for the slowest address. Sub-addressed ECUs share a tx address, so are queried one at a time.
+  """
+  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int,
+               queries: list[tuple[list[AddrType], list[bytes], list[bytes], int]], response_pending_timeout: float = 10,
+               max_in_flight: int = 128, latencies: ResponseLatencies | None = None, separation_time: float = 0.01,
+               tx_dl: int = 8) -> None:
+    super().__init__(can_send, can_recv, bus, response_pending_timeout, latencies, separation_time, tx_dl)
+    self.queries = queries
+    self.max_in_flight = max_in_flight
+
+    # (query index, tx address, rx address) per address of every query, queued per tx address
+    self.jobs: list[tuple[int, AddrType, int]] = []
+    self.lanes: dict[int, deque[int]] = defaultdict(deque)
+    for query_idx, (addrs, _, _, response_offset) in enumerate(queries):
+      for tx_addr in addrs:
+        assert tx_addr[0] not in uds.FUNCTIONAL_ADDRS, f"Functional addresses can't be pipelined: {hex(tx_addr[0])}"
+        self.lanes[tx_addr[0]].append(len(self.jobs))
+        self.jobs.append((query_idx, tx_addr, uds.get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset)))
+    self.rx_addrs = {rx_addr for _, _, rx_addr in self.jobs}
+    self.latency_keys = [self._latency_key(tx_addr, queries[query_idx][1][0]) for query_idx, tx_addr, _ in self.jobs]
+
+  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[int, dict[AddrType, bytes]]:
+    """Responses to each query by index, timeout applies to each request of a query"""
+    self._drain_rx()
+
+    lanes = {tx_addr: deque(jobs) for tx_addr, jobs in self.lanes.items()}
+    waiting = dict.fromkeys(lanes)  # tx addresses with queued jobs and none in flight
+    active: dict[int, int] = {}  # rx address -> job in flight
+    msgs: dict[int, uds.IsoTpMessage] = {}
+    request_counter: dict[int, int] = {}
+    response_timeouts: dict[int, float] = {}
+    deadlines: list[tuple[float, int]] = []  # min-heap of (deadline, job), stale once the job's timeout is extended or it's done
+    addrs_responded = set()  # track jobs that have ever received a valid iso-tp frame for timeout logging
+    start_times: dict[int, float] = {}
+    results: dict[int, dict[AddrType, bytes]] = defaultdict(dict)
+    # jobs not done yet, the query doesn't wait on the ones to addresses that have never answered
+    remaining = set(range(len(self.jobs)))
+    absent = {job for job in remaining if self._is_absent(self.latency_keys[job])}
+
+    def set_timeout(job: int, deadline: float) -> None:
+      response_timeouts[job] = deadline
+      heapq.heappush(deadlines, (deadline, job))
+
+    def start_jobs() -> None:
+      for tx_addr in list(waiting):
+        if len(active) >= self.max_in_flight:
+          break
+        job = lanes[tx_addr][0]
+        query_idx, (_, sub_addr), rx_addr = self.jobs[job]
+        # another address responds on the same rx address
+        if rx_addr in active:
+          continue
+
+        lanes[tx_addr].popleft()
+        del waiting[tx_addr]
+        active[rx_addr] = job
+        # frames left over from a previous job on this rx address
+        self.msg_buffer[rx_addr].clear()
+        self.ready.discard(rx_addr)
+
+        msgs[job] = self._create_isotp_msg(tx_addr, sub_addr, rx_addr)
+        request_counter[job] = 0
+        start_times[job] = time.monotonic()
+        set_timeout(job, start_times[job] + self._response_timeout(self.latency_keys[job], timeout))
+        msgs[job].send(self.queries[query_idx][1][0])
+
+    def finish_job(job: int) -> None:
+      _, (tx_addr, _), rx_addr = self.jobs[job]
+      del active[rx_addr]
+      del response_timeouts[job]
+      remaining.discard(job)
+      if lanes[tx_addr]:
+        waiting[tx_addr] = None
+
+    start_jobs()
+    start_time = time.monotonic()
+    while active and not remaining <= absent:
+      self.rx()
+
+      # only process the addresses that received frames
+      ready, self.ready = self.ready, set()
+      finished = False
+      for rx_addr in ready:
+        job = active.get(rx_addr)
+        if job is None:
+          continue
+
+        query_idx, tx_addr, _ = self.jobs[job]
+        _, request, response, _ = self.queries[query_idx]
+        msg = msgs[job]
+        try:
+          dat, rx_in_progress = msg.recv()
+        except Exception:
+          carlog.exception(f"Error processing UDS response: {tx_addr}")
+          finish_job(job)
+          finished = True
+          continue
+
+        # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
+        if rx_in_progress:
+          addrs_responded.add(job)
+          set_timeout(job, time.monotonic() + timeout)
+
+        if dat is None:
+          continue
+
+        # Log unexpected empty responses
+        if len(dat) == 0:
+          carlog.error(f"iso-tp query empty response: {tx_addr}")
+          finish_job(job)
+          finished = True
+          continue
+
+        counter = request_counter[job]
+        expected_response = response[counter]
+        if dat.startswith(expected_response):
+          if counter + 1 < len(request):
+            set_timeout(job, time.monotonic() + timeout)
+            msg.send(request[counter + 1])
+            request_counter[job] += 1
+          else:
+            results[query_idx][tx_addr] = dat[len(expected_response):]
+            self._add_response(self.latency_keys[job], time.monotonic() - start_times[job])
+            finish_job(job)
+            finished = True
+        else:
+          error_code = dat[2] if len(dat) > 2 else -1
+          if error_code == 0x78:
+            set_timeout(job, time.monotonic() + self.response_pending_timeout)
+            carlog.error(f"iso-tp query response pending: {tx_addr}")
+          else:
+            carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
+            self._add_response(self.latency_keys[job], time.monotonic() - start_times[job])
+            finish_job(job)
+            finished = True
+
+      # Finish jobs that timed out
+      cur_time = time.monotonic()
+      while deadlines and deadlines[0][0] < cur_time:
+        deadline, job = heapq.heappop(deadlines)
+        if response_timeouts.get(job) != deadline:
+          continue
+        if request_counter[job] > 0:
+          carlog.error(f"iso-tp query timeout after receiving partial response: {self.jobs[job][1]}")
+        elif job in addrs_responded:
+          carlog.error(f"iso-tp query timeout while receiving response: {self.jobs[job][1]}")
+        else:
+          self._add_timeout(self.latency_keys[job], cur_time - start_times[job])
+        finish_job(job)
+        finished = True
+
+      # the next query of every address that finished one
+      if finished:
+        start_jobs()
+
+      if cur_time - start_time > total_timeout:
+        carlog.error("iso-tp query timeout while receiving data")
+        break
+
+    for job in remaining & absent:
+      self._add_skip(self.latency_keys[job])
+    return dict(results)
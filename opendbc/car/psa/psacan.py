@@ -1,8 +1,9 @@
 def psa_checksum(address: int, sig, d: bytearray) -> int:
   chk_ini = {0x452: 0x4, 0x38D: 0x7, 0x42D: 0xC}.get(address, 0xB)
   byte = sig.start_bit // 8
-  d[byte] &= 0x0F if sig.start_bit % 8 >= 4 else 0xF0
   checksum = sum((b >> 4) + (b & 0xF) for b in d)
+  # the checksum nibble itself doesn't count
+  checksum -= (d[byte] >> 4) if sig.start_bit % 8 >= 4 else (d[byte] & 0xF)
   return (chk_ini - checksum) & 0xF
 
 
@@ -0,0 +1,134 @@
+"""
+Learned ISO-TP query response latencies, per (bus, tx address, sub address, request).
+
+Queries use them to stop waiting once every address that has ever answered is done, and to wait longer than their
+timeout on addresses known to answer slower than it. The statistics can be saved to a small JSON file between drives
+and inspected to see which ECUs dominate query time.
+"""
+import json
+import os
+from dataclasses import asdict, dataclass, fields
+
+from opendbc.car.carlog import carlog
+
+LatencyKey = tuple[int, int, int | None, bytes]  # bus, tx address, sub address, request
+
+# weight of the newest latency in the running mean
+MEAN_ALPHA = 0.2
+# saved files of another version are dropped
+LATENCY_FILE_VERSION = 1
+
+
+@dataclass
+class LatencyStats:
+  responses: int = 0
+  timeouts: int = 0
+  mean: float = 0.
+  max: float = 0.
+  # seconds queries spent waiting on this address, answered or not
+  total_wait: float = 0.
+  # queries that didn't wait on this address since it last timed out
+  skipped: int = 0
+
+  def add_response(self, latency: float) -> None:
+    self.mean = latency if self.responses == 0 else self.mean + MEAN_ALPHA * (latency - self.mean)
+    self.max = max(self.max, latency)
+    self.responses += 1
+    self.total_wait += latency
+
+  def add_timeout(self, waited: float) -> None:
+    # an address that has answered before may have slowed down, it's waited on longer next time
+    if self.responses > 0:
+      self.max = max(self.max, waited)
+    self.timeouts += 1
+    self.skipped = 0
+    self.total_wait += waited
+
+  def add_skip(self) -> None:
+    self.skipped += 1
+
+
+class ResponseLatencies:
+  """
+  An address is waited on for the query's timeout, or its slowest response or timed out wait times safety_factor
+  plus margin if that's longer, up to max_timeout. One that has never answered in min_timeouts queries is expected
+  to be absent: it's still sent the request, but queries don't wait on it, except every reprobe_interval-th query
+  in case it came up late.
+  """
+  def __init__(self, safety_factor: float = 1.5, margin: float = 0.02, max_timeout: float = 1., min_timeouts: int = 3,
+               reprobe_interval: int = 10):
+    self.safety_factor = safety_factor
+    self.margin = margin
+    self.max_timeout = max_timeout
+    self.min_timeouts = min_timeouts
+    self.reprobe_interval = reprobe_interval
+    self.stats: dict[LatencyKey, LatencyStats] = {}
+
+  def get_timeout(self, key: LatencyKey, timeout: float) -> float:
+    stats = self.stats.get(key)
+    if stats is None or stats.responses == 0:
+      return timeout
+    return max(timeout, min(stats.max * self.safety_factor + self.margin, self.max_timeout))
+
+  def is_absent(self, key: LatencyKey) -> bool:
+    stats = self.stats.get(key)
+    return (stats is not None and stats.responses == 0 and stats.timeouts >= self.min_timeouts and
+            stats.skipped < self.reprobe_interval - 1)
+
+  def add_response(self, key: LatencyKey, latency: float) -> None:
+    self.stats.setdefault(key, LatencyStats()).add_response(latency)
+
+  def add_timeout(self, key: LatencyKey, waited: float) -> None:
+    self.stats.setdefault(key, LatencyStats()).add_timeout(waited)
+
+  def add_skip(self, key: LatencyKey) -> None:
+    """Record a query that didn't wait on an absent address"""
+    self.stats.setdefault(key, LatencyStats()).add_skip()
+
+  def summary(self) -> list[tuple[LatencyKey, LatencyStats]]:
+    """Statistics of every address, the ones queries spent the most time waiting on first"""
+    return sorted(self.stats.items(), key=lambda item: item[1].total_wait, reverse=True)
+
+  def save(self, path: str | os.PathLike) -> None:
+    """Save the statistics to path. Failing to is logged, the statistics are only an optimization"""
+    rows = [{"bus": bus, "address": addr, "subAddress": sub_addr, "request": request.hex(), **asdict(stats)}
+            for (bus, addr, sub_addr, request), stats in self.stats.items()]
+    tmp_path = f"{path}.tmp"
+    try:
+      with open(tmp_path, "w") as f:
+        json.dump({"version": LATENCY_FILE_VERSION, "stats": rows}, f)
+      os.replace(tmp_path, path)
+    except OSError:
+      carlog.exception(f"failed to save response latencies to {path}")
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+  def load(self, path: str | os.PathLike) -> None:
+    """
+    Add the statistics saved to path. A missing file is the same as an empty one, and an unreadable one,
+    or one saved by another version, is logged and ignored
+    """
+    try:
+      with open(path) as f:
+        data = json.load(f)
+    except FileNotFoundError:
+      return
+    except (OSError, ValueError):
+      carlog.exception(f"failed to load response latencies from {path}")
+      return
+
+    if not isinstance(data, dict) or data.get("version") != LATENCY_FILE_VERSION:
+      carlog.warning(f"ignoring response latencies from {path}, saved by another version")
+      return
+
+    # fields of another LatencyStats are ignored, missing ones start from their defaults
+    names = {f.name for f in fields(LatencyStats)}
+    stats: dict[LatencyKey, LatencyStats] = {}
+    try:
+      for row in data["stats"]:
+        key = (row["bus"], row["address"], row["subAddress"], bytes.fromhex(row["request"]))
+        stats[key] = LatencyStats(**{name: value for name, value in row.items() if name in names})
+    except (TypeError, KeyError, ValueError):
+      carlog.exception(f"failed to load response latencies from {path}")
+      return
+    self.stats.update(stats)
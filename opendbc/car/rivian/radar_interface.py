@@ -11,7 +11,7 @@ RADAR_MSG_COUNT = 32
 
 def get_radar_can_parser(CP):
   messages = [(f"RADAR_TRACK_{addr:x}", 20) for addr in range(RADAR_START_ADDR, RADAR_START_ADDR + RADAR_MSG_COUNT)]
-  return CANParser(DBC[CP.carFingerprint][Bus.radar], messages, 1)
+  return CANParser(DBC[CP.carFingerprint][Bus.radar], messages, 1, lazy=True)
 
 
 class RadarInterface(RadarInterfaceBase):
@@ -1,14 +1,18 @@
+from functools import cache
+
+from opendbc.car.crc import Crc
+
+# CRC8 SAE J1850 polynomial with a final XOR per message
+RIVIAN_CRC = Crc(8, 0x1D)
+
+
+@cache
+def get_crc8(poly: int) -> Crc:
+  return RIVIAN_CRC if poly == RIVIAN_CRC.poly else Crc(8, poly)
+
+
 def checksum(data, poly, xor_output):
-  crc = 0
-  for byte in data:
-    crc ^= byte
-    for _ in range(8):
-      if crc & 0x80:
-        crc = (crc << 1) ^ poly
-      else:
-        crc <<= 1
-      crc &= 0xFF
-  return crc ^ xor_output
+  return get_crc8(poly)(data, xor_out=xor_output)
 
 
 def create_lka_steering(packer, frame, acm_lka_hba_cmd, apply_torque, enabled, active):
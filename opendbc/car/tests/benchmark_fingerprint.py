@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+End-to-end fingerprint() of simulated cars: the time it takes on the car, and the CPU time it takes on the host.
+
+The cars' ECUs answer the FW queries with their versions in FW_VERSIONS, see opendbc.car.virtual_can.
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.car_helpers import fingerprint
+from opendbc.car.carlog import carlog
+from opendbc.car.fingerprints import FW_VERSIONS
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, MODEL_TO_BRAND
+from opendbc.car.interfaces import get_interface_attr
+from opendbc.car.virtual_can import VirtualCanBus, get_virtual_ecus
+
+VIN = "1FTEW1E58JFA00001"
+FINGERPRINTS = get_interface_attr('FINGERPRINTS', combine_brands=True, ignore_none=True)
+
+
+@dataclass
+class FingerprintResult:
+  car: str
+  candidate: str | None
+  exact: bool
+  # seconds on the simulated clock, and of host CPU
+  sim_time: float
+  cpu_time: float
+
+
+def get_benchmark_cars(brand: str | None = None) -> list[str]:
+  """Platforms of the brands with FW queries"""
+  return [car for car in sorted(FW_VERSIONS) if len(FW_QUERY_CONFIGS[MODEL_TO_BRAND[car]].requests) and
+          (brand is None or MODEL_TO_BRAND[car] == brand)]
+
+
+def benchmark_car(car: str, num_pandas: int = 1, seed: int = 0, random_versions: bool = False, **ecu_kwargs) -> FingerprintResult:
+  ecus = get_virtual_ecus(car, vin=VIN, rng=random.Random(seed) if random_versions else None, **ecu_kwargs)
+  # the first CAN fingerprint of the platform, if it has one
+  traffic = [CanData(addr, bytes(length), 0) for addr, length in FINGERPRINTS.get(car, [{}])[0].items()]
+
+  cpu_time = time.process_time()
+  with VirtualCanBus(ecus, traffic=traffic, seed=seed) as can_bus:
+    candidate, _, _, _, _, exact = fingerprint(can_bus.can_recv, can_bus.can_send, can_bus.set_obd_multiplexing, num_pandas, None)
+  return FingerprintResult(car, candidate, exact, can_bus.now, time.process_time() - cpu_time)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark fingerprinting simulated cars", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--brand", help="only benchmark this brand's platforms")
+  parser.add_argument("--num-pandas", type=int, default=1)
+  parser.add_argument("--latency", type=float, default=0.005, help="ECU response latency in seconds")
+  parser.add_argument("--response-pending", type=int, default=0, help="response pending messages before each response")
+  parser.add_argument("--drop-rate", type=float, default=0., help="probability of an ECU ignoring a request")
+  parser.add_argument("--random-versions", action="store_true", help="answer with a random FW version of each ECU instead of the first")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--verbose", action="store_true", help="log the queries")
+  args = parser.parse_args()
+
+  if not args.verbose:
+    carlog.setLevel("CRITICAL")
+
+  results = defaultdict(list)
+  for car in get_benchmark_cars(args.brand):
+    result = benchmark_car(car, args.num_pandas, args.seed, args.random_versions, latency=args.latency,
+                           response_pending=args.response_pending, drop_rate=args.drop_rate)
+    results[MODEL_TO_BRAND[car]].append(result)
+    if result.candidate != car or not result.exact:
+      print(f"{car}: fingerprinted as {result.candidate}, exact={result.exact}")
+
+  print(f"{'brand':<12} {'cars':>5} {'matched':>8} {'mean (s)':>9} {'max (s)':>8} {'cpu (ms)':>9}")
+  for brand, brand_results in sorted(results.items()):
+    matched = sum(r.candidate == r.car and r.exact for r in brand_results)
+    sim_times = [r.sim_time for r in brand_results]
+    cpu_time = sum(r.cpu_time for r in brand_results) / len(brand_results)
+    print(f"{brand:<12} {len(brand_results):>5} {matched:>8} {sum(sim_times) / len(sim_times):>9.2f} {max(sim_times):>8.2f} {cpu_time * 1000:>9.1f}")
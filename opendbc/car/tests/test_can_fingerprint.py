@@ -1,7 +1,9 @@
+import random
+
 import pytest
 from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from opendbc.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from opendbc.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS as FINGERPRINTS, eliminate_incompatible_cars, is_valid_for_fingerprint
 
 
 class TestCanFingerprint:
@@ -21,6 +23,21 @@ class TestCanFingerprint:
       assert finger[1] == fingerprint
       assert finger[2] == {}
 
+  def test_eliminate_incompatible_cars(self):
+    """The fingerprint index must eliminate the same cars as checking every fingerprint"""
+    rng = random.Random(0)
+    addresses = [(address, length) for fingerprints in FINGERPRINTS.values() for fingerprint in fingerprints for address, length in fingerprint.items()]
+    for _ in range(2000):
+      address, length = rng.choice(addresses)
+      if rng.random() < 0.2:
+        length = rng.randint(0, 8)
+      if rng.random() < 0.1:
+        address = rng.choice([*_DEBUG_ADDRESS, 0x800, 0x18DAF110, rng.randint(0, 0x7FF)])
+      msg = CanData(address=address, dat=b'\x00' * length, src=0)
+      candidate_cars = rng.sample(list(FINGERPRINTS), rng.randint(0, len(FINGERPRINTS)))
+      expected = [car for car in candidate_cars if any(is_valid_for_fingerprint(msg, fp | _DEBUG_ADDRESS) for fp in FINGERPRINTS[car])]
+      assert eliminate_incompatible_cars(msg, candidate_cars) == expected
+
   def test_timing(self, subtests):
     # just pick any CAN fingerprinting car
     car_model = "CHEVROLET_BOLT_EUV"
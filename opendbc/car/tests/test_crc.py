@@ -0,0 +1,50 @@
+import pytest
+
+from opendbc.car.crc import Crc
+from opendbc.car.rivian.riviancan import checksum as rivian_checksum
+
+CHECK_DATA = b"123456789"
+
+
+class TestCrc:
+  # (width, poly, init, xor_out, reflect), check value from the CRC catalogs
+  @pytest.mark.parametrize("params, check", [
+    ((8, 0x07, 0x00, 0x00, False), 0xF4),  # CRC-8/SMBUS
+    ((8, 0x1D, 0xFF, 0xFF, False), 0x4B),  # CRC-8/SAE-J1850
+    ((8, 0x2F, 0xFF, 0xFF, False), 0xDF),  # CRC-8/AUTOSAR
+    ((8, 0x9B, 0x00, 0x00, True), 0x25),  # CRC-8/WCDMA
+    ((16, 0x1021, 0x0000, 0x0000, False), 0x31C3),  # CRC-16/XMODEM
+    ((16, 0x1021, 0xB2AA, 0x0000, True), 0x63D0),  # CRC-16/RIELLO
+    ((24, 0x864CFB, 0xB704CE, 0x000000, False), 0x21CF02),  # CRC-24/OPENPGP
+    ((32, 0x04C11DB7, 0xFFFFFFFF, 0xFFFFFFFF, True), 0xCBF43926),  # CRC-32/ISO-HDLC
+  ])
+  def test_catalog(self, params, check):
+    width, poly, init, xor_out, reflect = params
+    crc = Crc(width, poly, init=init, xor_out=xor_out, reflect_in=reflect)
+    assert crc(CHECK_DATA) == check
+    assert crc(bytearray(CHECK_DATA)) == check
+    assert crc(b"\x00\x00" + CHECK_DATA + b"\x00", 2, -1) == check
+
+    # byte at a time must match the bulk update
+    reg = crc.init
+    for b in CHECK_DATA:
+      reg = crc.update_byte(reg, b)
+    assert crc.finish(reg) == check
+
+  def test_overrides(self):
+    crc = Crc(8, 0x1D, xor_out=0x0A)
+    assert crc(CHECK_DATA, xor_out=0x10) == crc(CHECK_DATA) ^ 0x0A ^ 0x10
+    assert crc(CHECK_DATA, init=0xFF, xor_out=0xFF) == 0x4B
+
+  @pytest.mark.parametrize("poly", [0x1D, 0x07, 0x2F])
+  def test_rivian_checksum(self, poly):
+    def reference(data, poly, xor_output):
+      crc = 0
+      for byte in data:
+        crc ^= byte
+        for _ in range(8):
+          crc = ((crc << 1) ^ poly if crc & 0x80 else crc << 1) & 0xFF
+      return crc ^ xor_output
+
+    for xor_output in (0x00, 0x63, 0xD1):
+      assert rivian_checksum(CHECK_DATA, poly, xor_output) == reference(CHECK_DATA, poly, xor_output)
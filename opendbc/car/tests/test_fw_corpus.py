@@ -0,0 +1,53 @@
+import json
+import random
+
+import pytest
+
+from opendbc.car.structs import CarParams
+from opendbc.car.fingerprints import FW_VERSIONS
+from opendbc.car.fw_corpus import FwMatchResult, diff_results, load_results, match_corpus, summarize
+from opendbc.car.fw_versions import MODEL_TO_BRAND, match_fw_to_car
+
+Ecu = CarParams.Ecu
+ECU_NAME = {v: k for k, v in Ecu.schema.enumerants.items()}
+
+
+def get_corpus(n: int) -> list[dict]:
+  rng = random.Random(0)
+  cars = sorted(FW_VERSIONS)
+  corpus = []
+  for i in range(n):
+    car = rng.choice(cars)
+    fw = [{"ecu": ECU_NAME[ecu], "fwVersion": (rng.choice(versions) if rng.random() < 0.95 else b"unknown").hex(),
+           "address": addr, "subAddress": sub_addr or 0, "brand": MODEL_TO_BRAND[car]}
+          for (ecu, addr, sub_addr), versions in FW_VERSIONS[car].items() if rng.random() < 0.9]
+    corpus.append({"id": str(i), "carFingerprint": str(car), "carFw": fw})
+  return corpus
+
+
+class TestFwCorpus:
+  @pytest.mark.parametrize("workers", [0, 2])
+  def test_match_corpus(self, workers):
+    corpus = get_corpus(300)
+    results = list(match_corpus([json.dumps(r) + "\n" for r in corpus], workers=workers, chunk_size=64))
+
+    assert [r.id for r in results] == [r["id"] for r in corpus]
+    for record, result in zip(corpus, results, strict=True):
+      car_fw = [CarParams.CarFw(**{**fw, "fwVersion": bytes.fromhex(fw["fwVersion"])}) for fw in record["carFw"]]
+      exact, matches = match_fw_to_car(car_fw, "", log=False)
+      assert result.matches == sorted(matches)
+      assert result.kind == ("none" if not matches else "exact" if exact else "fuzzy")
+
+    summary = summarize(results)
+    assert sum(sum(c[k] for k in ("exact", "fuzzy", "none")) for c in summary.values()) == len(corpus)
+    assert sum(c["mismatch"] for c in summary.values()) == sum(r.mismatch for r in results)
+
+  def test_diff_results(self, tmp_path):
+    previous = [FwMatchResult("0", "A", "exact", ["A"]), FwMatchResult("1", None, "fuzzy", ["B"]), FwMatchResult("2", None, "none", [])]
+    path = tmp_path / "previous.jsonl"
+    path.write_text("".join(json.dumps(r.__dict__) + "\n" for r in previous))
+    assert load_results(path) == previous
+
+    results = [FwMatchResult("0", "A", "exact", ["A"]), FwMatchResult("1", None, "none", []), FwMatchResult("3", None, "none", [])]
+    assert diff_results(previous, results) == [(previous[1], results[1])]
+    assert summarize(results) == {"A": {"exact": 1}, "UNKNOWN": {"none": 2}}
@@ -7,8 +7,9 @@ from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import interfaces
 from opendbc.car.structs import CarParams
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, build_fw_dict, \
-                                    match_fw_to_car, get_brand_ecu_matches, get_fw_versions, get_present_ecus
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, MODEL_TO_BRAND, VERSIONS, FwIndex, build_fw_dict, \
+                                    match_fw_to_car, match_fw_to_car_exact, match_fw_to_car_fuzzy, get_brand_ecu_matches, \
+                                    get_fw_versions, get_present_ecus
 from opendbc.car.vin import get_vin
 
 CarFw = CarParams.CarFw
@@ -178,6 +179,28 @@ class TestFwFingerprint:
       for request_ecu in request_ecus:
         assert request_ecu in {e for e, _, _ in version_ecus}, f"Ecu.{ECU_NAME[request_ecu]} not in {brand} FW versions"
 
+  def test_extra_fw_versions(self):
+    rng = random.Random(0)
+    for car_model in rng.sample(sorted(FW_VERSIONS), 20):
+      brand = MODEL_TO_BRAND[car_model]
+      ecus = [ecu for ecu in FW_VERSIONS[car_model] if ecu[0] != Ecu.debug]
+      new_ecu = rng.choice(ecus)
+      # a new version of one ECU, and one for an ECU the car doesn't have, which is ignored
+      extra_fw_versions = {car_model: {new_ecu: [b"new version"], (Ecu.unknown, 0x123, None): [b"new version"]}}
+      live_fw_versions = {ecu[1:]: {b"new version" if ecu == new_ecu else FW_VERSIONS[car_model][ecu][0]} for ecu in ecus}
+
+      # must match indexing the merged database
+      merged = {c: {ecu: fws + extra_fw_versions.get(c, {}).get(ecu, []) for ecu, fws in fw_by_addr.items()} for c, fw_by_addr in FW_VERSIONS.items()}
+      expected = FwIndex(merged).match_exact(live_fw_versions, brand)
+      assert car_model in expected
+      assert match_fw_to_car_exact(live_fw_versions, brand, extra_fw_versions=extra_fw_versions) == expected
+      assert car_model not in match_fw_to_car_exact(live_fw_versions, brand)
+
+  def test_unknown_brand(self):
+    live_fw_versions = {(0x7e0, None): {b"version"}}
+    assert match_fw_to_car_exact(live_fw_versions, "unknown") == set()
+    assert match_fw_to_car_fuzzy(live_fw_versions, "unknown") == set()
+
   def test_brand_ecu_matches(self):
     brand_matches = get_brand_ecu_matches(set())
     assert len(brand_matches) > 0
@@ -216,9 +239,15 @@ class TestFwFingerprintTiming:
     self.total_time += timeout
     return {}
 
+  def fake_pipelined_get_data(self, query, timeout):
+    """Without responses, each address waits out the timeout of every query sent to it in turn"""
+    self.total_time += max((len(jobs) for jobs in query.lanes.values()), default=0) * timeout
+    return {}
+
   def _benchmark_brand(self, brand, num_pandas, mocker):
     self.total_time = 0
-    mocker.patch("opendbc.car.isotp_parallel_query.IsoTpParallelQuery.get_data", self.fake_get_data)
+    mocker.patch("opendbc.car.isotp_parallel_query.IsoTpPipelinedQuery.get_data",
+                 lambda query, timeout: self.fake_pipelined_get_data(query, timeout))
     for _ in range(self.N):
       # Treat each brand as the most likely (aka, the first) brand with OBD multiplexing initially on
       self.current_obd_multiplexing = True
@@ -260,27 +289,27 @@ class TestFwFingerprintTiming:
         print(f'get_vin {name} case, query time={self.total_time / self.N} seconds')
 
   def test_fw_query_timing(self, subtests, mocker):
-    total_ref_time = {1: 7.4, 2: 8.0}
+    total_ref_time = {1: 6.4, 2: 7.0}
     brand_ref_times = {
       1: {
         'gm': 1.0,
         'body': 0.1,
-        'chrysler': 0.3,
+        'chrysler': 0.2,
         'fiat': 0.3,
-        'ford': 1.5,
+        'ford': 1.2,
         'honda': 0.45,
         'hyundai': 0.65,
         'mazda': 0.1,
         'nissan': 0.8,
         'subaru': 0.65,
         'tesla': 0.1,
-        'toyota': 0.7,
-        'volkswagen': 0.65,
+        'toyota': 0.4,
+        'volkswagen': 0.35,
         'rivian': 0.3,
         'psa': 0.1,
       },
       2: {
-        'ford': 1.6,
+        'ford': 1.3,
         'hyundai': 1.15,
       }
     }
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from opendbc.car.uds import CAN_FRAME_LENGTHS, CanClient, IsoTpMessage, get_frame_length, get_separation_time
+
+
+class Loopback:
+  """A tester and an ECU IsoTpMessage connected in memory, recording every frame on the bus"""
+  def __init__(self, sub_addr: int | None = None, **kwargs):
+    self.frames: list[tuple[str, bytes]] = []
+    self.inbox: dict[str, list[bytes]] = {"tester": [], "ecu": []}
+    self.tester = IsoTpMessage(self._can_client("tester", "ecu", 0x7E0, 0x7E8, sub_addr), timeout=0, **kwargs)
+    self.ecu = IsoTpMessage(self._can_client("ecu", "tester", 0x7E8, 0x7E0, sub_addr), timeout=0, **kwargs)
+
+  def _can_client(self, name: str, other: str, tx_addr: int, rx_addr: int, sub_addr: int | None) -> CanClient:
+    def can_send(addr: int, dat: bytes, bus: int) -> None:
+      self.frames.append((name, dat))
+      self.inbox[other].append(dat)
+
+    def can_recv() -> list[tuple[int, bytes, int]]:
+      msgs = [(rx_addr, dat, 0) for dat in self.inbox[name]]
+      self.inbox[name].clear()
+      return msgs
+
+    return CanClient(can_send, can_recv, tx_addr, rx_addr, 0, sub_addr=sub_addr)
+
+  def transfer(self, request: bytes, response: bytes) -> None:
+    self.ecu.send(b"", setup_only=True)
+    self.tester.send(request)
+    while (dat := self.ecu.recv()[0]) is None:
+      self.tester.recv()
+    assert dat == request
+
+    self.ecu.send(response)
+    while (dat := self.tester.recv()[0]) is None:
+      self.ecu.recv()
+    assert dat == response
+
+
+class TestIsoTp:
+  @pytest.mark.parametrize("sub_addr", [None, 0xF])
+  @pytest.mark.parametrize("tx_dl", [8, 64])
+  def test_transfer(self, tx_dl, sub_addr):
+    rng = random.Random(0)
+    for length in (1, 6, 7, 8, 61, 62, 63, 100, 0xFFF, 0x1000, 10000):
+      loopback = Loopback(sub_addr, tx_dl=tx_dl)
+      loopback.transfer(rng.randbytes(length), rng.randbytes(length))
+      sub_addr_len = 0 if sub_addr is None else 1
+      assert all(len(dat) in CAN_FRAME_LENGTHS and len(dat) <= tx_dl for _, dat in loopback.frames)
+      assert all(dat[:sub_addr_len] == bytes([sub_addr] if sub_addr is not None else []) for _, dat in loopback.frames)
+
+  def test_can_fd_frames(self):
+    loopback = Loopback(tx_dl=64)
+    # short single frames keep the classic length byte, longer ones are escaped
+    loopback.transfer(b"\x22\xf1\x90", bytes(30))
+    assert loopback.frames[0][1] == b"\x03\x22\xf1\x90".ljust(8, b"\x00")
+    assert loopback.frames[1][1] == (b"\x00\x1e" + bytes(30)).ljust(32, b"\x00")
+
+    # first frames over 4095 bytes escape the length, consecutive frames carry 63 bytes
+    response = bytes(range(256)) * 20
+    loopback = Loopback(tx_dl=64)
+    loopback.transfer(b"\x22\xf1\x90", response)
+    ecu_frames = [dat for name, dat in loopback.frames if name == "ecu"]
+    assert ecu_frames[0][:6] == b"\x10\x00" + len(response).to_bytes(4, "big")
+    assert len(ecu_frames) == 1 + -(-(len(response) - 58) // 63)
+
+    classic = Loopback(tx_dl=8)
+    classic.transfer(b"\x22\xf1\x90", response)
+    assert len([name for name, _ in classic.frames if name == "ecu"]) > 8 * len(ecu_frames)
+
+  def test_block_size(self):
+    loopback = Loopback(block_size=4)
+    loopback.transfer(b"\x22\xf1\x90", bytes(200))
+    # 6 bytes in the first frame, 28 consecutive frames, flow control after the first frame and every 4 consecutive frames
+    tester_frames = [dat for name, dat in loopback.frames if name == "tester"]
+    assert [dat[:2] for dat in tester_frames[1:]] == [b"\x30\x04"] * 7
+
+  def test_separation_time(self):
+    assert get_separation_time(0x00) == 0
+    assert get_separation_time(0x7F) == 0.127
+    assert get_separation_time(0xF1) == pytest.approx(0.0001)
+    assert get_separation_time(0xF9) == pytest.approx(0.0009)
+    assert get_separation_time(0x80) == 0.127
+
+  def test_frame_length(self):
+    assert [get_frame_length(n) for n in (0, 8, 9, 12, 13, 33, 64)] == [8, 8, 12, 12, 16, 48, 64]
+    with pytest.raises(ValueError):
+      get_frame_length(65)
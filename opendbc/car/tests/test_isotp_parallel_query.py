@@ -0,0 +1,252 @@
+import json
+import time
+
+import pytest
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery, IsoTpPipelinedQuery
+from opendbc.car.response_latency import ResponseLatencies
+from opendbc.car.virtual_can import VirtualCanBus, VirtualEcu
+
+REQUEST = b"\x22\xf1\x90"
+RESPONSE = b"\x62\xf1\x90"
+VIN = b"1HGCM82633A004352"
+SW_REQUEST = b"\x22\xf1\x88"
+SW_RESPONSE = b"\x62\xf1\x88"
+SW_VERSION = b"SW-1234567890"
+
+
+class FakeEcu:
+  """Responds to a read data by identifier with a multi-frame response, as memoryviews over a reused buffer"""
+  def __init__(self, tx_addr: int, bus: int, responses: dict[bytes, bytes] | None = None):
+    self.tx_addr = tx_addr
+    self.bus = bus
+    self.pending: list[CanData] = []
+    self.received: list[CanData] = []
+    self.responses = responses if responses is not None else {REQUEST: RESPONSE + VIN}
+    self.response = b""
+
+  def _send_frame(self, dat: bytes) -> None:
+    frame = CanData(self.tx_addr + 8, memoryview(bytearray(dat.ljust(8, b"\x00"))), self.bus)
+    self.pending.append(frame)
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    for msg in msgs:
+      if msg.address != self.tx_addr:
+        continue
+      request = bytes(msg.dat[1:1 + msg.dat[0]])
+      if msg.dat[0] >> 4 == 0 and request in self.responses:
+        self.response = self.responses[request]
+        # first frame
+        self._send_frame(bytes([0x10 | (len(self.response) >> 8), len(self.response) & 0xFF]) + self.response[:6])
+      elif msg.dat[0] == 0x30:
+        # consecutive frames
+        for idx, i in enumerate(range(6, len(self.response), 7)):
+          self._send_frame(bytes([0x20 | ((idx + 1) & 0xF)]) + self.response[i:i + 7])
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    msgs, self.pending = self.pending, []
+    self.received += msgs
+    return [msgs]
+
+
+class TestIsoTpParallelQuery:
+  def test_rx_buffers_frames_as_is(self):
+    ecu = FakeEcu(0x7E0, 0)
+    ecu._send_frame(b"\x03\x62\xf1\x90")
+    query = IsoTpParallelQuery(ecu.can_send, ecu.can_recv, 0, [0x7E0], [REQUEST], [RESPONSE])
+    query.rx()
+    assert list(query.msg_buffer[0x7E8]) == ecu.received
+    assert query.ready == {0x7E8}
+    assert all(a is b for a, b in zip(query.msg_buffer[0x7E8], ecu.received, strict=True))
+
+  def test_memoryview_frames(self):
+    ecu = FakeEcu(0x7E0, 0)
+    query = IsoTpParallelQuery(ecu.can_send, ecu.can_recv, 0, [0x7E0], [REQUEST], [RESPONSE])
+    results = query.get_data(0.1)
+    assert results == {(0x7E0, None): VIN}
+    assert isinstance(results[(0x7E0, None)], bytes)
+
+  def test_timeout_without_response(self):
+    ecu = FakeEcu(0x7E0, 0)
+    query = IsoTpParallelQuery(ecu.can_send, ecu.can_recv, 0, [0x7E0, 0x7E1, (0x7E2, 0x1)], [REQUEST], [RESPONSE])
+    assert query.rx_to_tx == {0x7E8: [(0x7E0, None)], 0x7E9: [(0x7E1, None)], 0x7EA: [(0x7E2, 0x1)]}
+    results = query.get_data(0.05)
+    assert results == {(0x7E0, None): VIN}
+
+  def test_learned_latencies(self):
+    timeout = 0.3
+    ecus = [VirtualEcu(0, 0x7E0, responses={REQUEST: RESPONSE + VIN}), VirtualEcu(0, 0x7E1, negative_response=False)]
+    latencies = ResponseLatencies(min_timeouts=2)
+    durations = []
+    with VirtualCanBus(ecus) as can_bus:
+      for _ in range(3):
+        query = IsoTpParallelQuery(can_bus.can_send, can_bus.can_recv, 0, [0x7E0, 0x7E1], [REQUEST], [RESPONSE], latencies=latencies)
+        start = can_bus.now
+        assert query.get_data(timeout) == {(0x7E0, None): VIN}
+        durations.append(can_bus.now - start)
+
+    responsive, silent = latencies.stats[(0, 0x7E0, None, REQUEST)], latencies.stats[(0, 0x7E1, None, REQUEST)]
+    assert (responsive.responses, responsive.timeouts) == (3, 0)
+    assert (silent.responses, silent.timeouts, silent.skipped) == (0, 2, 1)
+    assert latencies.is_absent((0, 0x7E1, None, REQUEST))
+    # fast answers never shorten the timeout
+    assert latencies.get_timeout((0, 0x7E0, None, REQUEST), timeout) == timeout
+    assert [key for key, _ in latencies.summary()] == [(0, 0x7E1, None, REQUEST), (0, 0x7E0, None, REQUEST)]
+    # once the silent ECU is known to be absent, the query stops when the responsive one answers
+    assert durations[0] >= timeout and durations[1] >= timeout
+    assert durations[2] < timeout / 10
+
+  def test_slow_ecu_still_found(self):
+    ecu = VirtualEcu(0, 0x7E0, responses={REQUEST: RESPONSE + VIN})
+    latencies = ResponseLatencies()
+    found = []
+    with VirtualCanBus([ecu]) as can_bus:
+      for latency in (0.005, 0.005, 0.005, 0.06, 0.15, 0.15):
+        ecu.latency = latency
+        query = IsoTpParallelQuery(can_bus.can_send, can_bus.can_recv, 0, [0x7E0], [REQUEST], [RESPONSE], latencies=latencies)
+        found.append(query.get_data(0.1) == {(0x7E0, None): VIN})
+        # let any late response go by
+        time.sleep(1)
+
+    # an ECU slower than the timeout is missed once, then waited on longer
+    assert found == [True, True, True, True, False, True]
+    assert latencies.get_timeout((0, 0x7E0, None, REQUEST), 0.1) > 0.15
+
+  def test_absent_ecu_reprobed(self):
+    ecu = VirtualEcu(0, 0x7E0, responses={REQUEST: RESPONSE + VIN}, latency=0.05, drop_rate=1)
+    latencies = ResponseLatencies(min_timeouts=3, reprobe_interval=5)
+    found = []
+    with VirtualCanBus([ecu]) as can_bus:
+      for i in range(10):
+        # the ECU comes up late
+        if i == 3:
+          ecu.drop_rate = 0
+        query = IsoTpParallelQuery(can_bus.can_send, can_bus.can_recv, 0, [0x7E0], [REQUEST], [RESPONSE], latencies=latencies)
+        found.append(bool(query.get_data(0.1)))
+        time.sleep(1)
+
+    # absent after three timeouts, it's not waited on until the fifth query since it last timed out
+    assert found == [False] * 7 + [True] * 3
+    assert not latencies.is_absent((0, 0x7E0, None, REQUEST))
+
+
+class TestIsoTpPipelinedQuery:
+  def test_pipelined_queries(self):
+    timeout = 0.2
+    responsive = VirtualEcu(0, 0x7E0, responses={REQUEST: RESPONSE + VIN, SW_REQUEST: SW_RESPONSE + SW_VERSION}, latency=0.02)
+    silent = VirtualEcu(0, 0x7E1, negative_response=False)
+    queries = [([(0x7E0, None), (0x7E1, None)], [REQUEST], [RESPONSE], 0x8),
+               ([(0x7E0, None), (0x7E1, None)], [SW_REQUEST], [SW_RESPONSE], 0x8)]
+
+    with VirtualCanBus([responsive, silent]) as can_bus:
+      query = IsoTpPipelinedQuery(can_bus.can_send, can_bus.can_recv, 0, queries)
+      assert {tx_addr: list(jobs) for tx_addr, jobs in query.lanes.items()} == {0x7E0: [0, 2], 0x7E1: [1, 3]}
+      sent = []
+      query.can_send = lambda msgs: (sent.extend((can_bus.now, msg.address, bytes(msg.dat)) for msg in msgs), can_bus.can_send(msgs))
+      results = query.get_data(timeout)
+      duration = can_bus.now
+
+    assert results == {0: {(0x7E0, None): VIN}, 1: {(0x7E0, None): SW_VERSION}}
+    # single frame requests, leaving out flow control
+    requests = [(t, address, dat[1:1 + dat[0]]) for t, address, dat in sent if dat[0] >> 4 == 0]
+    assert [(address, request) for _, address, request in requests] == [(0x7E0, REQUEST), (0x7E1, REQUEST), (0x7E0, SW_REQUEST), (0x7E1, SW_REQUEST)]
+    # the responsive ECU gets its second query as soon as it answers, without waiting for the silent one to time out
+    assert requests[2][0] == pytest.approx(0.03)
+    assert requests[3][0] == pytest.approx(timeout)
+    assert duration == pytest.approx(2 * timeout)
+
+  def test_sub_addresses_one_at_a_time(self):
+    ecus = [VirtualEcu(0, 0x750, sub_addr=sub_addr, negative_response=False) for sub_addr in (0x1, 0x2)]
+    queries = [([(0x750, 0x1), (0x750, 0x2)], [REQUEST], [RESPONSE], 0x8)]
+    with VirtualCanBus(ecus) as can_bus:
+      query = IsoTpPipelinedQuery(can_bus.can_send, can_bus.can_recv, 0, queries)
+      assert list(query.lanes[0x750]) == [0, 1]
+      sent = []
+      query.can_send = lambda msgs: (sent.extend((can_bus.now, msg.dat[0]) for msg in msgs), can_bus.can_send(msgs))
+      assert query.get_data(0.05) == {}
+
+    # the second sub address is only queried once the first one timed out
+    assert [sub_addr for _, sub_addr in sent] == [0x1, 0x2]
+    assert [can_bus.requests(ecu) for ecu in ecus] == [[REQUEST], [REQUEST]]
+    # the timeout is noticed on the next 10 ms poll
+    assert sent[1][0] == pytest.approx(0.06)
+
+  def test_learned_latencies(self):
+    timeout = 0.3
+    ecus = [VirtualEcu(0, 0x7E0, responses={REQUEST: RESPONSE + VIN, SW_REQUEST: SW_RESPONSE + SW_VERSION}),
+            VirtualEcu(0, 0x7E1, negative_response=False)]
+    queries = [([(0x7E0, None), (0x7E1, None)], [REQUEST], [RESPONSE], 0x8),
+               ([(0x7E0, None), (0x7E1, None)], [SW_REQUEST], [SW_RESPONSE], 0x8)]
+    latencies = ResponseLatencies()
+    for request in (REQUEST, SW_REQUEST):
+      for _ in range(latencies.min_timeouts):
+        latencies.add_timeout((0, 0x7E1, None, request), timeout)
+
+    with VirtualCanBus(ecus) as can_bus:
+      results = IsoTpPipelinedQuery(can_bus.can_send, can_bus.can_recv, 0, queries, latencies=latencies).get_data(timeout)
+      assert can_bus.now < timeout / 2
+    assert results == {0: {(0x7E0, None): VIN}, 1: {(0x7E0, None): SW_VERSION}}
+    assert latencies.stats[(0, 0x7E0, None, SW_REQUEST)].responses == 1
+    assert latencies.stats[(0, 0x7E1, None, SW_REQUEST)].skipped == 1
+
+
+class TestResponseLatencies:
+  def test_save_load(self, tmp_path):
+    latencies = ResponseLatencies()
+    latencies.add_response((0, 0x7E0, None, REQUEST), 0.01)
+    latencies.add_response((0, 0x7E0, None, REQUEST), 0.03)
+    latencies.add_timeout((1, 0x750, 0xF, SW_REQUEST), 0.1)
+    assert latencies.get_timeout((0, 0x7E0, None, REQUEST), 0.05) == 0.03 * latencies.safety_factor + latencies.margin
+    assert latencies.get_timeout((0, 0x7E0, None, REQUEST), 0.1) == 0.1
+    assert latencies.get_timeout((1, 0x750, 0xF, SW_REQUEST), 0.1) == 0.1
+    assert not latencies.is_absent((1, 0x750, 0xF, SW_REQUEST))
+
+    latencies.save(tmp_path / "latencies.json")
+    loaded = ResponseLatencies()
+    loaded.load(tmp_path / "latencies.json")
+    assert loaded.stats == latencies.stats
+    loaded.load(tmp_path / "missing.json")
+    assert loaded.stats == latencies.stats
+
+  def get_saved(self, tmp_path) -> dict:
+    latencies = ResponseLatencies()
+    latencies.add_response((0, 0x7E0, None, REQUEST), 0.01)
+    latencies.save(tmp_path / "latencies.json")
+    with open(tmp_path / "latencies.json") as f:
+      return json.load(f)
+
+  def load(self, tmp_path, data) -> ResponseLatencies:
+    with open(tmp_path / "latencies.json", "w") as f:
+      f.write(data if isinstance(data, str) else json.dumps(data))
+    latencies = ResponseLatencies()
+    latencies.load(tmp_path / "latencies.json")
+    return latencies
+
+  def test_load_corrupt(self, tmp_path):
+    saved = json.dumps(self.get_saved(tmp_path))
+    assert self.load(tmp_path, saved[:len(saved) // 2]).stats == {}
+    assert self.load(tmp_path, b"\xff\xfe".decode("latin1")).stats == {}
+    assert self.load(tmp_path, {"version": 1, "stats": 3}).stats == {}
+    # the list saved before files had a version
+    assert self.load(tmp_path, self.get_saved(tmp_path)["stats"]).stats == {}
+    assert self.load(tmp_path, {**self.get_saved(tmp_path), "version": 0}).stats == {}
+
+  def test_load_extra_field(self, tmp_path):
+    saved = self.get_saved(tmp_path)
+    saved["stats"][0]["new_field"] = 1
+    stats = self.load(tmp_path, saved).stats[(0, 0x7E0, None, REQUEST)]
+    assert (stats.responses, stats.max) == (1, 0.01)
+
+  def test_load_missing_field(self, tmp_path):
+    saved = self.get_saved(tmp_path)
+    del saved["stats"][0]["skipped"]
+    assert self.load(tmp_path, saved).stats[(0, 0x7E0, None, REQUEST)].skipped == 0
+    del saved["stats"][0]["bus"]
+    assert self.load(tmp_path, saved).stats == {}
+
+  def test_save_failure(self, tmp_path):
+    latencies = ResponseLatencies()
+    latencies.add_response((0, 0x7E0, None, REQUEST), 0.01)
+    latencies.save(tmp_path / "missing_dir" / "latencies.json")
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,175 @@
+import asyncio
+import struct
+import time
+
+import pytest
+
+from opendbc.car.uds import DATA_IDENTIFIER_TYPE, SESSION_TYPE, MessageTimeoutError, NegativeResponseError
+from opendbc.car.uds_async import AsyncCanBus, AsyncUdsClient
+
+DID = DATA_IDENTIFIER_TYPE.APPLICATION_SOFTWARE_IDENTIFICATION
+PENDING_DID = DATA_IDENTIFIER_TYPE.VIN
+
+
+class FakeEcu:
+  """Answers UDS requests with its own ISO-TP framing, after a fixed response latency"""
+  def __init__(self, can: 'FakeCan', tx_addr: int, latency: float, separation_time: int = 1):
+    self.can = can
+    self.tx_addr = tx_addr
+    self.rx_addr = tx_addr + 8
+    self.latency = latency
+    self.separation_time = separation_time
+    self.data = {DID: f"FW-{hex(tx_addr)}-".encode().ljust(40, b"x"), PENDING_DID: b"1HGCM82633A004352"}
+    self.rx_dat = b""
+    self.rx_len = 0
+    self.tx_frames: list[bytes] = []
+    self.consecutive_times: list[float] = []
+
+  def on_frame(self, dat: bytes) -> None:
+    frame_type = dat[0] >> 4
+    if frame_type == 0:
+      asyncio.create_task(self.respond(dat[1:1 + dat[0]]))
+    elif frame_type == 1:
+      self.rx_len = ((dat[0] & 0xF) << 8) + dat[1]
+      self.rx_dat = dat[2:]
+      self.can.to_tester(self.rx_addr, bytes([0x30, 0x00, self.separation_time]).ljust(8, b"\x00"))
+    elif frame_type == 2:
+      self.consecutive_times.append(time.monotonic())
+      self.rx_dat += dat[1:]
+      if len(self.rx_dat) >= self.rx_len:
+        asyncio.create_task(self.respond(self.rx_dat[:self.rx_len]))
+    elif frame_type == 3:
+      asyncio.create_task(self.send_consecutive())
+
+  async def respond(self, req: bytes) -> None:
+    await asyncio.sleep(self.latency)
+    sid = req[0]
+    if sid == 0x22:
+      did = struct.unpack("!H", req[1:3])[0]
+      if did not in self.data:
+        resp = bytes([0x7F, sid, 0x31])
+      else:
+        if did == PENDING_DID:
+          self.can.to_tester(self.rx_addr, bytes([0x03, 0x7F, sid, 0x78]).ljust(8, b"\x00"))
+          await asyncio.sleep(self.latency)
+        resp = bytes([0x62]) + req[1:3] + self.data[did]
+    elif sid == 0x2E:
+      self.data[struct.unpack("!H", req[1:3])[0]] = req[3:]
+      resp = bytes([0x6E]) + req[1:3]
+    else:
+      resp = bytes([sid + 0x40]) + req[1:2]
+
+    if len(resp) < 8:
+      self.can.to_tester(self.rx_addr, (bytes([len(resp)]) + resp).ljust(8, b"\x00"))
+    else:
+      self.can.to_tester(self.rx_addr, struct.pack("!H", 0x1000 | len(resp)) + resp[:6])
+      self.tx_frames = [(bytes([0x20 | (i + 1) & 0xF]) + resp[j:j + 7]).ljust(8, b"\x00") for i, j in enumerate(range(6, len(resp), 7))]
+
+  async def send_consecutive(self) -> None:
+    for frame in self.tx_frames:
+      self.can.to_tester(self.rx_addr, frame)
+
+
+class FakeCan:
+  def __init__(self):
+    self.ecus: dict[int, FakeEcu] = {}
+    self.rx: asyncio.Queue[tuple[int, bytes, int] | Exception] = asyncio.Queue()
+
+  def to_tester(self, addr: int, dat: bytes) -> None:
+    self.rx.put_nowait((addr, dat, 0))
+
+  async def can_send(self, addr: int, dat: bytes, bus: int) -> None:
+    if bus == 0 and addr in self.ecus:
+      self.ecus[addr].on_frame(dat)
+
+  def fail(self, error: Exception) -> None:
+    """The next can_recv raises error, like a disconnected panda"""
+    self.rx.put_nowait(error)
+
+  async def can_recv(self) -> list[tuple[int, bytes, int]]:
+    msgs = [await self.rx.get()]
+    while not self.rx.empty():
+      msgs.append(self.rx.get_nowait())
+    for msg in msgs:
+      if isinstance(msg, Exception):
+        raise msg
+    return msgs
+
+
+class TestAsyncUdsClient:
+  def test_concurrent_sessions(self):
+    latency = 0.05
+    addrs = [0x700 + 0x10 * i for i in range(30)]
+
+    async def run():
+      can = FakeCan()
+      can.ecus = {addr: FakeEcu(can, addr, latency) for addr in addrs}
+      async with AsyncCanBus(can.can_send, can.can_recv) as can_bus:
+        clients = [AsyncUdsClient(can_bus, addr) for addr in addrs]
+        start = time.monotonic()
+        await asyncio.gather(*[c.diagnostic_session_control(SESSION_TYPE.EXTENDED_DIAGNOSTIC) for c in clients])
+        versions = await asyncio.gather(*[c.read_data_by_identifier(DID) for c in clients])
+        return versions, time.monotonic() - start, can
+
+    versions, elapsed, can = asyncio.run(run())
+    assert versions == [can.ecus[addr].data[DID] for addr in addrs]
+    # two requests of every session overlap, running them one after another takes 3 seconds
+    assert elapsed < 20 * latency
+
+  def test_multi_frame_request(self):
+    record = bytes(range(100))
+
+    async def run():
+      can = FakeCan()
+      ecu = can.ecus[0x7E0] = FakeEcu(can, 0x7E0, 0, separation_time=5)
+      async with AsyncCanBus(can.can_send, can.can_recv) as can_bus:
+        client = AsyncUdsClient(can_bus, 0x7E0)
+        await client.write_data_by_identifier(DATA_IDENTIFIER_TYPE.VIN, record)
+        return ecu, await client.read_data_by_identifier(DATA_IDENTIFIER_TYPE.VIN)
+
+    ecu, vin = asyncio.run(run())
+    assert vin == record
+    # STmin from the ECU's flow control is waited out between consecutive frames
+    gaps = [b - a for a, b in zip(ecu.consecutive_times, ecu.consecutive_times[1:], strict=False)]
+    assert len(gaps) == 13 and min(gaps) >= 0.004
+
+  def test_errors(self):
+    async def run():
+      can = FakeCan()
+      can.ecus[0x7E0] = FakeEcu(can, 0x7E0, 0.01)
+      async with AsyncCanBus(can.can_send, can.can_recv) as can_bus:
+        client = AsyncUdsClient(can_bus, 0x7E0, timeout=0.1)
+        # response pending is followed by the actual response
+        assert await client.read_data_by_identifier(PENDING_DID) == can.ecus[0x7E0].data[PENDING_DID]
+        with pytest.raises(NegativeResponseError):
+          await client.read_data_by_identifier(DATA_IDENTIFIER_TYPE.ECU_SERIAL_NUMBER)
+        with pytest.raises(MessageTimeoutError):
+          await AsyncUdsClient(can_bus, 0x7E1, timeout=0.1).tester_present()
+
+    asyncio.run(run())
+
+  def test_bus_error(self):
+    async def run():
+      can = FakeCan()
+      can.ecus[0x7E0] = FakeEcu(can, 0x7E0, 0.01)
+      async with AsyncCanBus(can.can_send, can.can_recv) as can_bus:
+        client = AsyncUdsClient(can_bus, 0x7E0, timeout=10)
+        assert await client.read_data_by_identifier(DID) == can.ecus[0x7E0].data[DID]
+
+        # sessions waiting on the ECU and on one that doesn't exist fail with the bus error, without waiting out their timeout
+        silent = AsyncUdsClient(can_bus, 0x7E1, timeout=10)
+        can.ecus[0x7E0].latency = 10
+        start = time.monotonic()
+        requests = [asyncio.create_task(c.read_data_by_identifier(DID)) for c in (client, silent)]
+        await asyncio.sleep(0.01)
+        can.fail(OSError("CAN interface lost"))
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        assert time.monotonic() - start < 1
+        assert [str(r) for r in results] == ["CAN interface lost"] * 2
+        assert isinstance(can_bus.error, OSError)
+
+        # and so do sessions started afterwards
+        with pytest.raises(OSError):
+          await client.tester_present()
+
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+import random
+import time
+
+import pytest
+
+from opendbc.car.fingerprints import FW_VERSIONS
+from opendbc.car.fw_query_definitions import StdQueries
+from opendbc.car.fw_versions import MODEL_TO_BRAND, get_fw_versions, match_fw_to_car
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery, IsoTpPipelinedQuery
+from opendbc.car.tests.benchmark_fingerprint import benchmark_car, get_benchmark_cars
+from opendbc.car.vin import get_vin
+from opendbc.car.virtual_can import VirtualCanBus, VirtualEcu, get_virtual_ecus
+
+REQUEST = StdQueries.MANUFACTURER_SOFTWARE_VERSION_REQUEST
+RESPONSE = StdQueries.MANUFACTURER_SOFTWARE_VERSION_RESPONSE
+VIN = "1FTEW1E58JFA00001"
+
+
+def make_ecu(addr: int, version: bytes, **kwargs) -> VirtualEcu:
+  return VirtualEcu(1, addr, responses={REQUEST: RESPONSE + version}, **kwargs)
+
+
+class TestVirtualCanBus:
+  def test_simulated_time(self):
+    real_monotonic = time.monotonic
+    with VirtualCanBus([]) as can_bus:
+      time.sleep(5)
+      assert time.monotonic() == can_bus.now == 5
+      # waiting for a frame that never comes takes one poll
+      assert can_bus.can_recv(wait_for_one=True) == [[]]
+      assert can_bus.now == pytest.approx(5.01)
+    assert time.monotonic is real_monotonic
+
+  def test_responses(self):
+    ecus = [
+      make_ecu(0x7E0, b"single"),
+      make_ecu(0x7E1, b"multi-frame version" * 4),
+      make_ecu(0x7E2, b"pending", response_pending=3, latency=0.05),
+      make_ecu(0x7E3, b"dropped", drop_rate=1),
+      make_ecu(0x7E4, bytes(range(100)), tx_dl=64),
+    ]
+    with VirtualCanBus(ecus) as can_bus:
+      query = IsoTpParallelQuery(can_bus.can_send, can_bus.can_recv, 1, [ecu.addr for ecu in ecus], [REQUEST], [RESPONSE])
+      results = query.get_data(0.1)
+      # the query lasts until the response after three response pending messages, 50 ms apart
+      assert can_bus.now == pytest.approx(0.2)
+
+    assert results == {(ecu.addr, None): ecu.responses[REQUEST][len(RESPONSE):] for ecu in ecus if ecu.drop_rate == 0}
+    assert can_bus.requests(ecus[3]) == [REQUEST]
+    # CAN FD frames, 64 bytes long and no flow control needed for 103 bytes
+    assert [len(msg.dat) for msg in can_bus.tx_frames if msg.address == 0x7E4] == [8, 8]
+
+  def test_negative_response(self):
+    # unknown requests are answered with a negative response, which ends the query, or ignored and waited out
+    for negative_response, duration in ((True, 0.005), (False, 0.11)):
+      with VirtualCanBus([make_ecu(0x7E0, b"version", negative_response=negative_response)]) as can_bus:
+        query = IsoTpParallelQuery(can_bus.can_send, can_bus.can_recv, 1, [0x7E0], [StdQueries.UDS_VERSION_REQUEST],
+                                   [StdQueries.UDS_VERSION_RESPONSE])
+        assert query.get_data(0.1) == {}
+        assert can_bus.now == pytest.approx(duration)
+
+  def test_sub_addresses(self):
+    ecus = [make_ecu(0x750, f"sub-addr {sub_addr}".encode(), sub_addr=sub_addr) for sub_addr in (0x0F, 0x6D, 0xB4)]
+    with VirtualCanBus(ecus) as can_bus:
+      addrs = [(0x750, sub_addr) for sub_addr in (0x0F, 0x6D, 0xB4, 0x10)]
+      query = IsoTpPipelinedQuery(can_bus.can_send, can_bus.can_recv, 1, [(addrs, [REQUEST], [RESPONSE], 0x8)])
+      results = query.get_data(0.1)
+    assert results == {0: {(0x750, ecu.sub_addr): ecu.responses[REQUEST][len(RESPONSE):] for ecu in ecus}}
+
+  def test_vin(self):
+    ecus = get_virtual_ecus("TOYOTA_RAV4", vin=VIN)
+    with VirtualCanBus(ecus) as can_bus:
+      assert get_vin(can_bus.can_recv, can_bus.can_send, (0, 1)) == (-1, -1, "0" * 17)
+      # only reachable on the OBD port
+      can_bus.set_obd_multiplexing(True)
+      assert get_vin(can_bus.can_recv, can_bus.can_send, (0, 1)) == (0x7E8, 1, VIN)
+
+  @pytest.mark.parametrize("brand", sorted({MODEL_TO_BRAND[car] for car in get_benchmark_cars()}))
+  def test_fw_versions(self, brand):
+    rng = random.Random(0)
+    for car in get_benchmark_cars(brand):
+      ecus = get_virtual_ecus(car, rng=rng, latency=rng.uniform(0, 0.05), response_pending=rng.randint(0, 1))
+      with VirtualCanBus(ecus) as can_bus:
+        car_fw = get_fw_versions(can_bus.can_recv, can_bus.can_send, can_bus.set_obd_multiplexing, brand, num_pandas=2)
+
+      exact, matches = match_fw_to_car(car_fw, VIN, log=False)
+      assert exact and matches == {car}
+      assert {(fw.address, fw.subAddress or None) for fw in car_fw if not fw.logging} == {(addr, sub_addr) for _, addr, sub_addr in FW_VERSIONS[car]}
+
+  def test_fingerprint_timing(self, subtests):
+    # simulated seconds to fingerprint the first platform of each brand, 2 seconds of which CAN fingerprinting without traffic
+    ref_times = {
+      'body': 2.24,
+      'chrysler': 3.47,
+      'ford': 4.77,
+      'honda': 3.78,
+      'hyundai': 4.0,
+      'mazda': 3.28,
+      'nissan': 4.22,
+      'psa': 3.26,
+      'rivian': 3.24,
+      'subaru': 3.68,
+      'tesla': 4.82,
+      'toyota': 3.58,
+      'volkswagen': 3.67,
+    }
+
+    cars = {}
+    for car in get_benchmark_cars():
+      cars.setdefault(MODEL_TO_BRAND[car], car)
+    assert set(cars) == set(ref_times)
+
+    for brand, car in cars.items():
+      with subtests.test(brand=brand, car=car):
+        result = benchmark_car(car)
+        assert result.candidate == car and result.exact
+        assert result.sim_time < ref_times[brand] + 0.05
+        assert result.sim_time > ref_times[brand] - 0.05, "Performance seems to have improved, update test refs."
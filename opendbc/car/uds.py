@@ -239,6 +239,10 @@ class ROUTINE_IDENTIFIER_TYPE(IntEnum):
   ERASE_MIRROR_MEMORY_DTCS = 0xFF02
 
 
+# valid CAN FD frame lengths, classic CAN frames are up to 8 bytes
+CAN_FRAME_LENGTHS = (8, 12, 16, 20, 24, 32, 48, 64)
+
+
 class MessageTimeoutError(Exception):
   pass
 
@@ -341,7 +345,7 @@ class CanClient:
     self.rx = can_recv
     self.tx_addr = tx_addr
     self.rx_addr = rx_addr
-    self.rx_buff: deque[bytes] = deque()
+    self.rx_buff: deque[memoryview] = deque()
     self.sub_addr = sub_addr
     self.rx_sub_addr = rx_sub_addr if rx_sub_addr is not None else sub_addr
     self.bus = bus
@@ -372,9 +376,10 @@ class CanClient:
       else:
         for rx_addr, rx_data, rx_bus in msgs or []:
           if self._recv_filter(rx_bus, rx_addr) and len(rx_data) > 0:
-            rx_data = bytes(rx_data)  # convert bytearray to bytes
+            # view into the received frame, the payload is copied once when the ISO-TP message is reassembled
+            rx_data = memoryview(rx_data)
 
-            carlog.debug(f"CAN-RX: {hex(rx_addr)} - 0x{bytes.hex(rx_data)}")
+            carlog.debug(f"CAN-RX: {hex(rx_addr)} - 0x{rx_data.hex()}")
 
             # Cut off sub addr in first byte
             if self.rx_sub_addr is not None:
@@ -387,7 +392,7 @@ class CanClient:
       if len(msgs) < 254:
         return
 
-  def recv(self, drain: bool = False) -> Generator[bytes, None, None]:
+  def recv(self, drain: bool = False) -> Generator[memoryview, None, None]:
     # buffer rx messages in case two response messages are received at once
     # (e.g. response pending and success/failure response)
     self._recv_buffer(drain)
@@ -407,7 +412,7 @@ class CanClient:
         msg = bytes([self.sub_addr]) + msg
 
       carlog.debug(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(msg)}")
-      assert len(msg) <= 8
+      assert len(msg) <= CAN_FRAME_LENGTHS[-1]
 
       self.tx(self.tx_addr, msg, self.bus)
       # prevent rx buffer from overflowing on large tx
@@ -415,12 +420,40 @@ class CanClient:
         self._recv_buffer()
 
 
+def get_frame_length(length: int) -> int:
+  """Smallest CAN (FD) frame length that fits length bytes"""
+  for frame_length in CAN_FRAME_LENGTHS:
+    if length <= frame_length:
+      return frame_length
+  raise ValueError(f"frame too long: {length}")
+
+
+def get_separation_time(st_min: int) -> float:
+  """Seconds to wait between consecutive frames for a flow control STmin byte"""
+  # <= 127 milliseconds, 0xF1 to 0xF9 are 100 to 900 microseconds, reserved values mean the maximum
+  if st_min <= 0x7F:
+    return st_min / 1000.
+  if 0xF1 <= st_min <= 0xF9:
+    return (st_min - 0xF0) / 10000.
+  return 0x7F / 1000.
+
+
 class IsoTpMessage:
-  def __init__(self, can_client: CanClient, timeout: float = 1, single_frame_mode: bool = False, separation_time: float = 0):
+  """
+  ISO 15765-2 transport, with frames of up to tx_dl bytes on the bus (8, or up to 64 for CAN FD). Received frames
+  may be of any valid length, the length of a first frame sets the length of its consecutive frames.
+  block_size is the number of consecutive frames the ECU may send between flow control frames, 0 for no limit.
+  """
+  def __init__(self, can_client: CanClient, timeout: float = 1, single_frame_mode: bool = False, separation_time: float = 0,
+               tx_dl: int = 8, block_size: int = 0):
+    assert tx_dl in CAN_FRAME_LENGTHS, f"invalid frame length: {tx_dl}"
+    assert 0 <= block_size <= 0xFF, f"invalid block size: {block_size}"
     self._can_client = can_client
     self.timeout = timeout
     self.single_frame_mode = single_frame_mode
-    self.max_len = 8 if self._can_client.sub_addr is None else 7
+    self.block_size = 1 if single_frame_mode else block_size
+    self.tx_dl = tx_dl
+    self.max_len = tx_dl if self._can_client.sub_addr is None else tx_dl - 1
 
     # <= 127, separation time in milliseconds
     # 0xF1 to 0xF9 UF, 100 to 900 microseconds
@@ -432,11 +465,16 @@ class IsoTpMessage:
     else:
       raise Exception("Separation time not in range")
 
-    self.flow_control_msg = bytes([
+    self.flow_control_msg = self._pad(bytes([
       0x30,  # flow control
-      0x01 if self.single_frame_mode else 0x00,  # block size
+      self.block_size,
       separation_time,
-    ]).ljust(self.max_len, b"\x00")
+    ]))
+
+  def _pad(self, msg: bytes) -> bytes:
+    """Pad to the next valid frame length"""
+    sub_addr_len = 0 if self._can_client.sub_addr is None else 1
+    return msg.ljust(get_frame_length(len(msg) + sub_addr_len) - sub_addr_len, b"\x00")
 
   def send(self, dat: bytes, setup_only: bool = False) -> None:
     # throw away any stale data
@@ -457,17 +495,27 @@ class IsoTpMessage:
     self._tx_first_frame(setup_only=setup_only)
 
   def _tx_first_frame(self, setup_only: bool = False) -> None:
-    if self.tx_len < self.max_len:
+    # a single frame has a one byte length up to 8 byte frames, with CAN FD longer ones escape it as 0x00 and a length byte
+    short_sf_len = min(self.max_len, 8 if self._can_client.sub_addr is None else 7) - 1
+    if self.tx_len <= short_sf_len or self.tx_len <= self.max_len - 2:
       # single frame (send all bytes)
       if not setup_only:
         carlog.debug(f"ISO-TP: TX - single frame - {hex(self._can_client.tx_addr)}")
-      msg = (bytes([self.tx_len]) + self.tx_dat).ljust(self.max_len, b"\x00")
+      if self.tx_len <= short_sf_len:
+        msg = self._pad(bytes([self.tx_len]) + self.tx_dat)
+      else:
+        msg = self._pad(bytes([0x00, self.tx_len]) + self.tx_dat)
       self.tx_done = True
     else:
-      # first frame (send first 6 bytes)
+      # first frame (send the first max_len - 2 bytes), lengths over 4095 are escaped as 0x000 and a 4 byte length
       if not setup_only:
         carlog.debug(f"ISO-TP: TX - first frame - {hex(self._can_client.tx_addr)}")
-      msg = (struct.pack("!H", 0x1000 | self.tx_len) + self.tx_dat[:self.max_len - 2]).ljust(self.max_len - 2, b"\x00")
+      if self.tx_len <= 0xFFF:
+        pci = struct.pack("!H", 0x1000 | self.tx_len)
+      else:
+        pci = struct.pack("!HI", 0x1000, self.tx_len)
+      self.tx_ff_len = self.max_len - len(pci)
+      msg = pci + self.tx_dat[:self.tx_ff_len]
     if not setup_only:
       self._can_client.send([msg])
 
@@ -493,9 +541,9 @@ class IsoTpMessage:
           raise MessageTimeoutError("timeout waiting for response")
     finally:
       if self.rx_dat:
-        carlog.debug(f"ISO-TP: RESPONSE - {hex(self._can_client.rx_addr)} 0x{bytes.hex(self.rx_dat)}")
+        carlog.debug(f"ISO-TP: RESPONSE - {hex(self._can_client.rx_addr)} 0x{self.rx_dat.hex()}")
 
-  def _isotp_rx_next(self, rx_data: bytes) -> ISOTP_FRAME_TYPE:
+  def _isotp_rx_next(self, rx_data: bytes | memoryview) -> ISOTP_FRAME_TYPE:
     # TODO: Handle CAN frame data optimization, which is allowed with some frame types
     # # ISO 15765-2 specifies an eight byte CAN frame for ISO-TP communication
     # assert len(rx_data) == self.max_len, f"isotp - rx: invalid CAN frame length: {len(rx_data)}"
@@ -505,31 +553,38 @@ class IsoTpMessage:
 
       # "if the first byte is 0x00, then it's a CAN-FD SF, and the second byte specifies the size of the data."
       # - https://en.wikipedia.org/wiki/CAN_FD
-      if rx_data[0] & 0x0F == 0 and len(rx_data) > 8:
+      rx_sub_addr_len = 0 if self._can_client.rx_sub_addr is None else 1
+      if rx_data[0] & 0x0F == 0 and len(rx_data) + rx_sub_addr_len > 8:
         self.rx_len = rx_data[1]
         offset = 2
-        # TODO: update self.max_len for CAN FD
-        max_len = 62 if self._can_client.sub_addr is None else 61
-        assert self.rx_len <= max_len, f"isotp - rx: invalid single frame length: {self.rx_len}"
       else:
         self.rx_len = rx_data[0] & 0x0F
         offset = 1
-        assert self.rx_len < self.max_len, f"isotp - rx: invalid single frame length: {self.rx_len}"
+      assert self.rx_len <= len(rx_data) - offset, f"isotp - rx: invalid single frame length: {self.rx_len}"
 
-      self.rx_dat = rx_data[offset:offset + self.rx_len]
+      self.rx_dat = bytes(rx_data[offset:offset + self.rx_len])
       self.rx_idx = 0
       self.rx_done = True
       carlog.debug(f"ISO-TP: RX - single frame - {hex(self._can_client.rx_addr)} idx={self.rx_idx} done={self.rx_done}")
       return ISOTP_FRAME_TYPE.SINGLE
 
     elif rx_data[0] >> 4 == ISOTP_FRAME_TYPE.FIRST:
-      # TODO: support CAN FD first frames
       # Once a first frame is received, further frames must be consecutive
       assert self.rx_dat == b"" or self.rx_done, "isotp - rx: first frame with active frame"
+      # the first frame fills a whole frame, which sets the length of the consecutive frames
+      rx_sub_addr_len = 0 if self._can_client.rx_sub_addr is None else 1
+      assert len(rx_data) + rx_sub_addr_len in CAN_FRAME_LENGTHS, f"isotp - rx: invalid CAN frame length: {len(rx_data)}"
       self.rx_len = ((rx_data[0] & 0x0F) << 8) + rx_data[1]
-      assert self.rx_len >= self.max_len, f"isotp - rx: invalid first frame length: {self.rx_len}"
-      assert len(rx_data) == self.max_len, f"isotp - rx: invalid CAN frame length: {len(rx_data)}"
-      self.rx_dat = rx_data[2:]
+      offset = 2
+      if self.rx_len == 0:
+        # escape sequence, 4 byte length
+        self.rx_len = struct.unpack("!I", rx_data[2:6])[0]
+        offset = 6
+        assert self.rx_len > 0xFFF, f"isotp - rx: invalid first frame length: {self.rx_len}"
+      # longer than fits in a single frame, which is escaped in frames over 8 bytes
+      sf_max_len = len(rx_data) - 1 if len(rx_data) + rx_sub_addr_len <= 8 else len(rx_data) - 2
+      assert self.rx_len > sf_max_len, f"isotp - rx: invalid first frame length: {self.rx_len}"
+      self.rx_dat = bytearray(rx_data[offset:])
       self.rx_idx = 0
       self.rx_done = False
       carlog.debug(f"ISO-TP: RX - first frame - {hex(self._can_client.rx_addr)} idx={self.rx_idx} done={self.rx_done}")
@@ -545,9 +600,10 @@ class IsoTpMessage:
       rx_size = self.rx_len - len(self.rx_dat)
       self.rx_dat += rx_data[1:1 + rx_size]
       if self.rx_len == len(self.rx_dat):
+        self.rx_dat = bytes(self.rx_dat)
         self.rx_done = True
-      elif self.single_frame_mode:
-        # notify ECU to send next frame
+      elif self.block_size and self.rx_idx % self.block_size == 0:
+        # notify ECU to send the next block
         self._can_client.send([self.flow_control_msg])
       carlog.debug(f"ISO-TP: RX - consecutive frame - {hex(self._can_client.rx_addr)} idx={self.rx_idx} done={self.rx_done}")
       return ISOTP_FRAME_TYPE.CONSECUTIVE
@@ -558,21 +614,18 @@ class IsoTpMessage:
       assert rx_data[0] == 0x30 or rx_data[0] == 0x31, "isotp - rx: flow-control transfer state indicator invalid"
       if rx_data[0] == 0x30:
         carlog.debug(f"ISO-TP: RX - flow control continue - {hex(self._can_client.tx_addr)}")
-        delay_ts = rx_data[2] & 0x7F
-        # scale is 1 milliseconds if first bit == 0, 100 micro seconds if first bit == 1
-        delay_div = 1000. if rx_data[2] & 0x80 == 0 else 10000.
-        delay_sec = delay_ts / delay_div
+        delay_sec = get_separation_time(rx_data[2])
 
-        # first frame = 6 bytes, each consecutive frame = 7 bytes
+        # first frame = max_len - 2 bytes (- 6 if escaped), each consecutive frame = max_len - 1 bytes
         num_bytes = self.max_len - 1
-        start = self.max_len - 2 + self.tx_idx * num_bytes
+        start = self.tx_ff_len + self.tx_idx * num_bytes
         count = rx_data[1]
-        end = start + count * num_bytes if count > 0 else self.tx_len
+        end = min(start + count * num_bytes, self.tx_len) if count > 0 else self.tx_len
         tx_msgs = []
         for i in range(start, end, num_bytes):
           self.tx_idx += 1
           # consecutive tx messages
-          msg = (bytes([0x20 | (self.tx_idx & 0xF)]) + self.tx_dat[i:i + num_bytes]).ljust(self.max_len, b"\x00")
+          msg = self._pad(bytes([0x20 | (self.tx_idx & 0xF)]) + self.tx_dat[i:i + num_bytes])
           tx_msgs.append(msg)
         # send consecutive tx messages
         self._can_client.send(tx_msgs, delay=delay_sec)
@@ -608,9 +661,53 @@ def get_rx_addr_for_tx_addr(tx_addr, rx_offset=0x8):
   raise ValueError(f"invalid tx_addr: {tx_addr}")
 
 
+def build_uds_request(service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
+  req = bytes([service_type])
+  if subfunction is not None:
+    req += bytes([subfunction])
+  if data is not None:
+    req += data
+  return req
+
+
+def parse_uds_response(service_type: SERVICE_TYPE, subfunction: int | None, resp: bytes) -> bytes | None:
+  """Data of a positive response (excluding service id and sub-function id), None if the ECU reports the response is pending"""
+  resp_sid = resp[0] if len(resp) > 0 else None
+
+  # negative response
+  if resp_sid == 0x7F:
+    service_id = resp[1] if len(resp) > 1 else -1
+    try:
+      service_desc = SERVICE_TYPE(service_id).name
+    except BaseException:
+      service_desc = 'NON_STANDARD_SERVICE'
+    error_code = resp[2] if len(resp) > 2 else -1
+    try:
+      error_desc = _negative_response_codes[error_code]
+    except BaseException:
+      error_desc = resp[3:].hex()
+    if error_code == 0x78:
+      carlog.debug("UDS-RX: response pending")
+      return None
+    raise NegativeResponseError(f'{service_desc} - {error_desc}', service_id, error_code)
+
+  # positive response
+  if service_type + 0x40 != resp_sid:
+    resp_sid_hex = hex(resp_sid) if resp_sid is not None else None
+    raise InvalidServiceIdError(f'invalid response service id: {resp_sid_hex}')
+
+  if subfunction is not None:
+    resp_sfn = resp[1] if len(resp) > 1 else None
+    if subfunction != resp_sfn:
+      resp_sfn_hex = hex(resp_sfn) if resp_sfn is not None else None
+      raise InvalidSubFunctionError(f'invalid response subfunction: {resp_sfn_hex}')
+
+  return resp[(1 if subfunction is None else 2):]
+
+
 class UdsClient:
   def __init__(self, panda, tx_addr: int, rx_addr: int | None = None, bus: int = 0, sub_addr: int | None = None, rx_sub_addr: int | None = None,
-               timeout: float = 1, tx_timeout: float = 1, response_pending_timeout: float = 10):
+               timeout: float = 1, tx_timeout: float = 1, response_pending_timeout: float = 10, tx_dl: int = 8):
     self.bus = bus
     self.tx_addr = tx_addr
     self.rx_addr = rx_addr if rx_addr is not None else get_rx_addr_for_tx_addr(tx_addr)
@@ -619,18 +716,13 @@ class UdsClient:
     can_send_with_timeout = partial(panda.can_send, timeout=int(tx_timeout*1000))
     self._can_client = CanClient(can_send_with_timeout, panda.can_recv, self.tx_addr, self.rx_addr, self.bus, self.sub_addr, rx_sub_addr)
     self.response_pending_timeout = response_pending_timeout
+    self.tx_dl = tx_dl
 
   # generic uds request
   def _uds_request(self, service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
-    req = bytes([service_type])
-    if subfunction is not None:
-      req += bytes([subfunction])
-    if data is not None:
-      req += data
-
     # send request, wait for response
-    isotp_msg = IsoTpMessage(self._can_client, timeout=self.timeout)
-    isotp_msg.send(req)
+    isotp_msg = IsoTpMessage(self._can_client, timeout=self.timeout, tx_dl=self.tx_dl)
+    isotp_msg.send(build_uds_request(service_type, subfunction, data))
     response_pending = False
     while True:
       timeout = self.response_pending_timeout if response_pending else self.timeout
@@ -639,41 +731,11 @@ class UdsClient:
       if resp is None:
         continue
 
-      response_pending = False
-      resp_sid = resp[0] if len(resp) > 0 else None
-
-      # negative response
-      if resp_sid == 0x7F:
-        service_id = resp[1] if len(resp) > 1 else -1
-        try:
-          service_desc = SERVICE_TYPE(service_id).name
-        except BaseException:
-          service_desc = 'NON_STANDARD_SERVICE'
-        error_code = resp[2] if len(resp) > 2 else -1
-        try:
-          error_desc = _negative_response_codes[error_code]
-        except BaseException:
-          error_desc = resp[3:].hex()
-        # wait for another message if response pending
-        if error_code == 0x78:
-          response_pending = True
-          carlog.debug("UDS-RX: response pending")
-          continue
-        raise NegativeResponseError(f'{service_desc} - {error_desc}', service_id, error_code)
-
-      # positive response
-      if service_type + 0x40 != resp_sid:
-        resp_sid_hex = hex(resp_sid) if resp_sid is not None else None
-        raise InvalidServiceIdError(f'invalid response service id: {resp_sid_hex}')
-
-      if subfunction is not None:
-        resp_sfn = resp[1] if len(resp) > 1 else None
-        if subfunction != resp_sfn:
-          resp_sfn_hex = hex(resp_sfn) if resp_sfn is not None else None
-          raise InvalidSubFunctionError(f'invalid response subfunction: {resp_sfn_hex}')
-
-      # return data (exclude service id and sub-function id)
-      return resp[(1 if subfunction is None else 2):]
+      resp_data = parse_uds_response(service_type, subfunction, resp)
+      if resp_data is not None:
+        return resp_data
+      # wait for another message if response pending
+      response_pending = True
 
   # services
   def diagnostic_session_control(self, session_type: SESSION_TYPE):
@@ -0,0 +1,275 @@
+"""
+asyncio transport for UDS over ISO-TP.
+
+A single AsyncCanBus reads frames from an async receive callable and hands each one to the clients
+listening on its bus, so one event loop can run many concurrent UDS sessions to different ECUs.
+Sessions await frame arrival instead of polling, and consecutive frames are paced with asyncio.sleep.
+
+  async with AsyncCanBus(can_send, can_recv) as can_bus:
+    clients = [AsyncUdsClient(can_bus, addr) for addr in addrs]
+    versions = await asyncio.gather(*[c.read_data_by_identifier(DATA_IDENTIFIER_TYPE.APPLICATION_SOFTWARE_IDENTIFICATION) for c in clients])
+"""
+import asyncio
+import struct
+from collections import deque
+from collections.abc import Awaitable, Callable, Generator
+
+from opendbc.car.carlog import carlog
+from opendbc.car.uds import ACCESS_TYPE, CAN_FRAME_LENGTHS, DATA_IDENTIFIER_TYPE, DTC_GROUP_TYPE, DTC_SETTING_TYPE, RESET_TYPE, \
+                            ROUTINE_CONTROL_TYPE, ROUTINE_IDENTIFIER_TYPE, SERVICE_TYPE, SESSION_TYPE, CanClient, InvalidSubAddressError, \
+                            IsoTpMessage, MessageTimeoutError, ISOTP_FRAME_TYPE, build_uds_request, get_rx_addr_for_tx_addr, parse_uds_response
+
+AsyncCanSend = Callable[[int, bytes, int], Awaitable[None]]
+AsyncCanRecv = Callable[[], Awaitable[list[tuple[int, bytes, int]]]]
+
+
+class AsyncCanBus:
+  """
+  Shares one CAN interface between AsyncCanClients. can_recv must wait for frames to arrive
+  and return (addr, dat, bus) tuples, like panda.can_recv. If receiving fails, the error is raised
+  in every session waiting for a frame and in any that waits afterwards.
+  """
+  def __init__(self, can_send: AsyncCanSend, can_recv: AsyncCanRecv):
+    self.can_send = can_send
+    self.can_recv = can_recv
+    self.clients: dict[int, list[AsyncCanClient]] = {}
+    self._reader: asyncio.Task | None = None
+    # set when the reader stopped on an error
+    self.error: Exception | None = None
+
+  def add_client(self, client: 'AsyncCanClient') -> None:
+    self.clients.setdefault(client.bus, []).append(client)
+
+  def remove_client(self, client: 'AsyncCanClient') -> None:
+    self.clients[client.bus].remove(client)
+
+  async def send(self, addr: int, dat: bytes, bus: int) -> None:
+    await self.can_send(addr, dat, bus)
+
+  async def run(self) -> None:
+    try:
+      while True:
+        for addr, dat, bus in await self.can_recv():
+          for client in self.clients.get(bus, ()):
+            client.on_frame(addr, dat, bus)
+    except Exception as e:
+      # nothing will be received anymore, fail the waiting sessions instead of leaving them to time out
+      carlog.exception("AsyncCanBus receive exception")
+      self.error = e
+      for clients in self.clients.values():
+        for client in clients:
+          client.rx_queue.put_nowait(e)
+
+  async def __aenter__(self) -> 'AsyncCanBus':
+    self._reader = asyncio.create_task(self.run())
+    return self
+
+  async def __aexit__(self, *exc) -> None:
+    assert self._reader is not None
+    self._reader.cancel()
+    try:
+      await self._reader
+    except asyncio.CancelledError:
+      pass
+    self._reader = None
+
+
+class AsyncCanClient(CanClient):
+  """
+  CanClient fed by an AsyncCanBus. Frames from send() are queued and written by flush(),
+  which waits out the separation time between consecutive frames with asyncio.sleep.
+  """
+  def __init__(self, can_bus: AsyncCanBus, tx_addr: int, rx_addr: int, bus: int, sub_addr: int | None = None, rx_sub_addr: int | None = None):
+    super().__init__(can_bus.send, can_bus.can_recv, tx_addr, rx_addr, bus, sub_addr, rx_sub_addr)  # type: ignore[arg-type]
+    self.can_bus = can_bus
+    self.rx_queue: asyncio.Queue[memoryview | Exception] = asyncio.Queue()
+    self.tx_queue: deque[tuple[bytes, float]] = deque()
+
+  def on_frame(self, addr: int, dat: bytes, bus: int) -> None:
+    if self._recv_filter(bus, addr) and len(dat) > 0:
+      rx_data = memoryview(dat)
+      carlog.debug(f"CAN-RX: {hex(addr)} - 0x{rx_data.hex()}")
+
+      # Cut off sub addr in first byte, errors are raised in the session instead of the bus reader
+      if self.rx_sub_addr is not None:
+        if rx_data[0] != self.rx_sub_addr:
+          self.rx_queue.put_nowait(InvalidSubAddressError(f"isotp - rx: invalid sub-address: {rx_data[0]}, expected: {self.rx_sub_addr}"))
+          return
+        rx_data = rx_data[1:]
+
+      self.rx_queue.put_nowait(rx_data)
+
+  def drain(self) -> None:
+    carlog.debug(f"CAN-RX: drain - {self.rx_queue.qsize()}")
+    while not self.rx_queue.empty():
+      self.rx_queue.get_nowait()
+
+  def recv(self, drain: bool = False) -> Generator[memoryview, None, None]:
+    # only frames the bus reader already queued, use get() to wait for one
+    if drain:
+      self.drain()
+    while not self.rx_queue.empty():
+      yield self._check(self.rx_queue.get_nowait())
+
+  async def get(self) -> memoryview:
+    if self.rx_queue.empty() and self.can_bus.error is not None:
+      raise self.can_bus.error
+    return self._check(await self.rx_queue.get())
+
+  @staticmethod
+  def _check(rx_data: memoryview | Exception) -> memoryview:
+    if isinstance(rx_data, Exception):
+      raise rx_data
+    return rx_data
+
+  def send(self, msgs: list[bytes], delay: float = 0) -> None:
+    for i, msg in enumerate(msgs):
+      if self.sub_addr is not None:
+        msg = bytes([self.sub_addr]) + msg
+      assert len(msg) <= CAN_FRAME_LENGTHS[-1]
+      self.tx_queue.append((msg, delay if i != 0 else 0))
+
+  async def flush(self) -> None:
+    while self.tx_queue:
+      msg, delay = self.tx_queue.popleft()
+      if delay:
+        carlog.debug(f"CAN-TX: delay - {delay}")
+        await asyncio.sleep(delay)
+      carlog.debug(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(msg)}")
+      await self.can_bus.send(self.tx_addr, msg, self.bus)
+
+
+class AsyncIsoTpMessage(IsoTpMessage):
+  _can_client: AsyncCanClient
+
+  async def send(self, dat: bytes, setup_only: bool = False) -> None:  # type: ignore[override]
+    # throw away any stale data
+    self._can_client.drain()
+    super().send(dat, setup_only)
+    await self._can_client.flush()
+
+  async def recv(self, timeout=None) -> tuple[bytes | None, bool]:  # type: ignore[override]
+    if timeout is None:
+      timeout = self.timeout
+
+    rx_in_progress = False
+    try:
+      while True:
+        # no timeout indicates non-blocking
+        if timeout == 0:
+          msg = next(self._can_client.recv(), None)
+          if msg is None:
+            return None, rx_in_progress
+        else:
+          try:
+            async with asyncio.timeout(timeout):
+              msg = await self._can_client.get()
+          except TimeoutError:
+            raise MessageTimeoutError("timeout waiting for response") from None
+
+        frame_type = self._isotp_rx_next(msg)
+        # flow control and consecutive frames queued while handling the frame
+        await self._can_client.flush()
+        # Anything that signifies we're building a response
+        rx_in_progress = frame_type in (ISOTP_FRAME_TYPE.FIRST, ISOTP_FRAME_TYPE.CONSECUTIVE)
+        if self.tx_done and self.rx_done:
+          return self.rx_dat, False
+    finally:
+      if self.rx_dat:
+        carlog.debug(f"ISO-TP: RESPONSE - {hex(self._can_client.rx_addr)} 0x{self.rx_dat.hex()}")
+
+
+class AsyncUdsClient:
+  """UdsClient on an AsyncCanBus, requests from clients to different ECUs can run concurrently"""
+  def __init__(self, can_bus: AsyncCanBus, tx_addr: int, rx_addr: int | None = None, bus: int = 0, sub_addr: int | None = None,
+               rx_sub_addr: int | None = None, timeout: float = 1, response_pending_timeout: float = 10, tx_dl: int = 8):
+    self.bus = bus
+    self.tx_addr = tx_addr
+    self.rx_addr = rx_addr if rx_addr is not None else get_rx_addr_for_tx_addr(tx_addr)
+    self.sub_addr = sub_addr
+    self.timeout = timeout
+    self.response_pending_timeout = response_pending_timeout
+    self.tx_dl = tx_dl
+    self.can_bus = can_bus
+    self._can_client = AsyncCanClient(can_bus, self.tx_addr, self.rx_addr, self.bus, self.sub_addr, rx_sub_addr)
+    can_bus.add_client(self._can_client)
+
+  def close(self) -> None:
+    self.can_bus.remove_client(self._can_client)
+
+  # generic uds request
+  async def _uds_request(self, service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
+    # send request, wait for response
+    isotp_msg = AsyncIsoTpMessage(self._can_client, timeout=self.timeout, tx_dl=self.tx_dl)
+    await isotp_msg.send(build_uds_request(service_type, subfunction, data))
+    response_pending = False
+    while True:
+      timeout = self.response_pending_timeout if response_pending else self.timeout
+      resp, _ = await isotp_msg.recv(timeout)
+
+      if resp is None:
+        continue
+
+      resp_data = parse_uds_response(service_type, subfunction, resp)
+      if resp_data is not None:
+        return resp_data
+      # wait for another message if response pending
+      response_pending = True
+
+  # services, see UdsClient for the rest, which can be sent with _uds_request
+  async def diagnostic_session_control(self, session_type: SESSION_TYPE):
+    await self._uds_request(SERVICE_TYPE.DIAGNOSTIC_SESSION_CONTROL, subfunction=session_type)
+
+  async def ecu_reset(self, reset_type: RESET_TYPE):
+    resp = await self._uds_request(SERVICE_TYPE.ECU_RESET, subfunction=reset_type)
+    if reset_type == RESET_TYPE.ENABLE_RAPID_POWER_SHUTDOWN:
+      power_down_time = resp[0]
+      return power_down_time
+
+  async def security_access(self, access_type: ACCESS_TYPE, security_key: bytes = b'', data_record: bytes = b''):
+    request_seed = access_type % 2 != 0
+    if request_seed and len(security_key) != 0:
+      raise ValueError('security_key not allowed')
+    if not request_seed and len(security_key) == 0:
+      raise ValueError('security_key is missing')
+    if not request_seed and len(data_record) != 0:
+      raise ValueError('data_record not allowed')
+    data = security_key + data_record
+    resp = await self._uds_request(SERVICE_TYPE.SECURITY_ACCESS, subfunction=access_type, data=data)
+    if request_seed:
+      security_seed = resp
+      return security_seed
+
+  async def tester_present(self):
+    await self._uds_request(SERVICE_TYPE.TESTER_PRESENT, subfunction=0x00)
+
+  async def control_dtc_setting(self, dtc_setting_type: DTC_SETTING_TYPE):
+    await self._uds_request(SERVICE_TYPE.CONTROL_DTC_SETTING, subfunction=dtc_setting_type)
+
+  async def read_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE):
+    data = struct.pack('!H', data_identifier_type)
+    resp = await self._uds_request(SERVICE_TYPE.READ_DATA_BY_IDENTIFIER, subfunction=None, data=data)
+    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
+    if resp_id != data_identifier_type:
+      raise ValueError(f'invalid response data identifier: {hex(resp_id)} expected: {hex(data_identifier_type)}')
+    return resp[2:]
+
+  async def write_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE, data_record: bytes):
+    data = struct.pack('!H', data_identifier_type) + data_record
+    resp = await self._uds_request(SERVICE_TYPE.WRITE_DATA_BY_IDENTIFIER, subfunction=None, data=data)
+    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
+    if resp_id != data_identifier_type:
+      raise ValueError(f'invalid response data identifier: {hex(resp_id)}')
+
+  async def clear_diagnostic_information(self, dtc_group_type: DTC_GROUP_TYPE):
+    data = struct.pack('!I', dtc_group_type)[1:]  # 3 bytes
+    await self._uds_request(SERVICE_TYPE.CLEAR_DIAGNOSTIC_INFORMATION, subfunction=None, data=data)
+
+  async def routine_control(self, routine_control_type: ROUTINE_CONTROL_TYPE, routine_identifier_type: ROUTINE_IDENTIFIER_TYPE,
+                            routine_option_record: bytes = b''):
+    data = struct.pack('!H', routine_identifier_type) + routine_option_record
+    resp = await self._uds_request(SERVICE_TYPE.ROUTINE_CONTROL, subfunction=routine_control_type, data=data)
+    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
+    if resp_id != routine_identifier_type:
+      raise ValueError(f'invalid response routine identifier: {hex(resp_id)}')
+    return resp[2:]
@@ -5,6 +5,7 @@ from opendbc.car import uds
 from opendbc.car.carlog import carlog
 from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
 from opendbc.car.fw_query_definitions import STANDARD_VIN_ADDRS, StdQueries
+from opendbc.car.response_latency import ResponseLatencies
 
 VIN_UNKNOWN = "0" * 17
 VIN_RE = "[A-HJ-NPR-Z0-9]{17}"
@@ -29,7 +30,7 @@ def is_valid_vin(vin: str):
   return re.fullmatch(VIN_RE, vin) is not None
 
 
-def get_vin(can_recv, can_send, buses, timeout=0.1, retry=2):
+def get_vin(can_recv, can_send, buses, timeout=0.1, retry=2, latencies: ResponseLatencies | None = None):
   for i in range(retry):
     for bus in buses:
       for request, response, valid_buses, vin_addrs, functional_addrs, rx_offset in (
@@ -51,7 +52,7 @@ def get_vin(can_recv, can_send, buses, timeout=0.1, retry=2):
 
         try:
           query = IsoTpParallelQuery(can_send, can_recv, bus, tx_addrs, [request, ], [response, ], response_offset=rx_offset,
-                                     functional_addrs=functional_addrs)
+                                     functional_addrs=functional_addrs, latencies=latencies)
           results = query.get_data(timeout)
 
           for addr in vin_addrs:
@@ -0,0 +1,271 @@
+"""
+Simulated CAN bus with virtual ECUs, to run the VIN, ECU address and FW version queries without a car.
+
+VirtualCanBus provides the can_send, can_recv and set_obd_multiplexing callbacks the queries take, on a simulated
+clock: used as a context manager, time.monotonic and time.sleep run on it, so queries that would take seconds on a
+car finish as fast as the host can run them, with the same results every time.
+
+Each VirtualEcu answers requests on one bus and address with its own ISO-TP transport, after a configurable latency,
+optionally preceded by response pending messages or not at all (dropped). get_virtual_ecus builds the ECUs of a
+platform from its FW_VERSIONS and its brand's FwQueryConfig.requests.
+"""
+import heapq
+import random
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from functools import partial
+
+from opendbc.car import uds
+from opendbc.car.can_definitions import CanData
+from opendbc.car.fingerprints import FW_VERSIONS
+from opendbc.car.fw_query_definitions import StdQueries
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, MODEL_TO_BRAND
+
+# request out of range, the answer of ECUs to requests they don't support
+NEGATIVE_RESPONSE_CODE = 0x31
+RESPONSE_PENDING_CODE = 0x78
+
+
+@dataclass
+class VirtualEcu:
+  bus: int
+  addr: int
+  sub_addr: int | None = None
+  rx_offset: int = 0x8
+  # responses by request, tester present is always answered
+  responses: dict[bytes, bytes] = field(default_factory=dict)
+  # only reachable in this OBD multiplexing mode, for ECUs on bus 1
+  obd_multiplexing: bool | None = None
+  latency: float = 0.005
+  # number of response pending messages sent before each response, latency apart
+  response_pending: int = 0
+  # probability of ignoring a request
+  drop_rate: float = 0.
+  tx_dl: int = 8
+  # answer unknown requests with a negative response instead of ignoring them
+  negative_response: bool = True
+
+  @property
+  def rx_addr(self) -> int:
+    return uds.get_rx_addr_for_tx_addr(self.addr, self.rx_offset)
+
+  def get_response(self, request: bytes) -> bytes | None:
+    if request in self.responses:
+      return self.responses[request]
+    if request[0] == uds.SERVICE_TYPE.TESTER_PRESENT:
+      # bit 7 of the sub-function suppresses the response
+      suppress_response = len(request) > 1 and request[1] & 0x80
+      return None if suppress_response else bytes([request[0] + 0x40]) + request[1:2]
+    if self.negative_response:
+      return bytes([0x7F, request[0], NEGATIVE_RESPONSE_CODE])
+    return None
+
+
+class _EcuCanClient(uds.CanClient):
+  """Schedules consecutive frames separation time apart on the simulated clock, instead of sleeping"""
+  def __init__(self, can_bus: 'VirtualCanBus', can_recv: Callable[[], list[tuple[int, bytes, int]]], tx_addr: int, rx_addr: int,
+               bus: int, sub_addr: int | None = None):
+    super().__init__(can_bus.schedule_frame, can_recv, tx_addr, rx_addr, bus, sub_addr=sub_addr)
+    self.can_bus = can_bus
+
+  def send(self, msgs: list[bytes], delay: float = 0) -> None:
+    for i, msg in enumerate(msgs):
+      if self.sub_addr is not None:
+        msg = bytes([self.sub_addr]) + msg
+      self.can_bus.schedule_frame(self.tx_addr, msg, self.bus, i * delay)
+
+
+class _EcuEndpoint:
+  """The ISO-TP transport of a VirtualEcu, reassembling requests and sending responses on the bus"""
+  def __init__(self, can_bus: 'VirtualCanBus', ecu: VirtualEcu):
+    self.can_bus = can_bus
+    self.ecu = ecu
+    self.inbox: list[bytes] = []
+    can_client = _EcuCanClient(can_bus, self._recv_inbox, ecu.rx_addr, ecu.addr, ecu.bus, sub_addr=ecu.sub_addr)
+    self.isotp = uds.IsoTpMessage(can_client, timeout=0, tx_dl=ecu.tx_dl)
+    self.isotp.send(b"", setup_only=True)
+    self.requests: list[bytes] = []
+
+  def _recv_inbox(self) -> list[tuple[int, bytes, int]]:
+    msgs = [(self.ecu.addr, dat, self.ecu.bus) for dat in self.inbox]
+    self.inbox.clear()
+    return msgs
+
+  def on_frame(self, dat: bytes) -> None:
+    pci_idx = 0 if self.ecu.sub_addr is None else 1
+    if len(dat) <= pci_idx:
+      return
+
+    # a new request aborts a response waiting for flow control, like the ECU timing out
+    frame_type = dat[pci_idx] >> 4
+    if frame_type in (uds.ISOTP_FRAME_TYPE.SINGLE, uds.ISOTP_FRAME_TYPE.FIRST) and not self.isotp.tx_done:
+      self.isotp.send(b"", setup_only=True)
+
+    self.inbox.append(dat)
+    try:
+      request, _ = self.isotp.recv()
+    except Exception:
+      # an unexpected frame aborts the transfer in progress
+      self.isotp.send(b"", setup_only=True)
+      return
+    if request is None:
+      return
+
+    # ready for the next request
+    self.isotp.send(b"", setup_only=True)
+    self.requests.append(request)
+    if self.can_bus.rng.random() < self.ecu.drop_rate:
+      return
+    response = self.ecu.get_response(request)
+    if response is not None:
+      self.can_bus.schedule(self.ecu.latency, partial(self._respond, request, response, self.ecu.response_pending))
+
+  def _respond(self, request: bytes, response: bytes, pending: int) -> None:
+    if pending > 0:
+      self.isotp.send(bytes([0x7F, request[0], RESPONSE_PENDING_CODE]))
+      self.can_bus.schedule(self.ecu.latency, partial(self._respond, request, response, pending - 1))
+    else:
+      self.isotp.send(response)
+
+
+class VirtualCanBus:
+  """
+  Connects the queries to virtual ECUs. can_recv(wait_for_one=True) returns one packet, like pandad does at 100 Hz:
+  the frames received by the next poll_period, or as soon as one is. traffic is sent every traffic_period,
+  for CAN fingerprinting.
+  """
+  def __init__(self, ecus: list[VirtualEcu], traffic: list[CanData] | None = None, traffic_period: float = 0.01,
+               poll_period: float = 0.01, obd_multiplexing_delay: float = 0.05, seed: int = 0):
+    self.now = 0.
+    self.poll_period = poll_period
+    self.obd_multiplexing = False
+    # the 10Hz blocking params loop adds on average 50ms for each OBD multiplexing change
+    self.obd_multiplexing_delay = obd_multiplexing_delay
+    self.rng = random.Random(seed)
+    self.events: list[tuple[float, int, Callable[[], None]]] = []
+    self.event_count = 0
+    self.rx_frames: list[CanData] = []
+    self.tx_frames: list[CanData] = []
+
+    self.endpoints: dict[tuple[int, int], list[_EcuEndpoint]] = defaultdict(list)
+    for ecu in ecus:
+      self.add_ecu(ecu)
+
+    if traffic:
+      self._send_traffic(traffic, traffic_period)
+
+  def __enter__(self) -> 'VirtualCanBus':
+    self._monotonic, self._sleep = time.monotonic, time.sleep
+    time.monotonic, time.sleep = self.monotonic, self.sleep
+    return self
+
+  def __exit__(self, *args) -> None:
+    time.monotonic, time.sleep = self._monotonic, self._sleep
+
+  def add_ecu(self, ecu: VirtualEcu) -> None:
+    endpoint = _EcuEndpoint(self, ecu)
+    self.endpoints[(ecu.bus, ecu.addr)].append(endpoint)
+    # OBD-II ECUs also answer functional requests
+    if 0x7E0 <= ecu.addr <= 0x7E7:
+      self.endpoints[(ecu.bus, uds.FUNCTIONAL_ADDRS[0])].append(endpoint)
+    elif ecu.addr & 0xFFFF00FF == 0x18DA00F1:
+      self.endpoints[(ecu.bus, uds.FUNCTIONAL_ADDRS[1])].append(endpoint)
+
+  def requests(self, ecu: VirtualEcu) -> list[bytes]:
+    """Requests the ECU has received"""
+    return next(endpoint.requests for endpoint in self.endpoints[(ecu.bus, ecu.addr)] if endpoint.ecu is ecu)
+
+  def monotonic(self) -> float:
+    return self.now
+
+  def sleep(self, seconds: float) -> None:
+    self._run_until(self.now + seconds)
+
+  def schedule(self, delay: float, callback: Callable[[], None]) -> None:
+    heapq.heappush(self.events, (self.now + delay, self.event_count, callback))
+    self.event_count += 1
+
+  def schedule_frame(self, addr: int, dat: bytes, bus: int, delay: float = 0) -> None:
+    self.schedule(delay, partial(self._receive, [CanData(addr, dat, bus)]))
+
+  def _receive(self, msgs: list[CanData]) -> None:
+    self.rx_frames.extend(msgs)
+
+  def _send_traffic(self, traffic: list[CanData], period: float) -> None:
+    self._receive(traffic)
+    self.schedule(period, partial(self._send_traffic, traffic, period))
+
+  def _run_until(self, end_time: float, stop_on_rx: bool = False) -> None:
+    while self.events and self.events[0][0] <= end_time:
+      event_time, _, callback = heapq.heappop(self.events)
+      self.now = max(self.now, event_time)
+      callback()
+      if stop_on_rx and self.rx_frames:
+        return
+    self.now = max(self.now, end_time)
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    for msg in msgs:
+      self.tx_frames.append(msg)
+      for endpoint in self.endpoints.get((msg.src, msg.address), []):
+        ecu = endpoint.ecu
+        if ecu.obd_multiplexing is not None and ecu.obd_multiplexing != self.obd_multiplexing:
+          continue
+        if ecu.sub_addr is not None and msg.dat[:1] != bytes([ecu.sub_addr]):
+          continue
+        endpoint.on_frame(msg.dat)
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    self._run_until(self.now)
+    if wait_for_one and not self.rx_frames:
+      self._run_until(self.now + self.poll_period, stop_on_rx=True)
+    elif not self.rx_frames:
+      return []
+
+    packet, self.rx_frames = self.rx_frames, []
+    return [packet]
+
+  def set_obd_multiplexing(self, obd_multiplexing: bool) -> None:
+    if obd_multiplexing != self.obd_multiplexing:
+      self.obd_multiplexing = obd_multiplexing
+      self.sleep(self.obd_multiplexing_delay)
+
+
+def get_virtual_ecus(car_model: str, vin: str | None = None, rng: random.Random | None = None, **kwargs) -> list[VirtualEcu]:
+  """
+  ECUs of a platform answering its brand's FW queries, on every bus the queries reach them. Each answers with the first
+  FW version of its ECU in FW_VERSIONS, or a random one with rng, on the response offset of the first query to it.
+  With a VIN, the engine answers the OBD-II VIN queries. kwargs are passed to every VirtualEcu.
+  """
+  config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[car_model]]
+  ecus: dict[tuple[int, bool | None, int, int | None], VirtualEcu] = {}
+
+  def get_ecu(bus: int, obd_multiplexing: bool, addr: int, sub_addr: int | None, rx_offset: int) -> VirtualEcu:
+    obd_multiplexing = obd_multiplexing if bus % 4 == 1 else None
+    key = (bus, obd_multiplexing, addr, sub_addr)
+    if key not in ecus:
+      ecus[key] = VirtualEcu(bus, addr, sub_addr, rx_offset, obd_multiplexing=obd_multiplexing, **kwargs)
+    return ecus[key]
+
+  for (ecu_type, addr, sub_addr), versions in FW_VERSIONS[car_model].items():
+    version = versions[0] if rng is None else rng.choice(versions)
+    for r in config.requests:
+      if len(r.whitelist_ecus) and ecu_type not in r.whitelist_ecus:
+        continue
+
+      ecu = get_ecu(r.bus, r.obd_multiplexing, addr, sub_addr, r.rx_offset)
+      # an ECU responds on one address, queries expecting another time out
+      if ecu.rx_offset != r.rx_offset:
+        continue
+      for request, response in zip(r.request[:-1], r.response[:-1], strict=True):
+        ecu.responses.setdefault(request, response)
+      ecu.responses[r.request[-1]] = r.response[-1] + version
+
+  if vin is not None:
+    ecu = get_ecu(1, True, 0x7E0, None, 0x8)
+    ecu.responses[StdQueries.UDS_VIN_REQUEST] = StdQueries.UDS_VIN_RESPONSE + vin.encode()
+    ecu.responses[StdQueries.OBD_VIN_REQUEST] = StdQueries.OBD_VIN_RESPONSE + vin.encode()
+
+  return list(ecus.values())
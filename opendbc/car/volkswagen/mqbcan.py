@@ -1,4 +1,7 @@
-from opendbc.car.crc import CRC8H2F
+from opendbc.car.crc import Crc
+
+# AUTOSAR CRC8 H2F, followed by a per-message, per-counter magic byte
+VOLKSWAGEN_MQB_MEB_CRC = Crc(8, 0x2F, init=0xFF, xor_out=0xFF)
 
 
 def create_steering_control(packer, bus, apply_torque, lkas_enabled):
@@ -173,16 +176,11 @@ def create_aeb_hud(packer, aeb_supported, fcw_active):
 
 
 def volkswagen_mqb_meb_checksum(address: int, sig, d: bytearray) -> int:
-  crc = 0xFF
-  for i in range(1, len(d)):
-    crc ^= d[i]
-    crc = CRC8H2F[crc]
-  counter = d[1] & 0x0F
+  crc = VOLKSWAGEN_MQB_MEB_CRC.update(VOLKSWAGEN_MQB_MEB_CRC.init, d, 1)
   const = VOLKSWAGEN_MQB_MEB_CONSTANTS.get(address)
   if const:
-    crc ^= const[counter]
-    crc = CRC8H2F[crc]
-  return crc ^ 0xFF
+    crc = VOLKSWAGEN_MQB_MEB_CRC.update_byte(crc, const[d[1] & 0x0F])
+  return VOLKSWAGEN_MQB_MEB_CRC.finish(crc)
 
 
 def xor_checksum(address: int, sig, d: bytearray, initial_value: int = 0) -> int: